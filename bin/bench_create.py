@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""Compare the CPU time of duplicate uploads with and without upserts.
+
+usage: PYTHONPATH=. python bin/bench_create.py [DUPLICATES SIZE]
+"""
+
+import sys
+import tempfile
+import time
+
+import sqlalchemy.exc
+
+import pbnh
+import pbnh.db
+
+
+def _exception_create(paster, data):
+    # The dedup before it was moved to INSERT ... ON CONFLICT DO NOTHING.
+    paste = paster._new_paste(data)
+    try:
+        with paster._session.begin():
+            paster._add(paste)
+    except sqlalchemy.exc.IntegrityError as exc:
+        query = paster.query(hashid=paste.hashid) or {}
+        if query["data"] != data:
+            raise pbnh.db.HashCollision(paste.hashid) from exc
+        raise pbnh.db.PasteExists(paste.hashid)
+
+
+def _bench(create, data, *, duplicates):
+    # Each upload has its own session (like each request).
+    start = time.process_time()
+    for _ in range(duplicates):
+        with pbnh.db.paster_context() as paster:
+            try:
+                create(paster, data)
+            except pbnh.db.PasteExists:
+                pass
+            else:
+                raise AssertionError("The paste was not a duplicate.")
+    return (time.process_time() - start) / duplicates * 1e6
+
+
+def main():
+    if len(sys.argv) not in {1, 3}:
+        sys.exit(__doc__.strip())
+    duplicates, size = (int(arg) for arg in sys.argv[1:] or [2000, 1024 * 1024])
+    data = bytes(range(256)) * (size // 256)
+    with tempfile.TemporaryDirectory() as tmp:
+        app = pbnh.create_app(
+            {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/bench.sqlite"}
+        )
+        with app.app_context():
+            pbnh.db.init_db()
+            with pbnh.db.paster_context() as paster:
+                paster.create(data, mime="application/octet-stream")
+            results = {
+                "IntegrityError": _bench(
+                    _exception_create, data, duplicates=duplicates
+                ),
+                "upsert": _bench(pbnh.db._Paster.create, data, duplicates=duplicates),
+            }
+            pbnh.db.dispose()
+    baseline = results["IntegrityError"]
+    for name, cpu in results.items():
+        print(f"{name}: {cpu:.0f} µs of CPU/upload ({baseline / cpu:.2f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
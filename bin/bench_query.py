@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Compare the CPU time of paste lookups through the ORM and through Core.
+
+usage: PYTHONPATH=. python bin/bench_query.py [LOOKUPS PASTES]
+"""
+
+import itertools
+import sys
+import tempfile
+import time
+
+import pbnh
+import pbnh.db
+
+
+def _orm_query(paster, *, hashid):
+    # The lookup before it was moved to a Core statement.
+    with paster._session.begin():
+        paste = (
+            paster._session.query(pbnh.db._Paste)
+            .filter(pbnh.db._Paste.hashid == hashid)
+            .first()
+        )
+        if paste:
+            return {
+                "data": paste.data,
+                "hashid": paste.hashid,
+                "ip": paste.ip,
+                "mime": paste.mime,
+                "sunset": paste.sunset,
+                "timestamp": paste.timestamp,
+            }
+    return None
+
+
+def _bench(lookup, hashids, *, lookups):
+    # Each lookup has its own session (like each request).
+    start = time.process_time()
+    for hashid in itertools.islice(itertools.cycle(hashids), lookups):
+        with pbnh.db.paster_context() as paster:
+            assert lookup(paster, hashid=hashid) is not None
+    return (time.process_time() - start) / lookups * 1e6
+
+
+def main():
+    if len(sys.argv) not in {1, 3}:
+        sys.exit(__doc__.strip())
+    lookups, pastes = (int(arg) for arg in sys.argv[1:] or [10000, 1000])
+    with tempfile.TemporaryDirectory() as tmp:
+        app = pbnh.create_app(
+            {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/bench.sqlite"}
+        )
+        with app.app_context():
+            pbnh.db.init_db()
+            with pbnh.db.paster_context() as paster:
+                hashids = [paster.create(f"paste {i}".encode()) for i in range(pastes)]
+            results = {
+                "ORM query": _bench(_orm_query, hashids, lookups=lookups),
+                "query": _bench(pbnh.db._Paster.query, hashids, lookups=lookups),
+                "exists": _bench(pbnh.db._Paster.exists, hashids, lookups=lookups),
+            }
+            pbnh.db.dispose()
+    baseline = results["ORM query"]
+    for name, cpu in results.items():
+        print(f"{name}: {cpu:.0f} µs of CPU/lookup ({baseline / cpu:.2f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Compare the throughput of following redirects with and without the fast path.
+
+usage: PYTHONPATH=. python bin/bench_redirect.py [SECONDS REDIRECTS]
+"""
+
+import itertools
+import sys
+import tempfile
+import time
+
+from sqlalchemy import delete
+
+import pbnh
+import pbnh.db
+
+
+def _bench(client, hashids, *, seconds):
+    count = 0
+    deadline = time.monotonic() + seconds
+    for hashid in itertools.cycle(hashids):
+        if time.monotonic() >= deadline:
+            break
+        response = client.get(f"/{hashid}")
+        assert response.status_code == 302
+        count += 1
+    return count / seconds
+
+
+def main():
+    if len(sys.argv) not in {1, 3}:
+        sys.exit(__doc__.strip())
+    seconds, redirects = (int(arg) for arg in sys.argv[1:] or [10, 1000])
+    with tempfile.TemporaryDirectory() as tmp:
+        app = pbnh.create_app(
+            {"SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/bench.sqlite"}
+        )
+        with app.app_context():
+            pbnh.db.init_db()
+            with pbnh.db.paster_context() as paster:
+                hashids = [
+                    paster.create(
+                        f"https://example.com/{i}".encode(),
+                        mime=pbnh.db.REDIRECT_MIME,
+                    )
+                    for i in range(redirects)
+                ]
+        client = app.test_client()
+        fast = _bench(client, hashids, seconds=seconds)
+        # Without paste_redirect rows, redirects take the generic path.
+        with app.app_context():
+            with pbnh.db._get_engine().begin() as connection:
+                connection.execute(delete(pbnh.db._PasteRedirect))
+        slow = _bench(client, hashids, seconds=seconds)
+    print(f"fast path: {fast:.0f} redirects/s")
+    print(f"generic path: {slow:.0f} redirects/s ({fast / slow:.2f}x slower)")
+
+
+if __name__ == "__main__":
+    main()
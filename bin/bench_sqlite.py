@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Compare concurrent read/write throughput of SQLite profiles.
+
+usage: PYTHONPATH=. python bin/bench_sqlite.py [SECONDS WRITERS READERS]
+"""
+
+import itertools
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import sqlalchemy.exc
+
+import pbnh
+import pbnh.db
+
+PROFILES = {
+    "untuned": {
+        "auto_vacuum": None,
+        "journal_mode": "delete",
+        "synchronous": "full",
+        "busy_timeout": None,
+        "mmap_size": None,
+        "cache_size": None,
+    },
+    "default": {},
+}
+
+
+def _bench(pragmas, *, seconds, writers, readers):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = pbnh.create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/bench.sqlite",
+                "SQLITE_PRAGMAS": pragmas,
+            }
+        )
+        with app.app_context():
+            pbnh.db.init_db()
+            with pbnh.db.paster_context() as paster:
+                hashids = [paster.create(os.urandom(4096)) for _ in range(100)]
+        counts = {"writes": 0, "reads": 0, "errors": 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + seconds
+
+        def _work(kind):
+            with app.app_context():
+                for i in itertools.count():
+                    if time.monotonic() >= deadline:
+                        break
+                    outcome = kind
+                    try:
+                        with pbnh.db.paster_context() as paster:
+                            if kind == "writes":
+                                paster.create(os.urandom(4096))
+                            else:
+                                paster.query(hashid=hashids[i % len(hashids)])
+                    except sqlalchemy.exc.OperationalError:
+                        outcome = "errors"  # e.g. "database is locked"
+                    with lock:
+                        counts[outcome] += 1
+
+        threads = [
+            threading.Thread(target=_work, args=(kind,))
+            for kind in ["writes"] * writers + ["reads"] * readers
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return {kind: count / seconds for kind, count in counts.items()}
+
+
+def main():
+    if len(sys.argv) not in {1, 4}:
+        sys.exit(__doc__.strip())
+    seconds, writers, readers = (int(arg) for arg in sys.argv[1:] or [10, 4, 4])
+    for name, pragmas in PROFILES.items():
+        rates = _bench(pragmas, seconds=seconds, writers=writers, readers=readers)
+        print(
+            f"{name}: {rates['writes']:.0f} writes/s, {rates['reads']:.0f} reads/s,"
+            f" {rates['errors']:.0f} errors/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
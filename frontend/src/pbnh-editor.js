@@ -121,4 +121,13 @@ export class PbnhEditor {
       },
     });
   }
+
+  /**
+   * Append to the document content.
+   * @param {string} text - The content to append.
+   */
+  appendValue(text) {
+    const end = this.#view.state.doc.length;
+    this.#view.dispatch({ changes: { from: end, to: end, insert: text } });
+  }
 }
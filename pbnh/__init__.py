@@ -65,18 +65,64 @@ def create_app(
     app.register_blueprint(pbnh.cli.blueprint)
     app.register_blueprint(pbnh.views.blueprint)
 
+    # Time requests (if configured).
+    import pbnh.timing
+
+    pbnh.timing.init_app(app)
+
     # Prepare the app for DB access.
     import pbnh.db
 
     pbnh.db.init_app(app)
 
+    # Keep old pastes in packs (if configured).
+    import pbnh.pack
+
+    pbnh.pack.init_app(app)
+
+    # Cache pastes (if configured).
+    import pbnh.cache
+
+    pbnh.cache.init_app(app)
+
+    # Filter out lookups of nonexistent pastes (if configured).
+    import pbnh.bloom
+
+    pbnh.bloom.init_app(app)
+
+    # Stage resumable uploads (if configured).
+    import pbnh.upload
+
+    pbnh.upload.init_app(app)
+
+    # Materialize pastes for the front proxy to serve (if configured).
+    import pbnh.sendfile
+
+    pbnh.sendfile.init_app(app)
+
+    # Start writing pastes in batches (if configured).
+    import pbnh.ingest
+
+    pbnh.ingest.init_app(app)
+
+    # Start rendering markup in worker processes (if configured).
+    import pbnh.render
+
+    pbnh.render.init_app(app)
+
+    # Start moving old pastes into packs on a schedule (if configured).
+    import pbnh.tier
+
+    pbnh.tier.init_app(app)
+
     # Ensure the DB is accessible.
     while check_db:
 
         with app.app_context():
             try:
-                with pbnh.db.paster_context() as paster:
-                    paster.query(hashid="Has the database been initialized?")
+                version = pbnh.db.db_version()
+                if version is None:
+                    raise pbnh.db.PasteDBError("The database is not initialized.")
             except Exception as exc:
                 app.logger.error(exc)
                 secs = 10
@@ -86,5 +132,12 @@ def create_app(
                 time.sleep(secs)
             else:
                 check_db = False
+                if version != pbnh.db.SCHEMA_VERSION:
+                    # Retrying won't help (and the DB can be migrated online).
+                    app.logger.warning(
+                        f"The database schema is at version {version}"
+                        f" (instead of {pbnh.db.SCHEMA_VERSION})."
+                        " Run `flask db upgrade` to migrate it."
+                    )
 
     return app
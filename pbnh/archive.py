@@ -0,0 +1,129 @@
+"""Index and extract members of archives (zip and uncompressed tar).
+
+An index records where the data of every member (regular file) is stored,
+which allows a member to be read by seeking to it and decompressing (if
+needed) only its data, instead of all of a (potentially huge) archive.
+Compressed tarballs (e.g. .tar.gz) can't be indexed, since they can only be
+read from the start.
+"""
+
+import io
+import struct
+import tarfile
+import zipfile
+import zlib
+from collections.abc import Callable, Iterable, Iterator
+from typing import Any
+
+INDEX_KIND = "archive"
+EXTENSIONS = {"tar", "zip"}
+STORED = zipfile.ZIP_STORED
+DEFLATED = zipfile.ZIP_DEFLATED
+
+# (signature, version, flags, method, time, date, CRC-32, sizes, name length,
+# and extra field length)
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+_ZIP_LOCAL_SIGNATURE = b"PK\x03\x04"
+# Data is decompressed in blocks of (at most) this many bytes.
+_BLOCK_SIZE = 256 * 1024
+
+
+class ArchiveError(ValueError):
+    """The data is not a usable archive."""
+
+
+def _zip_members(data: bytes) -> dict[str, dict[str, Any]]:
+    members = {}
+    with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+        for info in zip_file.infolist():
+            if info.is_dir():
+                continue
+            # The central directory doesn't say where the data starts,
+            # so skip the member's local header (which can differ from it).
+            fields = _ZIP_LOCAL_HEADER.unpack_from(data, info.header_offset)
+            if fields[0] != _ZIP_LOCAL_SIGNATURE:
+                raise ArchiveError(f"The header of {info.filename} is corrupt.")
+            members[info.filename] = {
+                "offset": info.header_offset
+                + _ZIP_LOCAL_HEADER.size
+                + fields[-2]  # the name
+                + fields[-1],  # the extra field
+                "size": info.file_size,
+                "stored_size": info.compress_size,
+                # Encrypted members can't be extracted.
+                "method": None if info.flag_bits & 0x1 else info.compress_type,
+            }
+    return members
+
+
+def _tar_members(data: bytes) -> dict[str, dict[str, Any]]:
+    # Only uncompressed tarballs (":") can be seeked into.
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r:") as tar_file:
+        return {
+            info.name: {
+                "offset": info.offset_data,
+                "size": info.size,
+                "stored_size": info.size,
+                "method": STORED,
+            }
+            for info in tar_file
+            if info.isfile()
+        }
+
+
+def build_index(data: bytes) -> dict[str, Any]:
+    """Build a member index of a zip or (uncompressed) tar archive."""
+    try:
+        if zipfile.is_zipfile(io.BytesIO(data)):
+            archive_format, members = "zip", _zip_members(data)
+        else:
+            archive_format, members = "tar", _tar_members(data)
+    except (zipfile.BadZipFile, tarfile.TarError, struct.error) as exc:
+        raise ArchiveError(
+            f"It is not a zip or (uncompressed) tar file ({exc})."
+        ) from exc
+    for name, member in members.items():
+        if member["offset"] + member["stored_size"] > len(data):
+            raise ArchiveError(f"The data of {name} is truncated.")
+    return {"format": archive_format, "members": members}
+
+
+def _inflate(chunks: Iterable[bytes], *, start: int, stop: int) -> Iterator[bytes]:
+    # Deflated data can only be decompressed from the start of the member.
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    position = 0
+    for chunk in chunks:
+        while chunk and position < stop:
+            try:
+                block = decompressor.decompress(chunk, _BLOCK_SIZE)
+            except zlib.error as exc:
+                raise ArchiveError(f"The member is corrupt ({exc}).") from exc
+            chunk = decompressor.unconsumed_tail
+            if part := block[max(start - position, 0) : stop - position]:
+                yield part
+            position += len(block)
+
+
+def read_member(
+    read: Callable[[int, int], Iterable[bytes]],
+    member: dict[str, Any],
+    *,
+    start: int = 0,
+    stop: int | None = None,
+) -> Iterator[bytes]:
+    """Read bytes start:stop of a member (in chunks).
+
+    read is called with the start and stop offsets of the archive to read.
+    """
+    offset = member["offset"]
+    if stop is None:
+        stop = member["size"]
+    if member["method"] == STORED:
+        return iter(read(offset + start, offset + stop))
+    if member["method"] != DEFLATED:
+        raise ArchiveError(
+            "The member is encrypted (or compressed with an unsupported method)."
+        )
+    return _inflate(
+        read(offset, offset + member["stored_size"]), start=start, stop=stop
+    )
@@ -0,0 +1,133 @@
+"""Index and slice asciicasts (https://docs.asciinema.org/manual/asciicast/v2/).
+
+An index records the absolute time of an event every CHECKPOINT_BYTES or so,
+which allows a time range to be sliced out of a (potentially huge) recording
+by reading (and parsing) only the events between the nearest checkpoints.
+"""
+
+import bisect
+import json
+import math
+from collections.abc import Iterator
+from typing import Any
+
+CHECKPOINT_BYTES = 64 * 1024
+INDEX_KIND = "asciicast"
+
+
+class AsciicastError(ValueError):
+    """The data is not a usable asciicast."""
+
+
+def _event_lines(data: bytes, offset: int) -> Iterator[tuple[int, bytes]]:
+    while offset < len(data):
+        end = data.find(b"\n", offset)
+        if end < 0:
+            end = len(data)
+        line = data[offset:end].strip()
+        # asciicast v3 allows comments.
+        if line and not line.startswith(b"#"):
+            yield offset, line
+        offset = end + 1
+
+
+def _event_time(line: bytes) -> float:
+    # Only the time is needed, so avoid decoding the whole event.
+    try:
+        return float(line[1 : line.index(b",")])
+    except ValueError as exc:
+        raise AsciicastError(f"{line[:80]!r} is not a valid event.") from exc
+
+
+def _header(data: bytes) -> tuple[dict[str, Any], int]:
+    header_end = data.find(b"\n")
+    if header_end < 0:
+        header_end = len(data)
+    try:
+        header = json.loads(data[:header_end])
+    except ValueError as exc:
+        raise AsciicastError("The header is not valid JSON.") from exc
+    if not isinstance(header, dict) or header.get("version") not in {2, 3}:
+        raise AsciicastError("Only asciicast v2 and v3 are supported.")
+    return header, header_end + 1
+
+
+def build_index(data: bytes) -> dict[str, Any]:
+    """Build an index of an asciicast."""
+    header, header_end = _header(data)
+    relative = header["version"] >= 3  # v3 event times are intervals.
+    checkpoints: list[tuple[float, int]] = []
+    elapsed = 0.0
+    for offset, line in _event_lines(data, header_end):
+        time = _event_time(line)
+        elapsed = elapsed + time if relative else time
+        if not checkpoints or offset - checkpoints[-1][1] >= CHECKPOINT_BYTES:
+            checkpoints.append((elapsed, offset))
+    return {
+        "version": header["version"],
+        "header_end": header_end,
+        "checkpoints": checkpoints,
+    }
+
+
+def window(
+    index: dict[str, Any], *, start: float = 0.0, end: float = math.inf
+) -> tuple[int, int | None]:
+    """Get the byte range of an asciicast that holds the events from start to end.
+
+    The range runs from the checkpoint at/before start to the first one after
+    end (or the end of the asciicast, if the stop is None).
+    """
+    checkpoints = index["checkpoints"]
+    if not checkpoints:
+        return index["header_end"], index["header_end"]
+    times = [t for t, _ in checkpoints]
+    first = max(bisect.bisect_right(times, start) - 1, 0)
+    last = bisect.bisect_right(times, end)
+    return checkpoints[first][1], (
+        checkpoints[last][1] if last < len(checkpoints) else None
+    )
+
+
+def trim(
+    header_data: bytes,
+    events_data: bytes,
+    index: dict[str, Any],
+    *,
+    start: float = 0.0,
+    end: float = math.inf,
+) -> bytes:
+    """Get the events of an asciicast between start and end (in seconds).
+
+    Only the header (the bytes before index["header_end"]) and the events in
+    the window for the time range (see window) are needed.
+    Event times are shifted so that the trimmed asciicast begins at start.
+    """
+    header, _ = _header(header_data)
+    relative = index["version"] >= 3
+    checkpoints = index["checkpoints"]
+    # The window begins at the last checkpoint at/before start.
+    position = max(bisect.bisect_right([t for t, _ in checkpoints], start) - 1, 0)
+    lines: list[bytes] = []
+    if checkpoints:
+        elapsed = checkpoints[position][0]
+        first = True
+        for _, line in _event_lines(events_data, 0):
+            time = _event_time(line)
+            if not first:
+                elapsed = elapsed + time if relative else time
+            first = False
+            if elapsed < start:
+                continue
+            if elapsed > end:
+                break
+            if relative and lines:
+                # Subsequent intervals are unaffected by trimming.
+                lines.append(line)
+                continue
+            event = json.loads(line)
+            event[0] = round(elapsed - start, 6)
+            lines.append(json.dumps(event).encode())
+    if "duration" in header:
+        header["duration"] = round(max(min(header["duration"], end) - start, 0), 6)
+    return b"\n".join([json.dumps(header).encode(), *lines]) + b"\n"
@@ -0,0 +1,246 @@
+"""Answer lookups of nonexistent pastes without the DB (with a Bloom filter).
+
+When PASTE_FILTER_BYTES is set, each worker keeps a Bloom filter of that
+many bytes over the hashids of every paste (including packed pastes), which a
+thread builds (from a scan of just the hashids) at startup and rebuilds every
+PASTE_FILTER_REBUILD seconds. In between, pastes created since the last scan
+are added every PASTE_FILTER_REFRESH seconds (and pastes created by the worker
+itself are added immediately). Pastes created by other workers since the last
+scan aren't in the filter yet, so before a miss is trusted, the filter catches
+up with a scan of just the ids of newer pastes (which concurrent misses share).
+Lookups of hashids that are still not in the filter then 404 without fetching
+the paste.
+
+Removed pastes can't be taken out of a Bloom filter, so they are only
+false positives (which are looked up in the DB) until the next rebuild.
+"""
+
+import atexit
+import hashlib
+import math
+import threading
+import time
+from collections.abc import Iterator
+
+from flask import Flask, current_app
+
+from pbnh import db, pack
+
+EXTENSION = "pbnh.bloom"
+REFRESH_DEFAULT = 10.0  # seconds
+REBUILD_DEFAULT = 3600.0  # seconds
+MAX_HASHES = 16
+_PAGE_SIZE = 10000
+
+
+class BloomFilter:
+    """A Bloom filter (of strings) in a fixed number of bytes."""
+
+    def __init__(self, size: int, *, hashes: int) -> None:
+        self._bits = bytearray(size)
+        self._bit_count = size * 8
+        self.hashes = hashes
+        self.added = 0
+
+    @classmethod
+    def for_items(cls, size: int, *, items: int) -> "BloomFilter":
+        """Create a filter with the best number of hashes for some items."""
+        hashes = round(size * 8 / max(items, 1) * math.log(2))
+        return cls(size, hashes=min(max(hashes, 1), MAX_HASHES))
+
+    def _positions(self, key: str) -> Iterator[int]:
+        # Double hashing simulates any number of hashes with two.
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8]), int.from_bytes(digest[8:])
+        return ((first + i * second) % self._bit_count for i in range(self.hashes))
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.added += 1
+
+    def __contains__(self, key: str) -> bool:
+        return all(
+            self._bits[position >> 3] & 1 << (position & 7)
+            for position in self._positions(key)
+        )
+
+    def false_positive_rate(self) -> float:
+        """Estimate the false positive rate (from the number of keys added)."""
+        return float(
+            (1 - math.exp(-self.hashes * self.added / self._bit_count)) ** self.hashes
+        )
+
+
+class PasteFilter:
+    """Keep a Bloom filter of the hashids of pastes (with a thread)."""
+
+    def __init__(
+        self,
+        app: Flask,
+        *,
+        size: int,
+        refresh: float = REFRESH_DEFAULT,
+        rebuild: float = REBUILD_DEFAULT,
+    ) -> None:
+        self._app = app
+        self._size = size
+        self._refresh_interval = refresh
+        self._rebuild_interval = rebuild
+        self._filter: BloomFilter | None = None  # (until it is built)
+        self._building: BloomFilter | None = None
+        self._rebuild_at = 0.0  # (monotonic time)
+        # The highest ids scanned by the last two scans: Each refresh scans
+        # from the older one, since ids aren't committed in order.
+        self._scanned = (0, 0)
+        self._lock = threading.Lock()
+        self._catch_up_lock = threading.Lock()
+        # The filter the last catch-up scanned into (and when it started).
+        self._caught_up: tuple[BloomFilter | None, float] = (None, 0.0)
+        self._stats = dict.fromkeys(
+            (
+                "negatives",
+                "false_positives",
+                "rebuilds",
+                "refreshes",
+                "catch_ups",
+                "failures",
+            ),
+            0,
+        )
+        self._rebuild_seconds = 0.0
+        self._built = threading.Event()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._stats[key] += 1
+
+    def wait(self, timeout: float | None = None) -> bool:
+        """Wait for the filter to be built (and get whether it was)."""
+        return self._built.wait(timeout)
+
+    def might_contain(self, hashid: str) -> bool:
+        """Get whether a paste might exist (False means it definitely doesn't)."""
+        if (bloom_filter := self._filter) is None or hashid in bloom_filter:
+            return True
+        # It may have been created by another worker since the last scan.
+        self._catch_up(bloom_filter, since=time.monotonic())
+        if hashid in bloom_filter:
+            return True
+        self._count("negatives")
+        return False
+
+    def _catch_up(self, bloom_filter: BloomFilter, *, since: float) -> None:
+        with self._catch_up_lock:
+            # A catch-up that started after the miss covers it too.
+            if self._caught_up[0] is bloom_filter and self._caught_up[1] >= since:
+                return
+            start = time.monotonic()
+            with self._app.app_context():
+                self._scan(bloom_filter, after_id=self._scanned[0])
+            self._caught_up = (bloom_filter, start)
+        self._count("catch_ups")
+
+    def false_positive(self) -> None:
+        """Count a paste that might have existed (but didn't)."""
+        if self._filter is not None:
+            self._count("false_positives")
+
+    def add(self, hashid: str) -> None:
+        """Add a paste (e.g. when it is created)."""
+        with self._lock:
+            for bloom_filter in (self._filter, self._building):
+                if bloom_filter is not None:
+                    bloom_filter.add(hashid)
+
+    def _scan(self, bloom_filter: BloomFilter, *, after_id: int) -> int:
+        with db.paster_context() as paster:
+            # (Each page is read in a transaction of its own.)
+            while page := paster.scan_hashids(after_id=after_id, limit=_PAGE_SIZE):
+                with self._lock:
+                    for _, hashid in page:
+                        bloom_filter.add(hashid)
+                after_id = page[-1][0]
+        return after_id
+
+    def _rebuild(self) -> None:
+        start = time.monotonic()
+        with db.paster_context() as paster:
+            # The highest id is (at least) the number of pastes.
+            items = paster.last_id()
+        self._building = BloomFilter.for_items(self._size, items=items)
+        try:
+            scanned = self._scan(self._building, after_id=0)
+            if packs := pack.packs():
+                for hashid in packs.hashids():
+                    with self._lock:
+                        self._building.add(hashid)
+            with self._lock:
+                self._filter = self._building
+        finally:
+            self._building = None
+        self._scanned = (scanned, scanned)
+        self._rebuild_at = time.monotonic() + self._rebuild_interval
+        self._rebuild_seconds = time.monotonic() - start
+        self._count("rebuilds")
+        self._built.set()
+
+    def _refresh(self, bloom_filter: BloomFilter) -> None:
+        scanned = self._scan(bloom_filter, after_id=self._scanned[0])
+        self._scanned = (self._scanned[1], scanned)
+        self._count("refreshes")
+
+    def _run(self) -> None:
+        with self._app.app_context():
+            while True:
+                try:
+                    if self._filter is None or time.monotonic() >= self._rebuild_at:
+                        self._rebuild()
+                    else:
+                        self._refresh(self._filter)
+                except Exception:
+                    self._count("failures")
+                    current_app.logger.exception("The paste filter was not updated.")
+                if self._closed.wait(self._refresh_interval):
+                    return
+
+    def stats(self) -> dict[str, float]:
+        """Get the size of the filter and counts of lookups (by outcome)."""
+        bloom_filter = self._filter
+        with self._lock:
+            return {
+                "bytes": self._size,
+                "hashes": bloom_filter.hashes if bloom_filter else 0,
+                "added": bloom_filter.added if bloom_filter else 0,
+                "estimated_false_positive_rate": (
+                    bloom_filter.false_positive_rate() if bloom_filter else 1.0
+                ),
+                "rebuild_seconds": self._rebuild_seconds,
+                **self._stats,
+            }
+
+    def close(self) -> None:
+        """Stop updating the filter."""
+        self._closed.set()
+        self._thread.join()
+
+
+def init_app(app: Flask) -> None:
+    """Start a paste filter for the app (if PASTE_FILTER_BYTES is set)."""
+    if size := app.config.get("PASTE_FILTER_BYTES"):
+        paste_filter = PasteFilter(
+            app,
+            size=size,
+            refresh=app.config.get("PASTE_FILTER_REFRESH", REFRESH_DEFAULT),
+            rebuild=app.config.get("PASTE_FILTER_REBUILD", REBUILD_DEFAULT),
+        )
+        app.extensions[EXTENSION] = paste_filter
+        atexit.register(paste_filter.close)
+
+
+def paste_filter() -> PasteFilter | None:
+    """Get the paste filter for the current app (if any)."""
+    return current_app.extensions.get(EXTENSION)
@@ -0,0 +1,279 @@
+"""Cache pastes (and renders of them) in a backend that workers can share.
+
+CACHE_URL selects the backend:
+
+- memory://?max_items=1000: an LRU cache in each worker process.
+  Note: Pastes removed by `flask paste remove` stay cached (until they expire).
+- file:///var/cache/pbnh: files in a directory (shared by the workers on a host).
+- memcached://localhost:11211: a memcached server (shared by every host).
+
+Entries expire after CACHE_TTL seconds (or at the paste's sunset, if sooner),
+and only pastes of at most CACHE_MAX_BYTES are cached. The backend is
+consulted before the DB, so any failure of it is logged and treated as a miss.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import socket
+import struct
+import threading
+import time
+import urllib.parse
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from flask import Flask, current_app
+
+from pbnh import timing
+
+EXTENSION = "pbnh.cache"
+TTL_DEFAULT = 3600  # seconds
+MAX_BYTES_DEFAULT = 1024 * 1024
+
+
+class CacheError(Exception):
+    pass
+
+
+class MemoryCache:
+    """Cache values in this process (evicting the least recently used)."""
+
+    def __init__(self, *, max_items: int = 1000) -> None:
+        self._max_items = max_items
+        self._items: collections.OrderedDict[str, tuple[float, bytes]] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            try:
+                expires, value = self._items[key]
+            except KeyError:
+                return None
+            if expires <= time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, *, ttl: int) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._items.pop(key, None)
+
+
+class FileCache:
+    """Cache values in files (which processes on the same host can share)."""
+
+    _EXPIRES = struct.Struct(">d")  # (UNIX) time
+
+    def __init__(self, *, directory: str) -> None:
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, key: str) -> Path:
+        return (
+            self._directory
+            / hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest()
+        )
+
+    def get(self, key: str) -> bytes | None:
+        path = self._path(key)
+        try:
+            entry = path.read_bytes()
+        except FileNotFoundError:
+            return None
+        (expires,) = self._EXPIRES.unpack_from(entry)
+        if expires <= time.time():
+            path.unlink(missing_ok=True)
+            return None
+        return entry[self._EXPIRES.size :]
+
+    def set(self, key: str, value: bytes, *, ttl: int) -> None:
+        path = self._path(key)
+        # Write a temporary file first (so readers never see a partial entry).
+        temp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}")
+        temp_path.write_bytes(self._EXPIRES.pack(time.time() + ttl) + value)
+        temp_path.replace(path)
+
+    def delete(self, key: str) -> None:
+        self._path(key).unlink(missing_ok=True)
+
+
+class MemcachedCache:
+    """Cache values in a memcached server (with its text protocol)."""
+
+    # memcached treats larger TTLs as UNIX times.
+    MAX_TTL = 30 * 24 * 60 * 60
+
+    def __init__(self, *, host: str, port: int = 11211, timeout: float = 1.0) -> None:
+        self._address = (host, port)
+        self._timeout = timeout
+        self._local = threading.local()  # one connection per thread
+
+    def _call(self, command: bytes, value: bytes | None = None) -> tuple[bytes, Any]:
+        if getattr(self._local, "reader", None) is None:
+            connection = socket.create_connection(self._address, self._timeout)
+            self._local.connection = connection
+            self._local.reader = connection.makefile("rb")
+        try:
+            request = command + b"\r\n"
+            if value is not None:
+                request += value + b"\r\n"
+            self._local.connection.sendall(request)
+            return self._local.reader.readline().rstrip(b"\r\n"), self._local.reader
+        except OSError:
+            self._close()
+            raise
+
+    def _close(self) -> None:
+        self._local.reader.close()
+        self._local.connection.close()
+        self._local.reader = None
+
+    @staticmethod
+    def _key(key: str) -> bytes:
+        # Keys can't contain spaces (or be longer than 250 bytes).
+        return (
+            b"pbnh:"
+            + hashlib.sha1(key.encode(), usedforsecurity=False).hexdigest().encode()
+        )
+
+    def _check(self, response: bytes, *expected: bytes) -> None:
+        if response not in expected:
+            self._close()  # The connection may be out of sync.
+            raise CacheError(f"memcached responded with {response!r}.")
+
+    def get(self, key: str) -> bytes | None:
+        response, reader = self._call(b"get " + self._key(key))
+        if response == b"END":
+            return None
+        if not response.startswith(b"VALUE "):
+            self._check(response)
+        length = int(response.rsplit(b" ", 1)[1])
+        value: bytes = reader.read(length + 2)[:length]
+        self._check(reader.readline().rstrip(b"\r\n"), b"END")
+        return value
+
+    def set(self, key: str, value: bytes, *, ttl: int) -> None:
+        response, _ = self._call(
+            b"set %s 0 %d %d" % (self._key(key), min(ttl, self.MAX_TTL), len(value)),
+            value,
+        )
+        self._check(response, b"STORED")
+
+    def delete(self, key: str) -> None:
+        response, _ = self._call(b"delete " + self._key(key))
+        self._check(response, b"DELETED", b"NOT_FOUND")
+
+
+Backend = MemoryCache | FileCache | MemcachedCache
+
+
+def _backend(url: str) -> Backend:
+    parts = urllib.parse.urlsplit(url)
+    params = dict(urllib.parse.parse_qsl(parts.query))
+    if parts.scheme == "memory":
+        return MemoryCache(max_items=int(params.get("max_items", 1000)))
+    if parts.scheme == "file":
+        return FileCache(directory=parts.path)
+    if parts.scheme == "memcached" and parts.hostname:
+        return MemcachedCache(host=parts.hostname, port=parts.port or 11211)
+    raise ValueError(f"{url} is not a supported CACHE_URL.")
+
+
+def init_app(app: Flask) -> None:
+    """Set up a cache for the app (if CACHE_URL is set)."""
+    if url := app.config.get("CACHE_URL"):
+        app.extensions[EXTENSION] = _backend(url)
+
+
+def get(key: str) -> bytes | None:
+    """Get a cached value (or None if it is not cached)."""
+    backend: Backend | None = current_app.extensions.get(EXTENSION)
+    if backend is None:
+        return None
+    try:
+        with timing.phase("cache"):
+            return backend.get(key)
+    except (CacheError, OSError) as exc:
+        current_app.logger.warning(f"The cache could not be read ({exc}).")
+        return None
+
+
+def set(key: str, value: bytes, *, sunset: datetime | None = None) -> None:
+    """Cache a value (until CACHE_TTL seconds pass or the sunset, if sooner)."""
+    backend: Backend | None = current_app.extensions.get(EXTENSION)
+    if backend is None:
+        return
+    if len(value) > current_app.config.get("CACHE_MAX_BYTES", MAX_BYTES_DEFAULT):
+        return
+    ttl = current_app.config.get("CACHE_TTL", TTL_DEFAULT)
+    if sunset:
+        # The DB returns naive timestamps (in UTC).
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        ttl = min(ttl, int((sunset - now).total_seconds()))
+    if ttl <= 0:
+        return
+    try:
+        with timing.phase("cache"):
+            backend.set(key, value, ttl=ttl)
+    except (CacheError, OSError) as exc:
+        current_app.logger.warning(f"The cache could not be written ({exc}).")
+
+
+def delete(key: str) -> None:
+    """Remove a value from the cache (e.g. when a paste is removed)."""
+    backend: Backend | None = current_app.extensions.get(EXTENSION)
+    if backend is None:
+        return
+    try:
+        with timing.phase("cache"):
+            backend.delete(key)
+    except (CacheError, OSError) as exc:
+        current_app.logger.warning(f"The cache could not be written ({exc}).")
+
+
+def _paste_key(hashid: str) -> str:
+    return f"paste/{hashid}"
+
+
+def get_paste(hashid: str) -> dict[str, Any] | None:
+    """Get a cached paste (or None if it is not cached)."""
+    if (entry := get(_paste_key(hashid))) is None:
+        return None
+    metadata, data = entry.split(b"\n", 1)
+    paste: dict[str, Any] = json.loads(metadata)
+    for key in ("sunset", "timestamp"):
+        if paste[key]:
+            paste[key] = datetime.fromisoformat(paste[key])
+    return {**paste, "data": data}
+
+
+def set_paste(paste: dict[str, Any]) -> None:
+    """Cache a paste (with its data)."""
+    # JSON never contains a raw newline, so it separates the metadata and data.
+    metadata = json.dumps(
+        {key: value for key, value in paste.items() if key != "data"},
+        default=datetime.isoformat,
+    ).encode()
+    set(
+        _paste_key(paste["hashid"]),
+        metadata + b"\n" + paste["data"],
+        sunset=paste["sunset"],
+    )
+
+
+def delete_paste(hashid: str) -> None:
+    """Remove a paste from the cache."""
+    delete(_paste_key(hashid))
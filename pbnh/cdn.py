@@ -0,0 +1,40 @@
+import urllib.parse
+import urllib.request
+
+from flask import current_app
+
+
+class CDNPurgeError(Exception):
+    """A CDN purge request failed."""
+
+
+def purge(hashid: str) -> bool:
+    """Ask the CDN to purge any cached responses for a paste.
+
+    CDN_PURGE_URL is formatted with the (quoted) hashid, which is also sent
+    as a Surrogate-Key header (matching the one set on cached responses).
+    Return whether a purge was requested (i.e. whether purging is configured).
+    """
+    try:
+        url_template = current_app.config["CDN_PURGE_URL"]
+    except KeyError:
+        return False
+    url = url_template.format(hashid=urllib.parse.quote(hashid, safe=""))
+    if urllib.parse.urlsplit(url).scheme not in {"http", "https"}:
+        raise CDNPurgeError(f"CDN_PURGE_URL must be an HTTP(S) URL (not {url}).")
+    purge_request = urllib.request.Request(
+        url,
+        headers={
+            "Surrogate-Key": hashid,
+            **current_app.config.get("CDN_PURGE_HEADERS", {}),
+        },
+        method=current_app.config.get("CDN_PURGE_METHOD", "PURGE"),
+    )
+    timeout = current_app.config.get("CDN_PURGE_TIMEOUT", 10)
+    try:
+        # The scheme is checked above.
+        with urllib.request.urlopen(purge_request, timeout=timeout):  # nosec B310
+            pass
+    except OSError as exc:  # This includes URLError and HTTPError.
+        raise CDNPurgeError(f"{hashid} could not be purged ({exc}).") from exc
+    return True
@@ -1,9 +1,24 @@
+import contextlib
+import functools
 import hashlib
+import itertools
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
 
 import click
-from flask import Blueprint
+from flask import Blueprint, current_app
 
+import pbnh.cache
+import pbnh.cdn
 import pbnh.db
+import pbnh.loadtest
+import pbnh.pack
+import pbnh.scrub
+import pbnh.sendfile
+import pbnh.tier
+import pbnh.upload
 
 blueprint = Blueprint("cli", __name__, cli_group=None)
 
@@ -19,6 +34,144 @@ def init() -> None:
     click.echo("initialized the database successfully")
 
 
+@db.command()
+@click.option("--to", type=int, help="the version to upgrade to (default: latest)")
+@click.option(
+    "--batch-size",
+    default=1000,
+    show_default=True,
+    help="the most rows to backfill per transaction",
+)
+def upgrade(to: int | None, batch_size: int) -> None:
+    """Migrate the database to a newer schema (online)."""
+    for message in pbnh.db.upgrade_db(to=to, batch_size=batch_size):
+        click.echo(message)
+    click.echo(f"the database is at version {pbnh.db.db_version()}")
+
+
+@db.command()
+@click.option("--to", type=int, required=True, help="the version to downgrade to")
+def downgrade(to: int) -> None:
+    """Migrate the database to an older schema."""
+    for message in pbnh.db.downgrade_db(to=to):
+        click.echo(message)
+    click.echo(f"the database is at version {pbnh.db.db_version()}")
+
+
+@db.command()
+@click.option(
+    "--vacuum-pages",
+    default=0,
+    show_default=True,
+    help="the most free pages to release (or 0 for all)",
+)
+def checkpoint(vacuum_pages: int) -> None:
+    """Compact an SQLite database (e.g. periodically)."""
+    released, completed = pbnh.db.checkpoint_db(vacuum_pages=vacuum_pages)
+    click.echo(f"released {released} free pages")
+    if completed:
+        click.echo("checkpointed the WAL")
+    else:
+        click.echo(click.style("WARNING: the WAL is busy", fg="yellow"))
+
+
+def _parse_mix(
+    ctx: click.Context, param: click.Parameter, value: str
+) -> dict[str, int]:
+    try:
+        return {
+            kind.strip(): int(weight)
+            for kind, weight in (item.split("=") for item in value.split(","))
+        }
+    except ValueError as exc:
+        raise click.BadParameter(f"{value!r} is not like KIND=WEIGHT,...") from exc
+
+
+def _parse_sizes(
+    ctx: click.Context, param: click.Parameter, value: str
+) -> tuple[int, ...]:
+    try:
+        return tuple(int(size) for size in value.split(","))
+    except ValueError as exc:
+        raise click.BadParameter(f"{value!r} is not like SIZE,...") from exc
+
+
+@blueprint.cli.group("pbnh")
+def pbnh_() -> None:
+    pass
+
+
+@pbnh_.command()
+@click.option(
+    "--url",
+    help="the pbnh to load (default: this app, with a temporary SQLite database)",
+)
+@click.option(
+    "--duration",
+    type=click.FloatRange(min=0),
+    default=10.0,
+    show_default=True,
+    help="seconds to send requests for",
+)
+@click.option(
+    "--concurrency",
+    type=click.IntRange(min=1),
+    default=8,
+    show_default=True,
+    help="the number of requests to send at once",
+)
+@click.option(
+    "--mix",
+    callback=_parse_mix,
+    default=",".join(
+        f"{kind}={weight}" for kind, weight in pbnh.loadtest.MIX_DEFAULT.items()
+    ),
+    show_default=True,
+    help=f"relative weights of kinds of requests ({', '.join(pbnh.loadtest.KINDS)})",
+)
+@click.option(
+    "--sizes",
+    callback=_parse_sizes,
+    default=",".join(map(str, pbnh.loadtest.SIZES_DEFAULT)),
+    show_default=True,
+    help="sizes (in bytes) of pastes to create",
+)
+@click.option(
+    "--count",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="the number of pastes (of each kind) to seed",
+)
+def loadtest(
+    url: str | None,
+    duration: float,
+    concurrency: int,
+    mix: dict[str, int],
+    sizes: tuple[int, ...],
+    count: int,
+) -> None:
+    """Measure throughput and latency (by kind of request) under load."""
+    with contextlib.ExitStack() as stack:
+        if url:
+            new_request = functools.partial(pbnh.loadtest.url_request, url)
+        else:
+            app = stack.enter_context(pbnh.loadtest.local_app())
+            new_request = functools.partial(pbnh.loadtest.app_request, app)
+        try:
+            report = pbnh.loadtest.run(
+                new_request,
+                mix=mix,
+                duration=duration,
+                concurrency=concurrency,
+                count=count,
+                sizes=sizes,
+            )
+        except ValueError as exc:
+            raise click.UsageError(str(exc)) from exc
+    click.echo(json.dumps(report, indent=2))
+
+
 @blueprint.cli.group()
 @click.pass_context
 def paste(ctx: click.Context) -> None:
@@ -71,6 +224,258 @@ def info(ctx: click.Context, show_data: bool, hashids: tuple[str]) -> None:
             click.echo(f"{column + ':':>15} {value}")
 
 
+@paste.command()
+@click.option(
+    "--by",
+    type=click.Choice(["ip", "mime", "day"]),
+    help="how to group pastes",
+)
+@click.option(
+    "--rebuild/--no-rebuild",
+    help="whether to recalculate stats (by scanning every paste) first",
+    default=False,
+    show_default=True,
+)
+@click.pass_context
+def stats(ctx: click.Context, by: str | None, rebuild: bool) -> None:
+    """Summarize stored pastes."""
+    if rebuild:
+        ctx.obj.data["paster"].rebuild_stats()
+    for row in ctx.obj.data["paster"].stats(by=by):
+        label = row[by] if by else "total"
+        click.echo(f"{label}: {row['count']} pastes ({row['size']} bytes)")
+
+
+@paste.command()
+@click.option("--before", type=int, help="a cursor from a previous search")
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="the page size",
+)
+@click.argument("query", type=str)
+@click.pass_context
+def search(ctx: click.Context, query: str, before: int | None, limit: int) -> None:
+    """Search text pastes."""
+    results = ctx.obj.data["paster"].search(query, before=before, limit=limit)
+    for result in results:
+        click.echo(
+            f"{result['hashid']} {result['timestamp']}"
+            f" {result['mime']} ({result['size']} bytes)"
+        )
+    if len(results) == limit:
+        click.echo(f"(for more results, use --before {results[-1]['cursor']})")
+
+
+@paste.command("clean-uploads")
+def clean_uploads() -> None:
+    """Remove abandoned uploads (see UPLOAD_TTL)."""
+    if not (uploads := pbnh.upload.uploads()):
+        raise click.UsageError("UPLOAD_DIR is not set.")
+    click.echo(f"removed {uploads.clean()} uploads")
+
+
+@paste.command("clean-files")
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help="the most pastes to look up per query",
+)
+@click.pass_context
+def clean_files(ctx: click.Context, batch_size: int) -> None:
+    """Remove the files of removed (and expired) pastes (see SENDFILE_DIR)."""
+    if not (files := pbnh.sendfile.files()):
+        raise click.UsageError("SENDFILE_DIR is not set.")
+    removed = 0
+    hashids = files.hashids()
+    while batch := list(itertools.islice(hashids, batch_size)):
+        unexpired = ctx.obj.data["paster"].unexpired(hashids=batch)
+        for hashid in set(batch) - unexpired:
+            removed += files.remove(hashid)
+    click.echo(f"removed {removed} files")
+
+
+@paste.command()
+@click.option(
+    "--older-than",
+    type=click.FloatRange(min=0),
+    help="in days  [default: PACK_TIER_AFTER or 30]",
+)
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=pbnh.tier.LIMIT_DEFAULT,
+    show_default=True,
+    help="the most pastes per pack",
+)
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="the most pastes to move per transaction",
+)
+@click.pass_context
+def tier(
+    ctx: click.Context, older_than: float | None, limit: int, batch_size: int
+) -> None:
+    """Move old pastes into packs (see PACK_DIR)."""
+    if not (packs := pbnh.pack.packs()):
+        raise click.UsageError("PACK_DIR is not set.")
+    if older_than is None:
+        older_than = current_app.config.get(
+            "PACK_TIER_AFTER", pbnh.pack.TIER_AFTER_DEFAULT
+        )
+    before = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(
+        days=older_than
+    )
+    moved = 0
+    with packs.locked("tier"):  # (so that scheduled tiers wait)
+        while result := ctx.obj.data["paster"].tier(
+            before=before, limit=limit, batch_size=batch_size
+        ):
+            name, count = result
+            moved += count
+            click.echo(f"moved {count} pastes to pack {name}")
+    click.echo(f"moved {moved} pastes")
+
+
+@paste.command()
+@click.pass_context
+def repack(ctx: click.Context) -> None:
+    """Rewrite packs without removed (or expired) pastes (see PACK_DIR)."""
+    if not (packs := pbnh.pack.packs()):
+        raise click.UsageError("PACK_DIR is not set.")
+    size = packs.stats()["bytes"]
+    kept, expired = ctx.obj.data["paster"].repack()
+    click.echo(
+        f"kept {kept} pastes ({expired} expired),"
+        f" reclaiming {size - packs.stats()['bytes']} bytes"
+    )
+
+
+@paste.command("list")
+@click.option("--before", help="a cursor from a previous page")
+@click.option(
+    "--limit",
+    type=click.IntRange(min=1),
+    default=20,
+    show_default=True,
+    help="the page size",
+)
+@click.option("--mime", help="only list pastes of this MIME type")
+@click.option("--ip", help="only list pastes from this IP address")
+@click.option("--min-size", type=click.IntRange(min=0), help="in bytes")
+@click.option("--max-size", type=click.IntRange(min=0), help="in bytes")
+@click.pass_context
+def list_(
+    ctx: click.Context,
+    before: str | None,
+    limit: int,
+    mime: str | None,
+    ip: str | None,
+    min_size: int | None,
+    max_size: int | None,
+) -> None:
+    """List pastes (newest first)."""
+    try:
+        pastes = ctx.obj.data["paster"].list(
+            before=before,
+            limit=limit,
+            mime=mime,
+            ip=ip,
+            min_size=min_size,
+            max_size=max_size,
+        )
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="--before") from exc
+    for paste in pastes:
+        click.echo(
+            f"{paste['hashid']} {paste['timestamp']} {paste['ip']}"
+            f" {paste['mime']} ({paste['size']} bytes)"
+        )
+    if len(pastes) == limit:
+        click.echo(f"(for more pastes, use --before {pastes[-1]['cursor']})")
+
+
+@paste.command()
+@click.option(
+    "--after",
+    default=0,
+    show_default=True,
+    help="the primary key to resume after",
+)
+@click.option("--batch-size", default=100, show_default=True)
+@click.pass_context
+def reindex(ctx: click.Context, after: int, batch_size: int) -> None:
+    """(Re)build the search index."""
+    while (
+        after := ctx.obj.data["paster"].reindex_search(after=after, limit=batch_size)
+    ) is not None:
+        click.echo(f"indexed pastes through {after}")
+    click.echo("indexed all pastes")
+
+
+@paste.command()
+@click.option("--after", default="", help="the hashid to start after")
+@click.option("--through", help="the last hashid to check (default: all)")
+@click.option(
+    "--checkpoint",
+    type=click.Path(dir_okay=False),
+    help="a file to save progress to (and resume from, if it exists)",
+)
+@click.option(
+    "--batch-size", type=click.IntRange(min=1), default=100, show_default=True
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="the number of processes to check with (default: one per CPU)",
+)
+@click.option(
+    "--mime/--no-mime",
+    help="whether to check that MIME types (e.g. text vs. image) match the data",
+    default=False,
+    show_default=True,
+)
+@click.pass_context
+def verify(
+    ctx: click.Context,
+    after: str,
+    through: str | None,
+    checkpoint: str | None,
+    batch_size: int,
+    jobs: int | None,
+    mime: bool,
+) -> None:
+    """Check the integrity of stored pastes (in hashid order)."""
+    if checkpoint and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            after = max(after, f.read().strip())
+        click.echo(f"resuming after {after}")
+    checked = failed = 0
+    for last, count, problems in pbnh.scrub.scrub(
+        after=after, through=through, batch_size=batch_size, jobs=jobs, mime=mime
+    ):
+        for hashid, paste_problems in problems:
+            for problem in paste_problems:
+                click.echo(click.style(f"{hashid}: {problem}", fg="yellow"))
+        checked += count
+        failed += len(problems)
+        if checkpoint:
+            with open(f"{checkpoint}.tmp", "w") as f:
+                f.write(last)
+            os.replace(f"{checkpoint}.tmp", checkpoint)
+        click.echo(f"checked pastes through {last}")
+    click.echo(f"checked {checked} pastes ({failed} with problems)")
+    if failed:
+        ctx.exit(1)
+
+
 @paste.command()
 @click.argument("hashids", type=str, nargs=-1)
 @click.pass_context
@@ -80,3 +485,104 @@ def remove(ctx: click.Context, hashids: tuple[str]) -> None:
         removed = ctx.obj.data["paster"].delete(hashid=hashid)
         message = "removed" if removed else "not found"
         click.echo(f"{hashid} {message}")
+        if removed:
+            _purge(hashid)
+
+
+@paste.command()
+@click.option("--ip", help="remove pastes from this IP address")
+@click.option("--mime", help="remove pastes of this MIME type")
+@click.option(
+    "--before",
+    type=click.DateTime(),
+    help="remove pastes created before this time (in UTC)",
+)
+@click.option(
+    "--larger-than",
+    type=click.IntRange(min=0),
+    help="remove pastes larger than this many bytes",
+)
+@click.option("--dry-run", is_flag=True, help="count the pastes instead")
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=1000,
+    show_default=True,
+    help="the most pastes to remove per transaction",
+)
+@click.option(
+    "--rate",
+    type=click.FloatRange(min=0, min_open=True),
+    help="the most pastes to remove per second  [default: unlimited]",
+)
+@click.option("--after", default=0, show_default=True, help="the id to resume after")
+@click.pass_context
+def purge(
+    ctx: click.Context,
+    ip: str | None,
+    mime: str | None,
+    before: datetime | None,
+    larger_than: int | None,
+    dry_run: bool,
+    batch_size: int,
+    rate: float | None,
+    after: int,
+) -> None:
+    """Remove every paste that matches all of the criteria."""
+    criteria = {
+        key: value
+        for key, value in {
+            "ip": ip,
+            "mime": mime,
+            "before": before,
+            "larger_than": larger_than,
+        }.items()
+        if value is not None
+    }
+    if not criteria:
+        raise click.UsageError(
+            "At least one of --ip, --mime, --before, or --larger-than is required."
+        )
+    paster = ctx.obj.data["paster"]
+    if dry_run:
+        counts = paster.count_purge(**criteria)
+        click.echo(f"would remove {counts['count']} pastes ({counts['size']} bytes)")
+        return
+    removed = 0
+    packed = True
+    # Small batches keep transactions (and the WAL they write) short.
+    while True:
+        start = time.monotonic()
+        # Packed pastes go first, so that copies of them left in the paste
+        # table (by an interrupted tier) are counted by purge.
+        if (
+            packed
+            and (hashids := paster.purge_packed(limit=batch_size, **criteria))
+            is not None
+        ):
+            progress = "from packs"
+        else:
+            packed = False
+            batch = paster.purge(after=after, limit=batch_size, **criteria)
+            if batch is None:
+                break
+            after, hashids = batch
+            progress = f"through id {after}"
+        for hashid in hashids:
+            _purge(hashid)
+        removed += len(hashids)
+        click.echo(f"removed {removed} pastes ({progress})")
+        if rate:
+            time.sleep(max(len(hashids) / rate - (time.monotonic() - start), 0))
+    click.echo(f"removed {removed} pastes")
+
+
+def _purge(hashid: str) -> None:
+    pbnh.cache.delete_paste(hashid)
+    if files := pbnh.sendfile.files():
+        files.remove(hashid)
+    try:
+        if pbnh.cdn.purge(hashid):
+            click.echo(f"{hashid} purged from the CDN")
+    except pbnh.cdn.CDNPurgeError as exc:
+        click.echo(click.style(f"WARNING: {exc}", fg="yellow"))
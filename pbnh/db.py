@@ -1,23 +1,49 @@
 import contextlib
+import functools
 import hashlib
-from collections.abc import Iterator
-from datetime import datetime
+import itertools
+import os
+from collections.abc import Callable, Iterable, Iterator, Sequence
+from datetime import date, datetime, timedelta, timezone
+from typing import IO, Any, cast
 
 import magic
 import sqlalchemy.exc
-from flask import Flask, current_app, g
+from flask import Flask, current_app
 from sqlalchemy import (
+    BigInteger,
     Column,
+    Date,
     DateTime,
+    Index,
     Integer,
     LargeBinary,
     String,
+    Table,
     UniqueConstraint,
+    and_,
+    bindparam,
+    case,
+    column,
     create_engine,
+    delete,
+    event,
+    insert,
+    select,
+    table,
+    text,
+    tuple_,
+    update,
 )
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.engine import Engine
 from sqlalchemy.orm import DeclarativeBase, Session
 from sqlalchemy.sql import func
+from sqlalchemy.sql.expression import ColumnClause, ColumnElement
+
+from pbnh import pack, timing
+
+EXTENSION = "pbnh.db"
 
 
 class _Base(DeclarativeBase):
@@ -36,19 +62,217 @@ class _Paste(_Base):
     timestamp    datetime
     sunset       datetime
     data         blob
+    size         bigint (length of data)
     """
 
     __tablename__ = "paste"
 
     id = Column(Integer, primary_key=True)
     hashid = Column(String, nullable=False)
-    ip = Column(String)
+    ip = Column(String, index=True)
     timestamp = Column(DateTime, default=func.now())
     mime = Column(String, default="application/octet-stream")
-    sunset = Column(DateTime)
+    sunset = Column(DateTime, index=True)
+    data = Column(LargeBinary)
+    size = Column(BigInteger)
+
+    __table_args__ = (
+        UniqueConstraint("hashid", name="unique_hash"),
+        # for listing pastes (newest first) with keyset pagination
+        Index("ix_paste_timestamp_id", "timestamp", "id"),
+    )
+
+
+class _PasteIndex(_Base):
+    """Class to define the paste_index table
+
+    Indexes are derived from paste data (e.g. to allow partial retrieval),
+    so they can be rebuilt at any time.
+
+    paste_index
+    -------------
+    id           (PK) int
+    hashid       string (of the indexed paste)
+    kind         string (what kind of index it is)
+    data         blob
+    """
+
+    __tablename__ = "paste_index"
+
+    id = Column(Integer, primary_key=True)
+    hashid = Column(String, nullable=False)
+    kind = Column(String, nullable=False)
     data = Column(LargeBinary)
 
-    __table_args__ = (UniqueConstraint("hashid", name="unique_hash"),)
+    __table_args__ = (UniqueConstraint("hashid", "kind", name="unique_index"),)
+
+
+class _PasteStats(_Base):
+    """Class to define the paste_stats table
+
+    Rows are kept up to date as pastes are created/deleted,
+    so storage can be summarized without scanning the paste table.
+
+    paste_stats
+    -------------
+    id           (PK) int
+    ip           string ("" if unknown)
+    mime         string
+    day          date (of the paste timestamps)
+    count        bigint (number of pastes)
+    size         bigint (total length of paste data)
+    """
+
+    __tablename__ = "paste_stats"
+
+    id = Column(Integer, primary_key=True)
+    ip = Column(String, nullable=False)
+    mime = Column(String, nullable=False)
+    day = Column(Date, nullable=False)
+    count = Column(BigInteger, nullable=False)
+    size = Column(BigInteger, nullable=False)
+
+    __table_args__ = (UniqueConstraint("ip", "mime", "day", name="unique_stats"),)
+
+
+class _PasteRedirect(_Base):
+    """Class to define the paste_redirect table
+
+    Redirects (i.e. URL-shortener pastes) are the most requested pastes,
+    so their locations are kept here (as they are created/deleted)
+    to be looked up without fetching (or building) the whole paste.
+
+    paste_redirect
+    -------------
+    hashid       (PK) string (of the redirect paste)
+    location     string (the decoded paste data)
+    """
+
+    __tablename__ = "paste_redirect"
+
+    hashid = Column(String, primary_key=True)
+    location = Column(String, nullable=False)
+
+
+class _SchemaVersion(_Base):
+    """Class to define the schema_version table
+
+    It has (at most) one row, which records the latest migration applied.
+
+    schema_version
+    -------------
+    version      (PK) int
+    """
+
+    __tablename__ = "schema_version"
+
+    version = Column(Integer, primary_key=True)
+
+
+REDIRECT_MIME = "text/x.pbnh.redirect"
+
+# Lookups are the hottest queries, so they are Core statements (which return
+# plain rows, without the ORM's identity map), built once and compiled once
+# (by SQLAlchemy's statement cache).
+_paste = cast(Table, _Paste.__table__)
+_QUERY_COLUMNS = [
+    _paste.c[name] for name in ("data", "hashid", "ip", "mime", "sunset", "timestamp")
+]
+_QUERY = select(*_QUERY_COLUMNS).where(_paste.c.hashid == bindparam("hashid"))
+_QUERY_MANY = select(*_QUERY_COLUMNS).where(
+    _paste.c.hashid.in_(bindparam("hashids", expanding=True))
+)
+_QUERY_METADATA = select(
+    *(
+        _paste.c[name]
+        for name in ("hashid", "ip", "mime", "sunset", "timestamp", "size")
+    ),
+    case(
+        # The size may be unknown (e.g. during an upgrade).
+        (func.coalesce(_paste.c.size, 0) <= bindparam("max_data"), _paste.c.data),
+        else_=None,
+    ).label("data"),
+).where(_paste.c.hashid == bindparam("hashid"))
+_EXISTS = select(_paste.c.id).where(_paste.c.hashid == bindparam("hashid")).limit(1)
+
+# The size of a paste (which is unknown until paste.size is backfilled)
+_SIZE = func.coalesce(_Paste.size, func.length(_Paste.data))
+
+# These dialects support INSERT ... ON CONFLICT DO UPDATE:
+_UPSERTS: dict[str, Callable[..., Any]] = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+# Pastes are inserted unless their hashid exists (with the dialects above).
+_INSERT_COLUMNS = ("hashid", "ip", "mime", "sunset", "timestamp", "data", "size")
+# (This is text, since inserts with ON CONFLICT aren't cached once compiled.)
+_INSERT = text(
+    f"INSERT INTO paste ({', '.join(_INSERT_COLUMNS)})"
+    f" VALUES ({', '.join(f':{name}' for name in _INSERT_COLUMNS)})"
+    " ON CONFLICT (hashid) DO NOTHING RETURNING id"
+).bindparams(*(bindparam(name, type_=_paste.c[name].type) for name in _INSERT_COLUMNS))
+# Duplicates are told from (SHA1) collisions by the DB (so that the data of the
+# existing paste is never fetched), by comparing the size before the data.
+_QUERY_DUPLICATE = select(
+    and_(_SIZE == bindparam("size"), _paste.c.data == bindparam("data"))
+).where(_paste.c.hashid == bindparam("hashid"))
+
+
+# Full-text search is implemented with dialect-specific features
+# (FTS5 on SQLite and tsvector/GIN on PostgreSQL),
+# so the paste_search table is managed outside of the ORM.
+# Only the first SEARCH_MAX_BYTES of each text paste are indexed.
+SEARCH_MAX_BYTES = 512 * 1024
+_SEARCH_SQL = {
+    "postgresql": {
+        "create": (
+            "CREATE TABLE IF NOT EXISTS paste_search"
+            " (id INTEGER PRIMARY KEY, document TSVECTOR NOT NULL)",
+            "CREATE INDEX IF NOT EXISTS paste_search_document"
+            " ON paste_search USING GIN (document)",
+        ),
+        "insert": "INSERT INTO paste_search (id, document)"
+        " VALUES (:id, to_tsvector('simple', :text))",
+        "match": "paste_search.document @@ plainto_tsquery('simple', :query)",
+    },
+    "sqlite": {
+        "create": (
+            "CREATE VIRTUAL TABLE IF NOT EXISTS paste_search"
+            " USING fts5(document, tokenize='unicode61')",
+        ),
+        "insert": "INSERT INTO paste_search (rowid, document) VALUES (:id, :text)",
+        "match": "paste_search MATCH :query",
+    },
+}
+
+
+# Data streamed into a paste is read (and written) in chunks of this size,
+# and the first chunk is kept to derive things from (e.g. the search index).
+_STREAM_CHUNK_SIZE = SEARCH_MAX_BYTES
+# Streamed data is copied into this table first on PostgreSQL (with COPY,
+# since a parameter would have to hold all of it).
+_STREAM_TABLE = (
+    "CREATE TEMPORARY TABLE IF NOT EXISTS paste_stream (data BYTEA)"
+    " ON COMMIT DELETE ROWS"
+)
+
+
+class _ChunksFile:
+    # A file (for COPY ... FROM STDIN) that reads the next chunk each time.
+    def __init__(self, chunks: Iterator[bytes]) -> None:
+        self._chunks = chunks
+
+    def read(self, size: int = -1) -> bytes:
+        return next(self._chunks, b"")
+
+
+def _copy_row(stream: IO[bytes]) -> Iterator[bytes]:
+    # A row of one bytea column in COPY's text format (which escapes "\").
+    yield b"\\\\x"
+    while chunk := stream.read(_STREAM_CHUNK_SIZE):
+        yield chunk.hex().encode()
+    yield b"\n"
 
 
 class PasteDBError(Exception):
@@ -64,42 +288,290 @@ class HashCollision(PasteDBError):
 
 
 class _Paster:
-    def __init__(self, session: Session, /) -> None:
+    def __init__(
+        self,
+        session: Session,
+        /,
+        *,
+        search: bool = False,
+        packs: pack.Packs | None = None,
+    ) -> None:
         self._session = session
+        self._search = search
+        # Lookups fall through to packed pastes (which aren't in the paste table).
+        self._packs = packs
 
-    def create(
-        self,
+    def _require_packs(self) -> pack.Packs:
+        if self._packs is None:
+            raise PasteDBError("PACK_DIR is not set in the config.")
+        return self._packs
+
+    @staticmethod
+    def _new_paste(
         data: bytes,
         ip: str | None = None,
         mime: str | None = None,
         sunset: datetime | None = None,
         timestamp: datetime | None = None,
-    ) -> str:
-        hashid = hashlib.sha1(
-            data,
-            # This is for content identification, not security...
-            # If there is a collision, the new paste will be rejected,
-            # and the original paste will be preserved.
-            usedforsecurity=False,
-        ).hexdigest()
-        paste = _Paste(
+        *,
+        hashid: str | None = None,
+        size: int | None = None,
+    ) -> _Paste:
+        # (hashid and size are given if data is only the start of a stream.)
+        if hashid is None:
+            with timing.phase("hash"):
+                hashid = hashlib.sha1(
+                    data,
+                    # This is for content identification, not security...
+                    # If there is a collision, the new paste will be rejected,
+                    # and the original paste will be preserved.
+                    usedforsecurity=False,
+                ).hexdigest()
+        if not mime:
+            with timing.phase("magic"):
+                mime = magic.from_buffer(data, mime=True)
+        return _Paste(
             hashid=hashid,
             ip=ip,
-            mime=mime or magic.from_buffer(data, mime=True),
+            mime=mime,
             sunset=sunset,
-            timestamp=timestamp,
+            # Set the timestamp here (instead of with the DB's clock and time zone)
+            # so that it matches the day the stats are kept under.
+            timestamp=timestamp or datetime.now(timezone.utc).replace(tzinfo=None),
             data=data,
+            size=len(data) if size is None else size,
         )
-        try:
+
+    def _add(self, paste: _Paste) -> None:
+        # Beware: This must be called in a transaction!
+        self._session.add(paste)
+        # The paste is flushed (and may fail) before anything is derived from it.
+        self._session.flush()
+        self._derive(paste, cast(int, paste.id))
+
+    def _derive(self, paste: _Paste, id_: int) -> None:
+        # Beware: This must be called in a transaction (that inserted the paste)!
+        self._update_stats(
+            ip=cast(str | None, paste.ip),
+            mime=cast(str, paste.mime),
+            day=cast(datetime, paste.timestamp).date(),
+            count=1,
+            size=cast(int, paste.size),
+        )
+        if paste.mime == REDIRECT_MIME:
+            try:
+                location = cast(bytes, paste.data).decode("utf-8")
+            except UnicodeDecodeError:
+                pass  # It can't be redirected to anyway.
+            else:
+                self._session.add(
+                    _PasteRedirect(hashid=paste.hashid, location=location)
+                )
+        if self._search:
+            self._index_for_search(
+                id_,
+                mime=cast(str, paste.mime),
+                data=cast(bytes, paste.data),
+            )
+
+    def create(
+        self,
+        data: bytes | IO[bytes],
+        ip: str | None = None,
+        mime: str | None = None,
+        sunset: datetime | None = None,
+        timestamp: datetime | None = None,
+        *,
+        hashid: str | None = None,
+    ) -> str:
+        # The data can also be a (seekable) stream, which is never read into
+        # memory all at once (and whose hashid can be given, if it is known).
+        if not isinstance(data, bytes):
+            return self._create_streamed(
+                data,
+                ip=ip,
+                mime=mime,
+                sunset=sunset,
+                timestamp=timestamp,
+                hashid=hashid,
+            )
+        paste = self._new_paste(data, ip, mime, sunset, timestamp)
+        hashid = cast(str, paste.hashid)
+        if self._packs is not None and (packed := self._packs.query(hashid)):
+            # (The paste table's unique index doesn't cover packed pastes.)
+            if packed["data"] != data:
+                raise HashCollision(hashid)
+            raise PasteExists(hashid)
+        dialect = self._session.get_bind().dialect.name
+        if dialect not in _UPSERTS:
+            try:
+                with self._session.begin():
+                    self._add(paste)
+            except sqlalchemy.exc.IntegrityError as exc:
+                # A paste with that hashid already exists.
+                query = self.query(hashid=hashid) or {}
+                if query["data"] != data:
+                    raise HashCollision(hashid) from exc
+                raise PasteExists(hashid)
+            return hashid
+        values = {name: getattr(paste, name) for name in _INSERT_COLUMNS}
+        while True:
             with self._session.begin():
-                self._session.add(paste)
-        except sqlalchemy.exc.IntegrityError as exc:
-            # A paste with that hashid already exists.
-            query = self.query(hashid=hashid) or {}
-            if query["data"] != data:
-                raise HashCollision(hashid) from exc
+                id_ = self._session.connection().execute(_INSERT, values).scalar()
+                if id_ is not None:
+                    self._derive(paste, id_)
+                    return hashid
+            # A paste with that hashid already exists, so compare it.
+            if (duplicate := self._query_duplicate(hashid=hashid, data=data)) is None:
+                continue  # It was removed since.
+            if not duplicate:
+                raise HashCollision(hashid)
             raise PasteExists(hashid)
-        return hashid
+
+    def _create_streamed(
+        self, stream: IO[bytes], *, hashid: str | None, **kwargs: Any
+    ) -> str:
+        size = stream.seek(0, os.SEEK_END)
+        stream.seek(0)
+        head = stream.read(_STREAM_CHUNK_SIZE)
+        if (
+            len(head) == size
+            or kwargs["mime"] == REDIRECT_MIME
+            or self._session.get_bind().dialect.name not in _UPSERTS
+        ):
+            # (It is small, needed whole, or can't be streamed into the DB.)
+            return self.create(head + stream.read(), **kwargs)
+        if hashid is None:
+            with timing.phase("hash"):
+                digest = hashlib.sha1(head, usedforsecurity=False)
+                while chunk := stream.read(_STREAM_CHUNK_SIZE):
+                    digest.update(chunk)
+            hashid = digest.hexdigest()
+        paste = self._new_paste(head, hashid=hashid, size=size, **kwargs)
+        while True:
+            # (The paste table's unique index doesn't cover packed pastes.)
+            if self._packs is None or hashid not in self._packs:
+                stream.seek(0)
+                with self._session.begin():
+                    if (id_ := self._insert_streamed(paste, stream)) is not None:
+                        self._derive(paste, id_)
+                        return hashid
+            # A paste with that hashid already exists, so compare it.
+            if (duplicate := self._compare_streamed(stream, hashid=hashid)) is None:
+                continue  # It was removed since.
+            if not duplicate:
+                raise HashCollision(hashid)
+            raise PasteExists(hashid)
+
+    def _insert_streamed(self, paste: _Paste, stream: IO[bytes]) -> int | None:
+        # Beware: This must be called in a transaction!
+        # Insert a paste unless its hashid exists (like _INSERT), but with the
+        # data from a stream (and get its id).
+        connection = self._session.connection()
+        dialect = connection.dialect.name
+        dbapi_connection: Any = connection.connection.dbapi_connection
+        data: ColumnElement[Any]
+        if dialect == "postgresql":
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(_STREAM_TABLE)
+                cursor.copy_expert(
+                    "COPY paste_stream (data) FROM STDIN",
+                    _ChunksFile(_copy_row(stream)),
+                )
+            data = (
+                select(column("data"))
+                .select_from(table("paste_stream"))
+                .scalar_subquery()
+            )
+        else:
+            # The data is written into a blob of its size (see below).
+            data = func.zeroblob(paste.size)
+        id_: int | None = connection.execute(
+            _UPSERTS[dialect](_paste)
+            .values({name: getattr(paste, name) for name in _INSERT_COLUMNS})
+            .values(data=data)
+            .on_conflict_do_nothing(index_elements=["hashid"])
+            .returning(_paste.c.id)
+        ).scalar()
+        if id_ is not None and dialect == "sqlite":
+            with dbapi_connection.blobopen("paste", "data", id_) as blob:
+                while chunk := stream.read(_STREAM_CHUNK_SIZE):
+                    blob.write(chunk)
+        return id_
+
+    def _compare_streamed(self, stream: IO[bytes], *, hashid: str) -> bool | None:
+        # Like _query_duplicate, but a chunk at a time (from the table or a pack).
+        if (paste := self.query_metadata(hashid=hashid)) is None:
+            return None
+        stream.seek(0, os.SEEK_END)
+        if paste["size"] != stream.tell():
+            return False
+        stream.seek(0)
+        for chunk in self.read(hashid=hashid, chunk_size=_STREAM_CHUNK_SIZE):
+            if stream.read(len(chunk)) != chunk:
+                return False
+        return True
+
+    def _query_duplicate(self, *, hashid: str, data: bytes) -> bool | None:
+        # (None if there is no such paste.)
+        with self._session.begin():
+            parameters = {"hashid": hashid, "size": len(data), "data": data}
+            duplicate: bool | None = (
+                self._session.connection()
+                .execute(_QUERY_DUPLICATE, parameters)
+                .scalar()
+            )
+        return duplicate
+
+    def create_many(
+        self, pastes: Sequence[dict[str, Any]], *, dry_run: bool = False
+    ) -> list[str | PasteExists | HashCollision]:
+        """Create many pastes in one transaction.
+
+        Each paste is given as a dict of create arguments, and each result is
+        either the hashid of a new paste or the exception create would raise.
+        If dry_run is set, the results are determined without creating anything.
+        """
+        new_pastes = [self._new_paste(**paste) for paste in pastes]
+        with self._session.begin():
+            existing = dict(
+                self._session.execute(
+                    select(_Paste.hashid, _Paste.data).where(
+                        _Paste.hashid.in_({paste.hashid for paste in new_pastes})
+                    )
+                )
+                .tuples()
+                .all()
+            )
+        if self._packs is not None:
+            for paste in new_pastes:
+                hashid = cast(str, paste.hashid)
+                if hashid not in existing and (packed := self._packs.query(hashid)):
+                    existing[hashid] = packed["data"]
+        results: list[str | PasteExists | HashCollision] = []
+        try:
+            with self._session.begin():
+                for paste in new_pastes:
+                    hashid = cast(str, paste.hashid)
+                    if hashid not in existing:
+                        if not dry_run:
+                            self._add(paste)
+                        existing[hashid] = cast(bytes, paste.data)
+                        results.append(hashid)
+                    elif existing[hashid] == paste.data:
+                        results.append(PasteExists(hashid))
+                    else:
+                        results.append(HashCollision(hashid))
+        except sqlalchemy.exc.IntegrityError:
+            # Some paste was created concurrently, so create them one at a time.
+            self._session.expunge_all()
+            results = []
+            for paste_kwargs in pastes:
+                try:
+                    results.append(self.create(**paste_kwargs))
+                except (PasteExists, HashCollision) as exc:
+                    results.append(exc)
+        return results
 
     def _query(self, *, hashid: str) -> _Paste | None:
         # Beware: This autobegins a transaction!
@@ -108,63 +580,1123 @@ class _Paster:
 
     def query(self, *, hashid: str) -> dict[str, object] | None:
         with self._session.begin():
-            result = self._query(hashid=hashid)
-            if result:
-                return {
-                    "data": result.data,
-                    "hashid": result.hashid,
-                    "ip": result.ip,
-                    "mime": result.mime,
-                    "sunset": result.sunset,
-                    "timestamp": result.timestamp,
+            row = self._session.connection().execute(_QUERY, {"hashid": hashid}).first()
+        if row is not None:
+            return dict(row._mapping)
+        if self._packs is None or (paste := self._packs.query(hashid)) is None:
+            return None
+        del paste["size"]  # (to match the paste table)
+        return paste
+
+    def exists(self, *, hashid: str) -> bool:
+        with self._session.begin():
+            if (
+                self._session.connection().execute(_EXISTS, {"hashid": hashid}).first()
+                is not None
+            ):
+                return True
+        return self._packs is not None and hashid in self._packs
+
+    def query_metadata(
+        self, *, hashid: str, max_data: int = 0
+    ) -> dict[str, object] | None:
+        """Query a paste (like query), but only include data of at most max_data bytes.
+
+        The size of the data is included either way, so larger data can be read
+        (e.g. with read) without holding all of it in memory.
+        """
+        with self._session.begin():
+            row = (
+                self._session.connection()
+                .execute(_QUERY_METADATA, {"hashid": hashid, "max_data": max_data})
+                .first()
+            )
+        if row is None:
+            if self._packs is None:
+                return None
+            return self._packs.query(hashid, max_data=max_data)
+        paste = dict(row._mapping)
+        if paste["data"] is None:
+            del paste["data"]
+        elif paste["size"] is None:
+            paste["size"] = len(paste["data"])
+        return paste
+
+    def read(
+        self,
+        *,
+        hashid: str,
+        chunk_size: int = 256 * 1024,
+        start: int = 0,
+        stop: int | None = None,
+    ) -> Iterator[bytes]:
+        """Read the data of a paste in chunks (with a transaction for each one).
+
+        Only bytes start:stop are read (e.g. for a member of an archive).
+        """
+        offset = start
+        while stop is None or offset < stop:
+            length = chunk_size if stop is None else min(chunk_size, stop - offset)
+            with self._session.begin():
+                chunk = self._session.execute(
+                    select(
+                        func.substr(_Paste.data, offset + 1, length, type_=LargeBinary)
+                    ).where(_Paste.hashid == hashid)
+                ).scalar()
+            if chunk is None and offset == start and self._packs is not None:
+                # The paste isn't in the paste table (but may be packed).
+                yield from self._packs.read(
+                    hashid, chunk_size=chunk_size, start=start, stop=stop
+                )
+                return
+            if not chunk:
+                return  # The paste was read (or removed).
+            yield chunk
+            if len(chunk) < length:
+                return
+            offset += len(chunk)
+
+    def query_redirect(self, *, hashid: str) -> str | None:
+        """Get the location of a redirect paste (or None for any other paste)."""
+        with self._session.begin():
+            return self._session.execute(
+                select(_PasteRedirect.location).where(_PasteRedirect.hashid == hashid)
+            ).scalar()
+
+    def query_many(
+        self, *, hashids: Iterable[str], chunk_size: int = 100
+    ) -> Iterator[tuple[str, dict[str, object] | None]]:
+        """Query many pastes (with one IN query per chunk of hashids).
+
+        (hashid, paste) pairs are yielded in the order the hashids were given,
+        and paste is None for hashids that do not exist.
+        """
+        hashids = iter(hashids)
+        while chunk := list(itertools.islice(hashids, chunk_size)):
+            with self._session.begin():
+                found: dict[object, dict[str, object]] = {
+                    row.hashid: dict(row._mapping)
+                    for row in self._session.connection().execute(
+                        _QUERY_MANY, {"hashids": list(set(chunk))}
+                    )
                 }
-        return None
+            for hashid in chunk:
+                if hashid not in found and self._packs is not None:
+                    if (paste := self._packs.query(hashid)) is not None:
+                        del paste["size"]  # (to match the paste table)
+                        found[hashid] = paste
+                yield hashid, found.get(hashid)
+
+    def last_id(self) -> int:
+        """Get the highest paste id (0 if there are no pastes)."""
+        with self._session.begin():
+            return cast(
+                int,
+                self._session.connection()
+                .execute(select(func.coalesce(func.max(_paste.c.id), 0)))
+                .scalar_one(),
+            )
+
+    def scan_hashids(
+        self, *, after_id: int = 0, limit: int = 10000
+    ) -> list[tuple[int, str]]:
+        """Get a page of (id, hashid) pairs in id order (without any data).
+
+        Pages are found by id (the primary key), so a scan can be resumed
+        from the last id of any page (e.g. to find pastes created since).
+        """
+        statement = (
+            select(_paste.c.id, _paste.c.hashid)
+            .where(_paste.c.id > after_id)
+            .order_by(_paste.c.id)
+            .limit(limit)
+        )
+        with self._session.begin():
+            return [
+                (row.id, row.hashid)
+                for row in self._session.connection().execute(statement)
+            ]
+
+    def unexpired(self, *, hashids: Iterable[str]) -> set[str]:
+        """Get which of the hashids are of pastes that haven't passed their sunset."""
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        hashids = set(hashids)
+        statement = select(_Paste.hashid).where(
+            _Paste.hashid.in_(hashids),
+            _Paste.sunset.is_(None) | (_Paste.sunset > now),
+        )
+        with self._session.begin():
+            unexpired = set(self._session.execute(statement).scalars())
+        if self._packs is not None:
+            for hashid in hashids - unexpired:
+                paste = self._packs.query(hashid, max_data=0)
+                if paste and (paste["sunset"] is None or paste["sunset"] > now):
+                    unexpired.add(hashid)
+        return unexpired
+
+    def scan(
+        self, *, after: str = "", through: str | None = None, limit: int = 100
+    ) -> list[dict[str, object]]:
+        """Get a page of pastes (with their data) in hashid order.
+
+        Pages are found by hashid (with the unique index), so a scan can be
+        resumed from the last hashid of any page. Packed pastes are included.
+        """
+        statement = (
+            select(_Paste.hashid, _Paste.mime, _Paste.size, _Paste.data)
+            .where(_Paste.hashid > after)
+            .order_by(_Paste.hashid)
+            .limit(limit)
+        )
+        if through is not None:
+            statement = statement.where(_Paste.hashid <= through)
+        with self._session.begin():
+            pastes = {
+                row.hashid: dict(row._mapping)
+                for row in self._session.execute(statement)
+            }
+        if self._packs is not None:
+            for paste in self._packs.scan(after=after, through=through, limit=limit):
+                # (A copy in the paste table, e.g. from an interrupted tier, wins.)
+                pastes.setdefault(
+                    paste["hashid"],
+                    {key: paste[key] for key in ("hashid", "mime", "size", "data")},
+                )
+        return [pastes[hashid] for hashid in sorted(pastes)[:limit]]
 
     def delete(self, *, hashid: str) -> bool:
         with self._session.begin():
             result = self._query(hashid=hashid)
             if result:
                 self._session.delete(result)
-                return True
-        return False
+                size = len(result.data) if result.size is None else result.size
+                self._update_stats(
+                    ip=cast(str | None, result.ip),
+                    mime=cast(str, result.mime),
+                    day=cast(datetime, result.timestamp).date(),
+                    count=-1,
+                    size=-cast(int, size),
+                )
+                for model in (_PasteIndex, _PasteRedirect):
+                    self._session.execute(delete(model).where(model.hashid == hashid))
+                if self._search:
+                    self._unindex_for_search([cast(int, result.id)])
+        # Packed copies are removed too (even of a paste that is in the paste
+        # table, e.g. if it was packed by a tier that was interrupted).
+        if self._packs is None or (packed := self._packs.remove(hashid)) is None:
+            return result is not None
+        if result is None:
+            with self._session.begin():
+                self._forget([packed])
+        return True
 
+    @staticmethod
+    def _purge_filter(
+        *,
+        ip: str | None = None,
+        mime: str | None = None,
+        before: datetime | None = None,
+        larger_than: int | None = None,
+    ) -> list[ColumnElement[bool]]:
+        filter_ = []
+        if ip is not None:
+            filter_.append(_Paste.ip == ip)
+        if mime is not None:
+            filter_.append(_Paste.mime == mime)
+        if before is not None:
+            filter_.append(_Paste.timestamp < before)
+        if larger_than is not None:
+            filter_.append(_Paste.size > larger_than)
+        return filter_
 
-def _get_engine() -> Engine:
-    try:
-        # If g.engine is already set, assume it is valid:
-        return g.engine  # type: ignore
-    except AttributeError:
-        key = "SQLALCHEMY_DATABASE_URI"
+    @staticmethod
+    def _purge_matches(
+        paste: dict[str, Any],
+        *,
+        ip: str | None = None,
+        mime: str | None = None,
+        before: datetime | None = None,
+        larger_than: int | None = None,
+    ) -> bool:
+        # (This is _purge_filter for packed pastes.)
+        return (
+            (ip is None or paste["ip"] == ip)
+            and (mime is None or paste["mime"] == mime)
+            and (before is None or paste["timestamp"] < before)
+            and (larger_than is None or paste["size"] > larger_than)
+        )
+
+    def _unpacked(self, hashids: list[str]) -> set[str]:
+        # Beware: This must be called in a transaction!
+        # (Packed pastes may still be in the paste table if a tier was interrupted.)
+        return set(
+            self._session.execute(
+                select(_Paste.hashid).where(_Paste.hashid.in_(hashids))
+            ).scalars()
+        )
+
+    def count_purge(self, **criteria: Any) -> dict[str, int]:
+        """Count the pastes (and bytes) that purge and purge_packed would delete."""
+        packed = [
+            paste
+            for paste in (self._packs.entries() if self._packs is not None else ())
+            if self._purge_matches(paste, **criteria)
+        ]
+        with self._session.begin():
+            row = self._session.execute(
+                select(
+                    func.count(_Paste.id).label("count"),
+                    func.coalesce(func.sum(_SIZE), 0).label("size"),
+                ).where(*self._purge_filter(**criteria))
+            ).one()
+            unpacked = self._unpacked([paste["hashid"] for paste in packed])
+        counts = dict(row._mapping)
+        for paste in packed:
+            if paste["hashid"] not in unpacked:
+                counts["count"] += 1
+                counts["size"] += paste["size"]
+        return counts
+
+    def purge(
+        self, *, after: int = 0, limit: int = 1000, **criteria: Any
+    ) -> tuple[int, list[str]] | None:
+        """Delete a batch of pastes that match every criterion (in id order).
+
+        The criteria are ip, mime, before (a timestamp), and larger_than (a size).
+        Returns the last id in the batch (to purge the next batch after)
+        and the deleted hashids, or None if no pastes are left to delete.
+        """
+        with self._session.begin():
+            rows = self._session.execute(
+                select(
+                    _Paste.id,
+                    _Paste.hashid,
+                    _Paste.ip,
+                    _Paste.mime,
+                    _Paste.timestamp,
+                    _SIZE.label("size"),
+                )
+                .where(_Paste.id > after, *self._purge_filter(**criteria))
+                .order_by(_Paste.id)
+                .limit(limit)
+            ).all()
+            if not rows:
+                return None
+            ids = [row.id for row in rows]
+            hashids = [row.hashid for row in rows]
+            self._session.execute(delete(_Paste).where(_Paste.id.in_(ids)))
+            stats: dict[tuple[str | None, str, date], list[int]] = {}
+            for row in rows:
+                day_stats = stats.setdefault(
+                    (row.ip, row.mime, row.timestamp.date()), [0, 0]
+                )
+                day_stats[0] -= 1
+                day_stats[1] -= row.size or 0
+            for (ip, mime, day), (count, size) in stats.items():
+                self._update_stats(ip=ip, mime=mime, day=day, count=count, size=size)
+            for model in (_PasteIndex, _PasteRedirect):
+                self._session.execute(delete(model).where(model.hashid.in_(hashids)))
+            if self._search:
+                self._unindex_for_search(ids)
+        return ids[-1], hashids
+
+    def purge_packed(self, *, limit: int = 1000, **criteria: Any) -> list[str] | None:
+        """Remove a batch of packed pastes that match every criterion (like purge).
+
+        The stats of pastes that are also in the paste table are left to purge.
+        Returns the removed hashids, or None if no packed pastes are left to remove.
+        """
+        if self._packs is None:
+            return None
+        matches = list(
+            itertools.islice(
+                (
+                    paste
+                    for paste in self._packs.entries()
+                    if self._purge_matches(paste, **criteria)
+                ),
+                limit,
+            )
+        )
+        if not matches:
+            return None
+        # (Pastes that were removed since they were listed are skipped.)
+        removed = [paste for paste in matches if self._packs.remove(paste["hashid"])]
+        with self._session.begin():
+            unpacked = self._unpacked([paste["hashid"] for paste in removed])
+            self._forget(paste for paste in removed if paste["hashid"] not in unpacked)
+        return [paste["hashid"] for paste in removed]
+
+    def _forget(self, pastes: Iterable[dict[str, Any]]) -> None:
+        # Beware: This must be called in a transaction!
+        # (This is for removed packed pastes, which aren't in the paste table.)
+        hashids = []
+        for paste in pastes:
+            self._update_stats(
+                ip=paste["ip"],
+                mime=paste["mime"],
+                day=paste["timestamp"].date(),
+                count=-1,
+                size=-paste["size"],
+            )
+            hashids.append(paste["hashid"])
+        for model in (_PasteIndex, _PasteRedirect):
+            self._session.execute(delete(model).where(model.hashid.in_(hashids)))
+
+    def tier(
+        self, *, before: datetime, limit: int = 10000, batch_size: int = 100
+    ) -> tuple[str, int] | None:
+        """Move (up to limit of) the pastes created before a time into a new pack.
+
+        Pastes are moved in id order, batch_size at a time, and are only
+        removed from the paste table once the pack is durable. Their stats and
+        derived rows (e.g. redirects) are kept, but they can't be searched.
+        Returns the name of the pack and the number of pastes moved into it,
+        or None if no pastes are left to move.
+        """
+        packs = self._require_packs()
+        hashids: dict[int, str] = {}  # (by id)
+        with packs.writer() as writer:
+            while len(hashids) < limit:
+                with self._session.begin():
+                    rows = self._session.execute(
+                        select(
+                            _Paste.id,
+                            _Paste.hashid,
+                            _Paste.ip,
+                            _Paste.mime,
+                            _Paste.sunset,
+                            _Paste.timestamp,
+                            _SIZE.label("size"),
+                            _Paste.data,
+                        )
+                        .where(_Paste.id > max(hashids, default=0))
+                        .where(_Paste.timestamp < before)
+                        .order_by(_Paste.id)
+                        .limit(min(batch_size, limit - len(hashids)))
+                    ).all()
+                if not rows:
+                    break
+                for row in rows:
+                    paste = dict(row._mapping)
+                    hashids[paste.pop("id")] = row.hashid
+                    writer.add(paste)
+        if not hashids:
+            return None
+        ids = list(hashids)
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start : start + batch_size]
+            with self._session.begin():
+                deleted = set(
+                    self._session.execute(
+                        delete(_paste)
+                        .where(_paste.c.id.in_(batch))
+                        .returning(_paste.c.hashid)
+                    ).scalars()
+                )
+                if self._search:
+                    self._unindex_for_search(batch)
+            for id_ in batch:
+                if hashids[id_] not in deleted:
+                    # It was removed since it was packed (so it must stay removed).
+                    packs.remove(hashids[id_], pack=writer.name)
+        return writer.name, len(ids)
+
+    def repack(self) -> tuple[int, int]:
+        """Rewrite the packs without removed (or expired) pastes.
+
+        Expired pastes are forgotten (like removed pastes).
+        Returns the number of pastes kept and the number that expired.
+        """
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        kept, expired = self._require_packs().repack(expired_before=now)
+        with self._session.begin():
+            self._forget(expired)
+        return kept, len(expired)
+
+    def query_index(self, *, hashid: str, kind: str) -> bytes | None:
+        with self._session.begin():
+            result = (
+                self._session.query(_PasteIndex.data)
+                .filter(_PasteIndex.hashid == hashid, _PasteIndex.kind == kind)
+                .first()
+            )
+        return result.data if result else None
+
+    def create_index(self, *, hashid: str, kind: str, data: bytes) -> None:
         try:
-            g.engine = create_engine(current_app.config[key])
+            with self._session.begin():
+                self._session.add(_PasteIndex(hashid=hashid, kind=kind, data=data))
+        except sqlalchemy.exc.IntegrityError:
+            # The index was created concurrently.
+            pass
+
+    def _update_stats(
+        self, *, ip: str | None, mime: str, day: date, count: int, size: int
+    ) -> None:
+        # Beware: This must be called in a transaction!
+        keys = {"ip": ip or "", "mime": mime, "day": day}
+        filter_ = [getattr(_PasteStats, key) == value for key, value in keys.items()]
+        if count < 0:
+            self._session.execute(
+                update(_PasteStats)
+                .where(*filter_)
+                .values(count=_PasteStats.count + count, size=_PasteStats.size + size)
+            )
+            self._session.execute(
+                delete(_PasteStats).where(*filter_, _PasteStats.count <= 0)
+            )
+            return
+        dialect = self._session.get_bind().dialect.name
+        if upsert := _UPSERTS.get(dialect):
+            statement = upsert(_PasteStats).values(**keys, count=count, size=size)
+            self._session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=list(keys),
+                    set_={
+                        "count": _PasteStats.count + statement.excluded.count,
+                        "size": _PasteStats.size + statement.excluded.size,
+                    },
+                )
+            )
+            return
+        # Other dialects can race here, in which case the paste will be rejected
+        # (with an IntegrityError), but the stats will remain accurate.
+        result = self._session.execute(
+            update(_PasteStats)
+            .where(*filter_)
+            .values(count=_PasteStats.count + count, size=_PasteStats.size + size)
+        )
+        if not result.rowcount:  # type: ignore[attr-defined]
+            self._session.execute(
+                insert(_PasteStats).values(**keys, count=count, size=size)
+            )
+
+    def stats(
+        self,
+        *,
+        by: str | None = None,
+        ip: str | None = None,
+        since: date | None = None,
+    ) -> list[dict[str, Any]]:
+        """Summarize stored pastes (largest first).
+
+        Pastes can be grouped by "ip", "mime", or "day"
+        and filtered by IP and/or a minimum day.
+        """
+        group = [getattr(_PasteStats, by)] if by else []
+        statement = select(
+            *group,
+            func.coalesce(func.sum(_PasteStats.count), 0).label("count"),
+            func.coalesce(func.sum(_PasteStats.size), 0).label("size"),
+        ).group_by(*group)
+        if ip is not None:
+            statement = statement.where(_PasteStats.ip == ip)
+        if since is not None:
+            statement = statement.where(_PasteStats.day >= since)
+        statement = statement.order_by(func.sum(_PasteStats.size).desc(), *group)
+        with self._session.begin():
+            return [dict(row._mapping) for row in self._session.execute(statement)]
+
+    def _stats_days(self) -> list[date]:
+        with self._session.begin():
+            days = {
+                *self._session.execute(
+                    select(func.date(_Paste.timestamp)).distinct()
+                ).scalars(),
+                *self._session.execute(select(_PasteStats.day).distinct()).scalars(),
+            }
+        # SQLite dates are strings.
+        return sorted(
+            day if isinstance(day, date) else date.fromisoformat(day)
+            for day in days
+            if day is not None
+        )
+
+    def _rebuild_day_stats(
+        self, day: date, *, packed: dict[tuple[str | None, str], list[int]]
+    ) -> None:
+        start = datetime(day.year, day.month, day.day)
+        paste_day = func.date(_Paste.timestamp)
+        ip = func.coalesce(_Paste.ip, "")
+        columns = ["ip", "mime", "day", "count", "size"]
+        select_ = (
+            select(
+                ip,
+                _Paste.mime,
+                paste_day,
+                func.count(),
+                func.sum(func.coalesce(_Paste.size, func.length(_Paste.data))),
+            )
+            .where(
+                _Paste.timestamp >= start, _Paste.timestamp < start + timedelta(days=1)
+            )
+            .group_by(ip, _Paste.mime, paste_day)
+        )
+        dialect = self._session.get_bind().dialect.name
+        with self._session.begin():
+            self._session.execute(delete(_PasteStats).where(_PasteStats.day == day))
+            if upsert := _UPSERTS.get(dialect):
+                # Pastes created concurrently (that the select can't see yet)
+                # are counted by their own upserts, so add to (don't replace) them.
+                statement = upsert(_PasteStats).from_select(columns, select_)
+                self._session.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=["ip", "mime", "day"],
+                        set_={
+                            "count": _PasteStats.count + statement.excluded.count,
+                            "size": _PasteStats.size + statement.excluded.size,
+                        },
+                    )
+                )
+            else:
+                self._session.execute(insert(_PasteStats).from_select(columns, select_))
+            for (packed_ip, mime), (count, size) in packed.items():
+                self._update_stats(
+                    ip=packed_ip, mime=mime, day=day, count=count, size=size
+                )
+
+    def rebuild_stats(self) -> None:
+        """Recalculate paste stats from scratch (by scanning the paste table).
+
+        Packed pastes are counted too (by scanning the metadata in the packs).
+        Each day is recalculated in its own transaction (to avoid blocking
+        writers for long), and the result is the same if this is rerun.
+        """
+        packed: dict[date, dict[tuple[str | None, str], list[int]]] = {}
+        for paste in self._packs.entries() if self._packs is not None else ():
+            day_stats = packed.setdefault(paste["timestamp"].date(), {}).setdefault(
+                (paste["ip"], paste["mime"]), [0, 0]
+            )
+            day_stats[0] += 1
+            day_stats[1] += paste["size"]
+        for day in sorted({*self._stats_days(), *packed}):
+            self._rebuild_day_stats(day, packed=packed.get(day, {}))
+
+    def _search_sql(self, key: str) -> str:
+        dialect = self._session.get_bind().dialect.name
+        try:
+            return cast(str, _SEARCH_SQL[dialect][key])
         except KeyError as exc:
-            raise PasteDBError(f"{key} is not set in the config.") from exc
-        except (ValueError, sqlalchemy.exc.ArgumentError) as exc:
-            raise PasteDBError(f"Config key {key} is malformed or unusable.") from exc
-        # mypy gives precedence to the g.engine type
-        # instead of the assignement above:
-        return g.engine  # type: ignore
+            raise PasteDBError(f"Search is not supported for {dialect}.") from exc
+
+    def _search_key(self) -> str:
+        # FTS5 tables can only be keyed by rowid.
+        self._search_sql("match")  # Ensure search is supported.
+        return "rowid" if self._session.get_bind().dialect.name == "sqlite" else "id"
+
+    def _index_for_search(self, id_: int, *, mime: str, data: bytes) -> None:
+        # Beware: This must be called in a transaction!
+        if not mime.startswith("text/"):
+            return
+        document = data[:SEARCH_MAX_BYTES].decode("utf-8", errors="ignore")
+        self._session.execute(
+            text(self._search_sql("insert")),
+            # PostgreSQL text cannot contain NUL.
+            {"id": id_, "text": document.replace("\0", " ")},
+        )
+
+    def _unindex_for_search(self, ids: list[int]) -> None:
+        # Beware: This must be called in a transaction!
+        key: ColumnClause[Any] = column(self._search_key())
+        self._session.execute(delete(table("paste_search", key)).where(key.in_(ids)))
+
+    def reindex_search(self, *, after: int = 0, limit: int = 100) -> int | None:
+        """(Re)index a batch of pastes for search (in primary key order).
+
+        Return the last primary key in the batch (to pass as after
+        for the next batch), or None if there are no more pastes.
+        """
+        with self._session.begin():
+            pastes = self._session.execute(
+                select(_Paste.id, _Paste.mime, _Paste.data)
+                .where(_Paste.id > after, _Paste.mime.startswith("text/"))
+                .order_by(_Paste.id)
+                .limit(limit)
+            ).all()
+            if not pastes:
+                return None
+            self._session.execute(
+                text(
+                    f"DELETE FROM paste_search WHERE {self._search_key()}"
+                    " BETWEEN :first AND :last"
+                ),
+                {"first": pastes[0].id, "last": pastes[-1].id},
+            )
+            for paste in pastes:
+                self._index_for_search(paste.id, mime=paste.mime, data=paste.data)
+        return cast(int, pastes[-1].id)
+
+    def search(
+        self, query: str, *, before: int | None = None, limit: int = 20
+    ) -> list[dict[str, Any]]:
+        """Find text pastes containing every word in a query (newest first).
+
+        Results include a cursor that can be passed as before to get the next page.
+        Pastes that have passed their sunset are excluded.
+        """
+        if not query.split():
+            return []
+        if self._session.get_bind().dialect.name == "sqlite":
+            # Quote each word so that FTS5 query syntax is not interpreted.
+            query = " ".join(
+                '"' + word.replace('"', '""') + '"' for word in query.split()
+            )
+        key: ColumnClause[Any] = column(self._search_key())
+        statement = (
+            select(
+                _Paste.id.label("cursor"),
+                _Paste.hashid,
+                _Paste.mime,
+                _Paste.timestamp,
+                _Paste.sunset,
+                _Paste.size,
+            )
+            .select_from(table("paste_search", key))
+            .join(_Paste, _Paste.id == key)
+            .where(
+                text(self._search_sql("match")),
+                # Sunsets are stored as naive UTC.
+                (_Paste.sunset.is_(None))
+                | (_Paste.sunset > datetime.now(timezone.utc).replace(tzinfo=None)),
+            )
+            .order_by(key.desc())
+            .limit(limit)
+        )
+        if before is not None:
+            statement = statement.where(key < before)
+        with self._session.begin():
+            rows = self._session.execute(statement, {"query": query})
+            return [dict(row._mapping) for row in rows]
+
+    # (This is defined last, so that it doesn't shadow list in annotations.)
+    def list(
+        self,
+        *,
+        before: str | None = None,
+        limit: int = 20,
+        mime: str | None = None,
+        ip: str | None = None,
+        min_size: int | None = None,
+        max_size: int | None = None,
+    ) -> list[dict[str, Any]]:
+        """Get a page of pastes (without their data), newest first.
+
+        Results include a cursor that can be passed as before to get the next page.
+        Pages are found with the (timestamp, id) index, so the cost of a page
+        depends on its size (and how many pastes the filters skip),
+        not on the size of the table.
+        Raises ValueError if before is not a cursor.
+        """
+        statement = (
+            select(
+                _Paste.id,
+                _Paste.hashid,
+                _Paste.ip,
+                _Paste.mime,
+                _Paste.timestamp,
+                _Paste.sunset,
+                _Paste.size,
+            )
+            .order_by(_Paste.timestamp.desc(), _Paste.id.desc())
+            .limit(limit)
+        )
+        if before is not None:
+            timestamp, _, id_ = before.rpartition(",")
+            statement = statement.where(
+                tuple_(_Paste.timestamp, _Paste.id)
+                < (datetime.fromisoformat(timestamp), int(id_))
+            )
+        if mime is not None:
+            statement = statement.where(_Paste.mime == mime)
+        if ip is not None:
+            statement = statement.where(_Paste.ip == ip)
+        if min_size is not None:
+            statement = statement.where(_Paste.size >= min_size)
+        if max_size is not None:
+            statement = statement.where(_Paste.size <= max_size)
+        with self._session.begin():
+            rows = self._session.execute(statement).all()
+        return [
+            {
+                "cursor": f"{row.timestamp.isoformat()},{row.id}",
+                **{key: value for key, value in row._mapping.items() if key != "id"},
+            }
+            for row in rows
+        ]
+
+
+SQLITE_PRAGMAS_DEFAULT: dict[str, int | str] = {
+    # Let checkpoint_db release free pages (which only works if this is set
+    # before the database is initialized, so it must come first):
+    "auto_vacuum": "incremental",
+    # Readers and the writer don't block each other in WAL mode:
+    "journal_mode": "wal",
+    # In WAL mode, this only risks the latest commits on power loss:
+    "synchronous": "normal",
+    # milliseconds to wait for a lock (instead of raising "database is locked"):
+    "busy_timeout": 5000,
+    # bytes of the database to read through mmap:
+    "mmap_size": 256 * 1024 * 1024,
+    # KiB (when negative) of page cache per connection:
+    "cache_size": -64 * 1024,
+}
+
+
+def _sqlite_pragmas() -> list[str]:
+    key = "SQLITE_PRAGMAS"
+    pragmas = {**SQLITE_PRAGMAS_DEFAULT, **current_app.config.get(key, {})}
+    statements = []
+    for name, value in pragmas.items():
+        if value is None:
+            continue  # The pragma is disabled.
+        # Pragmas can't be parameterized, so only allow simple values.
+        if not (name.isidentifier() and str(value).lstrip("-").isalnum()):
+            raise PasteDBError(f"Config key {key} is malformed or unusable.")
+        statements.append(f"PRAGMA {name} = {value}")
+    return statements
+
+
+def _execute_all(dbapi_connection: Any, _: Any, *, statements: list[str]) -> None:
+    cursor = dbapi_connection.cursor()
+    for statement in statements:
+        cursor.execute(statement)
+    cursor.close()
+
+
+def _get_engine() -> Engine:
+    # Engines (and their connection pools) last as long as the app, but each
+    # process needs its own (since connections can't be shared after a fork).
+    engines: dict[tuple[int, str], Engine] = current_app.extensions[EXTENSION]
+    key = "SQLALCHEMY_DATABASE_URI"
+    try:
+        url = current_app.config[key]
+    except KeyError as exc:
+        raise PasteDBError(f"{key} is not set in the config.") from exc
+    pid = os.getpid()
+    if engine := engines.get((pid, url)):
+        return engine
+    try:
+        engine = create_engine(
+            url, **current_app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+        )
+    except (ValueError, sqlalchemy.exc.ArgumentError) as exc:
+        raise PasteDBError(f"Config key {key} is malformed or unusable.") from exc
+    if engine.dialect.name == "sqlite":
+        # Apply the pragmas to every connection (since most are per-connection).
+        event.listen(
+            engine,
+            "connect",
+            functools.partial(_execute_all, statements=_sqlite_pragmas()),
+        )
+    for inherited in [engine_key for engine_key in engines if engine_key[0] != pid]:
+        # (Leave the parent's connections open for it.)
+        engines.pop(inherited).dispose(close=False)
+    engines[(pid, url)] = engine
+    return engine
 
 
 def init_app(app: Flask) -> None:
     """Prepare an app for DB access."""
+    app.extensions[EXTENSION] = {}
 
-    @app.teardown_appcontext
-    def _dispose_db_engine(_: BaseException | None) -> None:
-        engine = getattr(g, "engine", None)
-        if engine:
-            engine.dispose()
+
+def dispose() -> None:
+    """Close the pooled DB connections of the current app."""
+    engines: dict[tuple[int, str], Engine] = current_app.extensions[EXTENSION]
+    while engines:
+        engines.popitem()[1].dispose()
 
 
 @contextlib.contextmanager
 def paster_context() -> Iterator[_Paster]:
-    with Session(_get_engine()) as session:
-        yield _Paster(session)
+    with timing.phase("open"):
+        session = Session(_get_engine())
+    with session:
+        yield _Paster(
+            session,
+            search=current_app.config.get("SEARCH_INDEX", False),
+            packs=pack.packs(),
+        )
+
+
+def _stamp(connection: sqlalchemy.Connection, version: int) -> None:
+    connection.execute(delete(_SchemaVersion))
+    connection.execute(insert(_SchemaVersion).values(version=version))
 
 
 def init_db() -> None:
-    _Base.metadata.create_all(_get_engine())
+    engine = _get_engine()
+    new = db_version() is None
+    _Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        for statement in _SEARCH_SQL.get(engine.dialect.name, {}).get("create", ()):
+            connection.execute(text(statement))
+        if new:
+            # Existing DBs must be upgraded (to be sure they match the models).
+            _stamp(connection, SCHEMA_VERSION)
+
+
+# Migrations are applied in order, and each one's version is its (1-based)
+# position in _MIGRATIONS. Version 0 is the schema from before versioning.
+# Upgrades yield progress messages, and they must be safe to rerun,
+# so that an interrupted upgrade (e.g. of a huge table) can be resumed.
+
+
+def _add_size(engine: Engine, batch_size: int) -> Iterator[str]:
+    if "size" not in {
+        column["name"] for column in sqlalchemy.inspect(engine).get_columns("paste")
+    }:
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE paste ADD COLUMN size BIGINT"))
+    # Backfill in batches (by id) so that writers are never blocked for long.
+    after = 0
+    while True:
+        with engine.begin() as connection:
+            ids = (
+                select(_Paste.id)
+                .where(_Paste.id > after)
+                .order_by(_Paste.id)
+                .limit(batch_size)
+                .subquery()
+            )
+            through = connection.execute(select(func.max(ids.c.id))).scalar()
+            if through is None:
+                return
+            connection.execute(
+                update(_Paste)
+                .where(_Paste.id > after, _Paste.id <= through, _Paste.size.is_(None))
+                .values(size=func.coalesce(func.length(_Paste.data), 0))
+            )
+        yield f"backfilled paste.size through id {through}"
+        after = through
+
+
+def _drop_size(engine: Engine) -> None:
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE paste DROP COLUMN size"))
+
+
+_DERIVED_TABLES = ("paste_index", "paste_stats")
+
+
+def _add_derived_tables(engine: Engine, batch_size: int) -> Iterator[str]:
+    _Base.metadata.create_all(
+        engine, tables=[_Base.metadata.tables[name] for name in _DERIVED_TABLES]
+    )
+    with engine.begin() as connection:
+        for statement in _SEARCH_SQL.get(engine.dialect.name, {}).get("create", ()):
+            connection.execute(text(statement))
+    # Backfill stats a day at a time (with the timestamp index).
+    with Session(engine) as session:
+        paster = _Paster(session)
+        for day in paster._stats_days():
+            paster._rebuild_day_stats(day, packed={})
+            yield f"backfilled paste_stats for {day}"
+    yield "run `flask paste reindex` to index existing pastes for search"
+
+
+def _drop_derived_tables(engine: Engine) -> None:
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS paste_search"))
+    _Base.metadata.drop_all(
+        engine, tables=[_Base.metadata.tables[name] for name in _DERIVED_TABLES]
+    )
+
+
+_INDEXED_COLUMNS = ("timestamp", "sunset", "ip")
+
+
+def _create_index(
+    connection: sqlalchemy.Connection, name: str, columns: tuple[str, ...]
+) -> None:
+    # PostgreSQL can build indexes without blocking writes (outside of a transaction).
+    concurrently = " CONCURRENTLY" if connection.dialect.name == "postgresql" else ""
+    if (
+        concurrently
+        and connection.execute(
+            text(
+                "SELECT NOT pg_index.indisvalid FROM pg_index"
+                " JOIN pg_class ON pg_class.oid = pg_index.indexrelid"
+                " WHERE pg_class.relname = :name"
+            ),
+            {"name": name},
+        ).scalar()
+    ):
+        # An interrupted concurrent build leaves an invalid index behind.
+        connection.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+    quoted = ", ".join(f'"{column}"' for column in columns)
+    connection.execute(
+        text(f"CREATE INDEX{concurrently} IF NOT EXISTS {name} ON paste ({quoted})")
+    )
+
+
+def _add_indexes(engine: Engine, batch_size: int) -> Iterator[str]:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for name in _INDEXED_COLUMNS:
+            _create_index(connection, f"ix_paste_{name}", (name,))
+            yield f"indexed paste.{name}"
+
+
+def _drop_indexes(engine: Engine) -> None:
+    with engine.begin() as connection:
+        for name in _INDEXED_COLUMNS:
+            connection.execute(text(f"DROP INDEX IF EXISTS ix_paste_{name}"))
+
+
+def _add_listing_index(engine: Engine, batch_size: int) -> Iterator[str]:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        _create_index(connection, "ix_paste_timestamp_id", ("timestamp", "id"))
+        yield "indexed paste.timestamp, paste.id"
+        # The new index serves queries by timestamp too.
+        connection.execute(text("DROP INDEX IF EXISTS ix_paste_timestamp"))
+        yield "dropped the index of paste.timestamp"
+
+
+def _drop_listing_index(engine: Engine) -> None:
+    with engine.begin() as connection:
+        connection.execute(
+            text('CREATE INDEX IF NOT EXISTS ix_paste_timestamp ON paste ("timestamp")')
+        )
+        connection.execute(text("DROP INDEX IF EXISTS ix_paste_timestamp_id"))
+
+
+def _add_redirects(engine: Engine, batch_size: int) -> Iterator[str]:
+    _Base.metadata.create_all(engine, tables=[_Base.metadata.tables["paste_redirect"]])
+    # Backfill in batches (by id) so that writers are never blocked for long.
+    after = 0
+    with Session(engine) as session:
+        while True:
+            with session.begin():
+                rows = session.execute(
+                    select(_Paste.id, _Paste.hashid, _Paste.data)
+                    .where(_Paste.id > after, _Paste.mime == REDIRECT_MIME)
+                    .order_by(_Paste.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                existing = set(
+                    session.scalars(
+                        select(_PasteRedirect.hashid).where(
+                            _PasteRedirect.hashid.in_({row.hashid for row in rows})
+                        )
+                    )
+                )
+                for row in rows:
+                    if row.hashid not in existing:
+                        with contextlib.suppress(UnicodeDecodeError):
+                            session.add(
+                                _PasteRedirect(
+                                    hashid=row.hashid, location=row.data.decode("utf-8")
+                                )
+                            )
+            after = rows[-1].id
+            yield f"backfilled paste_redirect through paste {after}"
+
+
+def _drop_redirects(engine: Engine) -> None:
+    _Base.metadata.drop_all(engine, tables=[_Base.metadata.tables["paste_redirect"]])
+
+
+_MIGRATIONS: list[
+    tuple[str, Callable[[Engine, int], Iterator[str]], Callable[[Engine], None]]
+] = [
+    ("add paste.size", _add_size, _drop_size),
+    ("index paste.timestamp, paste.sunset, and paste.ip", _add_indexes, _drop_indexes),
+    (
+        "add paste_index, paste_stats, and paste_search",
+        _add_derived_tables,
+        _drop_derived_tables,
+    ),
+    ("add paste_redirect", _add_redirects, _drop_redirects),
+    ("index paste.timestamp, paste.id", _add_listing_index, _drop_listing_index),
+]
+SCHEMA_VERSION = len(_MIGRATIONS)
+
+
+def db_version() -> int | None:
+    """Get the schema version (or None if the DB is not initialized)."""
+    engine = _get_engine()
+    inspector = sqlalchemy.inspect(engine)
+    if not inspector.has_table("paste"):
+        return None
+    if not inspector.has_table("schema_version"):
+        return 0
+    with engine.connect() as connection:
+        version = connection.execute(select(func.max(_SchemaVersion.version))).scalar()
+    return version or 0
+
+
+def upgrade_db(*, to: int | None = None, batch_size: int = 1000) -> Iterator[str]:
+    """Migrate the DB to a newer schema version (by default, the latest).
+
+    Progress messages are yielded as the migrations are applied.
+    """
+    version = db_version()
+    if version is None:
+        raise PasteDBError("The database is not initialized.")
+    target = SCHEMA_VERSION if to is None else to
+    if not version <= target <= SCHEMA_VERSION:
+        raise PasteDBError(f"Version {target} is not an upgrade from {version}.")
+    engine = _get_engine()
+    _Base.metadata.create_all(engine, tables=[_Base.metadata.tables["schema_version"]])
+    for new_version, (description, upgrade, _) in enumerate(
+        _MIGRATIONS[version:target], start=version + 1
+    ):
+        yield from upgrade(engine, batch_size)
+        with engine.begin() as connection:
+            _stamp(connection, new_version)
+        yield f"upgraded to version {new_version} ({description})"
+
+
+def downgrade_db(*, to: int) -> Iterator[str]:
+    """Migrate the DB to an older schema version.
+
+    Progress messages are yielded as the migrations are reverted.
+    """
+    version = db_version()
+    if version is None:
+        raise PasteDBError("The database is not initialized.")
+    if not 0 <= to <= version:
+        raise PasteDBError(f"Version {to} is not a downgrade from {version}.")
+    engine = _get_engine()
+    for old_version in range(version, to, -1):
+        description, _, downgrade = _MIGRATIONS[old_version - 1]
+        downgrade(engine)
+        with engine.begin() as connection:
+            _stamp(connection, old_version - 1)
+        yield f"downgraded to version {old_version - 1} (reverted: {description})"
+
+
+def checkpoint_db(*, vacuum_pages: int = 0) -> tuple[int, bool]:
+    """Release free pages and checkpoint (and truncate) the WAL of an SQLite DB.
+
+    At most vacuum_pages (or all, if 0) free pages are released. The number of
+    pages released and whether the checkpoint completed are returned.
+    """
+    engine = _get_engine()
+    if engine.dialect.name != "sqlite":
+        raise PasteDBError(f"{engine.dialect.name} databases are not checkpointed.")
+    released = 0
+    with engine.connect() as connection:
+        # Nothing is freed unless auto_vacuum was set when the DB was initialized.
+        free_pages = connection.execute(text("PRAGMA freelist_count")).scalar_one()
+        target = min(vacuum_pages or free_pages, free_pages)
+        while released < target:
+            # pysqlite only steps the pragma once (freeing one page), so repeat it.
+            connection.execute(text(f"PRAGMA incremental_vacuum({target - released})"))
+            remaining = connection.execute(text("PRAGMA freelist_count")).scalar_one()
+            if free_pages - remaining == released:
+                break  # auto_vacuum is not enabled.
+            released = free_pages - remaining
+        connection.commit()
+        busy, _, _ = connection.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).one()
+    return released, not busy
 
 
 def undo_db() -> None:
-    _Base.metadata.drop_all(_get_engine())
+    engine = _get_engine()
+    with engine.begin() as connection:
+        connection.execute(text("DROP TABLE IF EXISTS paste_search"))
+    _Base.metadata.drop_all(engine)
@@ -0,0 +1,271 @@
+"""Write pastes to the DB in batches (i.e. with group commit).
+
+When WRITE_BEHIND is set, pastes are queued and inserted by a writer thread,
+many at a time, instead of with a transaction per request. Its value selects
+when a paste is acknowledged:
+
+- commit: after the batch containing the paste is committed.
+- journal: after the paste is appended (and fsynced) to a local journal
+  in WRITE_BEHIND_JOURNAL, which is replayed (e.g. after a crash) on startup.
+"""
+
+import atexit
+import concurrent.futures
+import fcntl
+import itertools
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, BinaryIO
+
+import magic
+from flask import Flask, current_app
+
+from pbnh import db
+
+EXTENSION = "pbnh.ingest"
+RETRY_DELAY = 1.0  # seconds between attempts to write a batch of journaled pastes
+_HEADER = struct.Struct(">II")  # metadata length, data length
+
+
+class _Item:
+    def __init__(self, paste: dict[str, Any]) -> None:
+        self.paste = paste
+        self.future: concurrent.futures.Future[str] = concurrent.futures.Future()
+
+
+def _encode(paste: dict[str, Any]) -> bytes:
+    metadata = json.dumps(
+        {key: value for key, value in paste.items() if key != "data"},
+        default=datetime.isoformat,
+    ).encode()
+    data: bytes = paste["data"]
+    return _HEADER.pack(len(metadata), len(data)) + metadata + data
+
+
+def _decode(journal: BinaryIO) -> Iterator[dict[str, Any]]:
+    while len(header := journal.read(_HEADER.size)) == _HEADER.size:
+        metadata_length, data_length = _HEADER.unpack(header)
+        metadata = journal.read(metadata_length)
+        data = journal.read(data_length)
+        if len(data) != data_length:
+            # The record was never fsynced (or acknowledged).
+            return
+        paste = json.loads(metadata)
+        for key in ("sunset", "timestamp"):
+            if paste[key]:
+                paste[key] = datetime.fromisoformat(paste[key])
+        yield {**paste, "data": data}
+
+
+class Writer:
+    """Queue pastes and write them in batches (with a thread)."""
+
+    def __init__(
+        self,
+        app: Flask,
+        *,
+        durability: str = "commit",
+        batch_size: int = 100,
+        batch_delay: float = 0.005,
+        queue_size: int = 1000,
+        journal_dir: str | None = None,
+    ) -> None:
+        if durability not in {"commit", "journal"}:
+            raise ValueError(f"{durability} is not a valid durability.")
+        self._app = app
+        self._batch_size = batch_size
+        self._batch_delay = batch_delay
+        self._queue: queue.Queue[_Item | None] = queue.Queue(maxsize=queue_size)
+        self._pending: dict[str, dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._journal: BinaryIO | None = None
+        self._unwritten = 0  # journaled pastes that have not been committed
+        self._written = 0  # batches that have been committed
+        self._closing = threading.Event()
+        if durability == "journal":
+            if not journal_dir:
+                raise ValueError("A journal directory is required.")
+            path = Path(journal_dir) / f"{os.getpid()}-{uuid.uuid4().hex}.journal"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._journal = path.open("xb")
+            # Holding the lock tells other processes not to replay this journal.
+            fcntl.flock(self._journal, fcntl.LOCK_EX)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        data: bytes,
+        ip: str | None = None,
+        mime: str | None = None,
+        sunset: datetime | None = None,
+    ) -> str:
+        """Queue a paste (like _Paster.create) and wait for it to be durable."""
+        if not self._thread.is_alive():
+            # Nothing would write the paste (and the queue would fill up).
+            raise db.PasteDBError("The writer is not running.")
+        paste = {
+            "data": data,
+            "ip": ip,
+            "mime": mime or magic.from_buffer(data, mime=True),
+            # Pending pastes are served like the DB returns them (naive, in UTC).
+            "sunset": sunset and sunset.astimezone(timezone.utc).replace(tzinfo=None),
+            # Don't let the timestamp depend on when the paste is written:
+            "timestamp": datetime.now(timezone.utc).replace(tzinfo=None),
+        }
+        if self._journal is None:
+            item = _Item(paste)
+            self._queue.put(item)
+            return item.future.result()
+        # Detect duplicates up front (since the paste will not be waited on).
+        written = self._written
+        hashid = self._check(paste)
+        record = _encode(paste)
+        with self._lock:
+            if hashid in self._pending:
+                # The paste was journaled but has not been written yet.
+                if self._pending[hashid]["data"] != data:
+                    raise db.HashCollision(hashid)
+                raise db.PasteExists(hashid)
+            if self._written != written:
+                # It may have been written (and stopped pending) since the check.
+                self._check(paste)
+            self._journal.write(record)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._unwritten += 1
+            self._pending[hashid] = {**paste, "hashid": hashid}
+        self._queue.put(_Item(paste))
+        return hashid
+
+    @staticmethod
+    def _check(paste: dict[str, Any]) -> str:
+        # Get the hashid of a new paste (or raise if it exists).
+        with db.paster_context() as paster:
+            (result,) = paster.create_many([paste], dry_run=True)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def pending(self, hashid: str) -> dict[str, Any] | None:
+        """Get a paste that has been acknowledged but not yet written."""
+        with self._lock:
+            return self._pending.get(hashid)
+
+    def close(self) -> None:
+        """Write any queued pastes and stop the thread."""
+        self._closing.set()
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._journal and not self._journal.closed:
+            if not self._unwritten:
+                os.unlink(self._journal.name)
+            # Release the lock (so the journal can be replayed).
+            self._journal.close()
+
+    def _run(self) -> None:
+        with self._app.app_context():
+            if self._journal:
+                self._replay(Path(self._journal.name))
+            while batch := self._next_batch():
+                self._write(batch)
+
+    def _next_batch(self) -> list[_Item]:
+        item = self._queue.get()
+        if item is None:
+            return []
+        batch = [item]
+        deadline = time.monotonic() + self._batch_delay
+        while len(batch) < self._batch_size:
+            try:
+                item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Stop after this batch.
+                break
+            batch.append(item)
+        return batch
+
+    def _write(self, batch: list[_Item]) -> None:
+        while True:
+            try:
+                with db.paster_context() as paster:
+                    results = paster.create_many([item.paste for item in batch])
+                break
+            except Exception as exc:
+                current_app.logger.exception(
+                    "%d queued pastes were not written.", len(batch)
+                )
+                # Journaled pastes have been acknowledged, so they are retried
+                # (until the writer stops, and then replayed on startup).
+                if self._journal is None or self._closing.wait(RETRY_DELAY):
+                    for item in batch:
+                        item.future.set_exception(exc)
+                    return
+        with self._lock:
+            self._written += 1
+            for item, result in zip(batch, results):
+                if isinstance(result, Exception):
+                    item.future.set_exception(result)
+                else:
+                    item.future.set_result(result)
+                    self._pending.pop(result, None)
+            if self._journal:
+                self._unwritten -= len(batch)
+                if not self._unwritten:
+                    # Everything in the journal has been committed.
+                    self._journal.truncate(0)
+                    self._journal.seek(0)
+
+    def _replay(self, own_path: Path) -> None:
+        for path in sorted(own_path.parent.glob("*.journal")):
+            if path == own_path:
+                continue
+            with path.open("rb") as journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue  # The journal belongs to a live process.
+                pastes = _decode(journal)
+                count = 0
+                try:
+                    while batch := list(itertools.islice(pastes, self._batch_size)):
+                        with db.paster_context() as paster:
+                            paster.create_many(batch)
+                        count += len(batch)
+                except Exception:
+                    # Keep the journal (so the next writer to start can replay it).
+                    current_app.logger.exception(f"{path} could not be replayed.")
+                    continue
+                path.unlink()
+                current_app.logger.info(f"{count} pastes were replayed from {path}.")
+
+
+def init_app(app: Flask) -> None:
+    """Start a writer for the app (if WRITE_BEHIND is set)."""
+    if durability := app.config.get("WRITE_BEHIND"):
+        writer = Writer(
+            app,
+            durability=durability,
+            batch_size=app.config.get("WRITE_BEHIND_BATCH_SIZE", 100),
+            batch_delay=app.config.get("WRITE_BEHIND_BATCH_DELAY", 0.005),
+            queue_size=app.config.get("WRITE_BEHIND_QUEUE_SIZE", 1000),
+            journal_dir=app.config.get("WRITE_BEHIND_JOURNAL"),
+        )
+        app.extensions[EXTENSION] = writer
+        atexit.register(writer.close)
+
+
+def writer() -> Writer | None:
+    """Get the writer for the current app (if any)."""
+    return current_app.extensions.get(EXTENSION)
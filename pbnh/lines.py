@@ -0,0 +1,85 @@
+"""Index and slice text by line.
+
+An index records the offset of every CHECKPOINT_LINES-th line, which allows
+any range of lines to be sliced out of a (potentially huge) paste by seeking
+to the nearest checkpoint and scanning no more than CHECKPOINT_LINES lines.
+Only the bytes between the checkpoints around a range are needed (see window).
+"""
+
+import re
+from typing import Any
+
+CHECKPOINT_LINES = 1024
+INDEX_KIND = "lines"
+
+_RANGE_PATTERN = re.compile(r"(?P<start>-?\d+)(?:-(?P<end>-?\d+)?)?")
+
+
+def build_index(data: bytes) -> dict[str, Any]:
+    """Build a line-offset index of some text."""
+    offsets = [0]
+    count = 0
+    offset = 0
+    while offset := data.find(b"\n", offset) + 1:
+        count += 1
+        if not count % CHECKPOINT_LINES:
+            offsets.append(offset)
+    if not data.endswith(b"\n"):
+        count += bool(data)  # The last line is unterminated.
+    return {"every": CHECKPOINT_LINES, "offsets": offsets, "count": count}
+
+
+def parse_range(spec: str, *, count: int) -> tuple[int, int]:
+    """Resolve a START[-END] line range (e.g. 1000-2000) for some text.
+
+    Lines are 1-based, and the range is inclusive. Negative lines count back
+    from the end (e.g. -1 is the last line), and END defaults to the last line.
+    The returned (start, end) are clamped to the text (so start > end if the
+    range is empty). ValueError is raised if the range is malformed.
+    """
+    match = _RANGE_PATTERN.fullmatch(spec)
+    if not match:
+        raise ValueError(f"{spec!r} is not a START[-END] line range.")
+    start, end = (int(match[group] or -1) for group in ("start", "end"))
+    if not (start and end):
+        raise ValueError("Lines are numbered from 1 (or -1).")
+    if start < 0:
+        start += count + 1
+    if end < 0:
+        end += count + 1
+    return max(start, 1), min(end, count)
+
+
+def window(index: dict[str, Any], *, start: int, end: int) -> tuple[int, int | None]:
+    """Get the byte range of some text that holds lines start through end.
+
+    The range runs from the checkpoint at/before start to the one after end
+    (or the end of the text, if the stop is None).
+    """
+    offsets = index["offsets"]
+    first = min((start - 1) // index["every"], len(offsets) - 1)
+    last = end // index["every"] + 1
+    return offsets[first], offsets[last] if last < len(offsets) else None
+
+
+def _offset(data: bytes, index: dict[str, Any], line: int, base: int) -> int:
+    # Seek to the nearest checkpoint and then scan for the line.
+    checkpoint = min((line - 1) // index["every"], len(index["offsets"]) - 1)
+    offset: int = index["offsets"][checkpoint] - base
+    for _ in range(line - 1 - checkpoint * index["every"]):
+        offset = data.find(b"\n", offset) + 1
+        if not offset:
+            return len(data)
+    return offset
+
+
+def slice_lines(
+    data: bytes, index: dict[str, Any], *, start: int, end: int, base: int = 0
+) -> bytes:
+    """Get lines start through end (1-based and inclusive) of some text.
+
+    data may be just the text from byte base on (e.g. the start of its window).
+    """
+    if start > end:
+        return b""
+    return data[_offset(data, index, start, base) : _offset(data, index, end + 1, base)]
@@ -0,0 +1,279 @@
+"""Generate load against pbnh (and measure its latency).
+
+Requests of each kind (see KINDS) are sent by concurrent threads,
+in proportion to their weights in the mix, for a duration.
+The pastes they retrieve are seeded first, so runs are comparable
+(e.g. between worker classes, pbnh versions, or hosts).
+"""
+
+import contextlib
+import http.client
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+import urllib.parse
+from collections.abc import Callable, Iterator
+from typing import Any
+
+from flask import Flask, current_app
+
+# (method, path, headers, body) -> (status, headers, body)
+Request = Callable[[str, str, dict[str, str], bytes | None], tuple[int, Any, bytes]]
+
+# Each kind of request (and the status that counts as a success):
+KINDS = {
+    "create": 201,
+    "raw": 200,
+    "conditional": 304,
+    "md": 200,
+    "rst": 200,
+    "redirect": 302,
+    "missing": 404,
+}
+MIX_DEFAULT = {
+    "create": 10,
+    "raw": 30,
+    "conditional": 20,
+    "md": 5,
+    "rst": 5,
+    "redirect": 20,
+    "missing": 10,
+}
+SIZES_DEFAULT = (1024, 64 * 1024, 1024 * 1024)  # bytes
+PERCENTILES = (50, 95, 99)
+FORM_HEADERS = {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+def app_request(app: Flask) -> Request:
+    """Send requests to an app (in this process)."""
+    client = app.test_client()
+
+    def _request(
+        method: str, path: str, headers: dict[str, str], body: bytes | None
+    ) -> tuple[int, Any, bytes]:
+        response = client.open(path, method=method, headers=headers, data=body)
+        return response.status_code, response.headers, response.get_data()
+
+    return _request
+
+
+def url_request(url: str) -> Request:
+    """Send requests to a running pbnh (over one persistent connection)."""
+    parts = urllib.parse.urlsplit(url)
+    connection = (
+        http.client.HTTPSConnection
+        if parts.scheme == "https"
+        else http.client.HTTPConnection
+    )(parts.netloc, timeout=60)
+    prefix = parts.path.rstrip("/")
+
+    def _request(
+        method: str, path: str, headers: dict[str, str], body: bytes | None
+    ) -> tuple[int, Any, bytes]:
+        try:
+            connection.request(method, prefix + path, body=body, headers=headers)
+            response = connection.getresponse()
+            return response.status, response.headers, response.read()
+        except Exception:
+            connection.close()  # It is reopened by the next request.
+            raise
+
+    return _request
+
+
+# Settings of the current app that would reach outside of a local app:
+_SHARED_CONFIG = ("CACHE_URL", "CDN_PURGE_URL", "PACK_TIER_INTERVAL")
+_SHARED_DIRS = ("PACK_DIR", "SENDFILE_DIR", "UPLOAD_DIR")
+
+
+@contextlib.contextmanager
+def local_app() -> Iterator[Flask]:
+    """Create an app (configured like the current one) with a temporary DB.
+
+    Nothing the current app shares (e.g. its cache, packs, or CDN) is touched:
+    its directories are replaced with temporary ones, and the rest is left out.
+    """
+    import pbnh
+    from pbnh import bloom, db, ingest, render, tier
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config = {
+            key: value
+            for key, value in current_app.config.items()
+            if key not in _SHARED_CONFIG
+        }
+        for key in _SHARED_DIRS:
+            if config.get(key):
+                config[key] = f"{tmp}/{key.lower()}"
+        app = pbnh.create_app(
+            {
+                **config,
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp}/loadtest.sqlite",
+                # Don't replay (or leave behind) the journals of the real app.
+                "WRITE_BEHIND_JOURNAL": f"{tmp}/journal",
+            }
+        )
+        if app is None:
+            raise RuntimeError("The app could not be created.")
+        with app.app_context():
+            db.init_db()
+        try:
+            yield app
+        finally:
+            with app.app_context():
+                if scheduler := tier.scheduler():
+                    scheduler.close()
+                if writer := ingest.writer():
+                    writer.close()
+                if render_pool := render.pool():
+                    render_pool.close()
+                if paste_filter := bloom.paste_filter():
+                    paste_filter.close()
+                db.dispose()
+
+
+def _form(**fields: str) -> bytes:
+    return urllib.parse.urlencode(fields).encode()
+
+
+def _create(request: Request, **fields: str) -> str:
+    status, _, data = request("POST", "/", FORM_HEADERS, _form(**fields))
+    if status not in {KINDS["create"], 200}:
+        raise RuntimeError(f"A paste could not be created (status {status}).")
+    return str(json.loads(data)["hashid"])
+
+
+def _text(size: int) -> str:
+    # Random content, so that each paste is new:
+    return os.urandom(math.ceil(size / 2)).hex()[:size]
+
+
+def seed(
+    request: Request, *, count: int, sizes: tuple[int, ...] = SIZES_DEFAULT
+) -> dict[str, list[tuple[str, dict[str, str]]]]:
+    """Create pastes to retrieve (and get the path and headers for each kind)."""
+    targets: dict[str, list[tuple[str, dict[str, str]]]] = {
+        kind: [] for kind in KINDS if kind != "create"
+    }
+    for i in range(count):
+        path = f"/{_create(request, content=_text(sizes[i % len(sizes)]))}.txt"
+        targets["raw"].append((path, {}))
+        _, headers, _ = request("GET", path, {}, None)
+        targets["conditional"].append((path, {"If-None-Match": headers["ETag"]}))
+        for kind, mime, markup in [
+            ("md", "text/markdown", "# {}\n\n*{}*\n"),
+            ("rst", "text/x-rst", "{}\n===\n\n*{}*\n"),
+        ]:
+            content = markup.format(i, _text(64))
+            targets[kind].append(
+                (f"/{_create(request, content=content, mime=mime)}", {})
+            )
+        redirect = f"https://example.com/{_text(16)}"
+        targets["redirect"].append((f"/{_create(request, redirect=redirect)}", {}))
+        targets["missing"].append((f"/{_text(40)}", {}))
+    return targets
+
+
+def _schedule(mix: dict[str, int]) -> list[str]:
+    # Interleave the kinds (e.g. a:2, b:1 -> a, b, a) so that any stretch
+    # of the schedule has roughly the same mix.
+    return [
+        kind
+        for _, kind in sorted(
+            ((i / weight, kind) for kind, weight in mix.items() for i in range(weight)),
+        )
+    ]
+
+
+def _percentile(latencies: list[float], percent: float) -> float:
+    # nearest-rank method (of sorted latencies)
+    return latencies[max(math.ceil(percent / 100 * len(latencies)) - 1, 0)]
+
+
+def run(
+    new_request: Callable[[], Request],
+    *,
+    mix: dict[str, int] = MIX_DEFAULT,
+    duration: float = 10.0,
+    concurrency: int = 8,
+    count: int = 20,
+    sizes: tuple[int, ...] = SIZES_DEFAULT,
+) -> dict[str, Any]:
+    """Send a mix of requests (with a new Request per thread), and report on them."""
+    if unknown := mix.keys() - KINDS.keys():
+        raise ValueError(f"{', '.join(sorted(unknown))} are not kinds of requests.")
+    mix = {kind: weight for kind, weight in mix.items() if weight > 0}
+    if not mix:
+        raise ValueError("The mix is empty.")
+    targets = seed(new_request(), count=count, sizes=sizes)
+    schedule = _schedule(mix)
+    latencies: dict[str, list[float]] = {kind: [] for kind in mix}
+    errors = dict.fromkeys(mix, 0)
+    lock = threading.Lock()
+
+    def _work(offset: int) -> None:
+        request = new_request()
+        thread_latencies: dict[str, list[float]] = {kind: [] for kind in mix}
+        thread_errors = dict.fromkeys(mix, 0)
+        i = offset
+        while time.monotonic() < deadline:
+            i += 1
+            kind = schedule[i % len(schedule)]
+            if kind == "create":
+                method, path, headers = "POST", "/", FORM_HEADERS
+                body = _form(content=_text(sizes[i % len(sizes)]))
+            else:
+                method, body = "GET", None
+                path, headers = targets[kind][i % len(targets[kind])]
+            start = time.perf_counter()
+            try:
+                status, _, _ = request(method, path, headers, body)
+            except Exception:
+                status = 0
+            thread_latencies[kind].append(time.perf_counter() - start)
+            if status != KINDS[kind]:
+                thread_errors[kind] += 1
+        with lock:
+            for kind in mix:
+                latencies[kind] += thread_latencies[kind]
+                errors[kind] += thread_errors[kind]
+
+    threads = [
+        threading.Thread(target=_work, args=(i * len(schedule) // concurrency,))
+        for i in range(concurrency)
+    ]
+    start = time.monotonic()
+    deadline = start + duration
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+    requests = sum(len(kind_latencies) for kind_latencies in latencies.values())
+    report: dict[str, Any] = {
+        "duration": elapsed,
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": sum(errors.values()),
+        "throughput": requests / elapsed,
+        "endpoints": {},
+    }
+    for kind, kind_latencies in latencies.items():
+        kind_latencies.sort()
+        report["endpoints"][kind] = {
+            "requests": len(kind_latencies),
+            "errors": errors[kind],
+            "throughput": len(kind_latencies) / elapsed,
+            "latency_ms": {
+                f"p{percent}": (
+                    _percentile(kind_latencies, percent) * 1000
+                    if kind_latencies
+                    else None
+                )
+                for percent in PERCENTILES
+            },
+        }
+    return report
@@ -0,0 +1,435 @@
+"""Keep old pastes in packfiles (when PACK_DIR is set).
+
+`flask paste tier` (or a thread, every PACK_TIER_INTERVAL seconds) moves
+pastes created more than PACK_TIER_AFTER days ago out of the paste table,
+into a new pack in PACK_DIR. A pack is written once, as a file of compressed
+records (NAME.pack) and an index of their hashids (NAME.idx), which is sorted
+so that lookups can binary search it (through mmap). Lookups that miss the
+paste table fall through to the packs, newest first.
+
+Packs are never modified: Removing a packed paste appends its hashid to a
+list of removed entries (NAME.removed), and `flask paste repack` rewrites
+the packs (into one) without removed or expired entries.
+"""
+
+import bisect
+import contextlib
+import fcntl
+import heapq
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from flask import Flask, current_app
+
+EXTENSION = "pbnh.pack"
+TIER_AFTER_DEFAULT = 30  # days
+_INDEX_MAGIC = b"PBNHIDX1"
+_ENTRY = struct.Struct(">20sQQ")  # SHA1 digest, record offset, record length
+_HEADER = struct.Struct(">I")  # metadata length (followed by compressed data)
+_DIGEST_SIZE = 20
+_HASHID = re.compile("[0-9a-f]{40}")
+# Data is decompressed in blocks of (at most) this many bytes.
+_BLOCK_SIZE = 256 * 1024
+
+
+class PackError(Exception):
+    """A pack is corrupt."""
+
+
+def _encode(paste: dict[str, Any], *, level: int) -> bytes:
+    metadata = json.dumps(
+        {key: value for key, value in paste.items() if key != "data"},
+        default=datetime.isoformat,
+    ).encode()
+    return _HEADER.pack(len(metadata)) + metadata + zlib.compress(paste["data"], level)
+
+
+class _Pack:
+    """A pack (opened through mmap)."""
+
+    def __init__(self, index_path: Path) -> None:
+        self.name = index_path.stem
+        self._index = self._map(index_path)
+        if self._index[: len(_INDEX_MAGIC)] != _INDEX_MAGIC:
+            raise PackError(f"{index_path} is not a pack index.")
+        self._count = (len(self._index) - len(_INDEX_MAGIC)) // _ENTRY.size
+        self._data = self._map(index_path.with_suffix(".pack"))
+        self.removed_path = index_path.with_suffix(".removed")
+        self._removed: set[bytes] = set()
+        self._removed_size = 0
+
+    @staticmethod
+    def _map(path: Path) -> mmap.mmap:
+        with path.open("rb") as file:
+            # (The map stays valid after the pack is removed, e.g. by a repack.)
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def paths(self) -> list[Path]:
+        # (The index is first, since a pack exists as long as its index does.)
+        return [self.removed_path.with_suffix(suffix) for suffix in (".idx", ".pack")]
+
+    def _entry(self, position: int) -> tuple[bytes, int, int]:
+        entry: tuple[bytes, int, int] = _ENTRY.unpack_from(
+            self._index, len(_INDEX_MAGIC) + position * _ENTRY.size
+        )
+        return entry
+
+    def removed(self) -> set[bytes]:
+        """Get the digests of the removed entries (which may have just changed)."""
+        try:
+            size = self.removed_path.stat().st_size
+        except FileNotFoundError:
+            size = 0
+        if size != self._removed_size:
+            data = self.removed_path.read_bytes()
+            # (An entry is appended with a single write, but might be cut off.)
+            self._removed = {
+                data[start : start + _DIGEST_SIZE]
+                for start in range(0, len(data) - _DIGEST_SIZE + 1, _DIGEST_SIZE)
+            }
+            self._removed_size = size
+        return self._removed
+
+    def find(self, digest: bytes) -> tuple[int, int] | None:
+        """Find the record of an entry (that hasn't been removed)."""
+        position = bisect.bisect_left(
+            range(self._count), digest, key=lambda i: self._entry(i)[0]
+        )
+        if position == self._count:
+            return None
+        found, offset, length = self._entry(position)
+        if found != digest or digest in self.removed():
+            return None
+        return offset, length
+
+    def entries(self, *, after: str = "") -> Iterator[tuple[bytes, int, int]]:
+        """Get the (digest, offset, length) of every entry (in digest order).
+
+        Only entries with hashids after `after` are included.
+        """
+        removed = self.removed()
+        start = bisect.bisect_right(
+            range(self._count), after, key=lambda i: self._entry(i)[0].hex()
+        )
+        for position in range(start, self._count):
+            if (entry := self._entry(position))[0] not in removed:
+                yield entry
+
+    def record(self, offset: int, length: int) -> bytes:
+        return self._data[offset : offset + length]
+
+    def metadata(self, offset: int) -> tuple[dict[str, Any], int]:
+        """Get the metadata of a record (and the offset of its data)."""
+        (metadata_length,) = _HEADER.unpack_from(self._data, offset)
+        start = offset + _HEADER.size
+        paste = json.loads(self._data[start : start + metadata_length])
+        for key in ("sunset", "timestamp"):
+            if paste[key]:
+                paste[key] = datetime.fromisoformat(paste[key])
+        return paste, start + metadata_length
+
+    def compressed(self, start: int, stop: int) -> memoryview:
+        return memoryview(self._data)[start:stop]
+
+
+class _Writer:
+    """Write a new pack (which only appears once it is published)."""
+
+    def __init__(self, directory: Path, *, level: int) -> None:
+        # Names sort by when packs were written (so newer packs are found first).
+        self.name = f"{time.time_ns():020d}-{os.getpid()}"
+        self._directory = directory
+        self._level = level
+        self._records: dict[bytes, tuple[int, int]] = {}
+        self._temp_path = directory / f"{self.name}.pack.tmp"
+        self._file = self._temp_path.open("xb")
+
+    @property
+    def digests(self) -> set[bytes]:
+        return set(self._records)
+
+    def add_record(self, digest: bytes, record: bytes) -> None:
+        """Add an (encoded) record, unless it is a duplicate."""
+        if digest not in self._records:
+            self._records[digest] = (self._file.tell(), len(record))
+            self._file.write(record)
+
+    def add(self, paste: dict[str, Any]) -> None:
+        """Add a paste (with the metadata and data that a lookup returns)."""
+        self.add_record(
+            bytes.fromhex(paste["hashid"]), _encode(paste, level=self._level)
+        )
+
+    def publish(self, *, removed: Iterable[bytes] = ()) -> None:
+        """Make the pack visible (with some of its entries already removed)."""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._temp_path.replace(self._directory / f"{self.name}.pack")
+        if removed_digests := b"".join(sorted(removed)):
+            (self._directory / f"{self.name}.removed").write_bytes(removed_digests)
+        index_temp_path = self._directory / f"{self.name}.idx.tmp"
+        with index_temp_path.open("xb") as index:
+            index.write(_INDEX_MAGIC)
+            for digest, (offset, length) in sorted(self._records.items()):
+                index.write(_ENTRY.pack(digest, offset, length))
+            index.flush()
+            os.fsync(index.fileno())
+        index_temp_path.replace(self._directory / f"{self.name}.idx")
+        # Make the renames durable (before the pastes are removed from the DB).
+        directory = os.open(self._directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    def discard(self) -> None:
+        self._file.close()
+        self._temp_path.unlink()
+
+
+class Packs:
+    """Packs of pastes in a directory."""
+
+    def __init__(self, directory: str, *, level: int = zlib.Z_DEFAULT_COMPRESSION):
+        self._directory = Path(directory).absolute()
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._level = level
+        self._lock = threading.Lock()
+        self._packs: dict[str, _Pack] = {}
+
+    def _current(self) -> list[_Pack]:
+        # Packs are added (and removed) by other processes, so list them each
+        # time (which is cheap, since lookups only get here on a miss).
+        names = sorted(
+            (path.stem for path in self._directory.glob("*.idx")), reverse=True
+        )
+        with self._lock:
+            if names != list(self._packs):
+                packs = {}
+                for name in names:
+                    try:
+                        packs[name] = self._packs.get(name) or _Pack(
+                            self._directory / f"{name}.idx"
+                        )
+                    except FileNotFoundError:
+                        pass  # It was just removed (e.g. by a repack).
+                self._packs = packs
+            return list(self._packs.values())
+
+    @contextlib.contextmanager
+    def locked(self, name: str, *, blocking: bool = True) -> Iterator[bool]:
+        """Hold a lock (across processes) and get whether it was acquired."""
+        with (self._directory / f"{name}.lock").open("ab") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            yield True
+
+    def _find(self, hashid: str) -> tuple[_Pack, int, int] | None:
+        if not _HASHID.fullmatch(hashid):
+            return None
+        digest = bytes.fromhex(hashid)
+        for pack in self._current():
+            if found := pack.find(digest):
+                return pack, *found
+        return None
+
+    def __contains__(self, hashid: str) -> bool:
+        return self._find(hashid) is not None
+
+    def query(
+        self, hashid: str, *, max_data: int | None = None
+    ) -> dict[str, Any] | None:
+        """Get a packed paste (with data, unless it is larger than max_data)."""
+        if (found := self._find(hashid)) is None:
+            return None
+        pack, offset, length = found
+        paste, start = pack.metadata(offset)
+        if max_data is None or paste["size"] <= max_data:
+            paste["data"] = zlib.decompress(pack.compressed(start, offset + length))
+        return paste
+
+    def read(
+        self,
+        hashid: str,
+        *,
+        chunk_size: int = _BLOCK_SIZE,
+        start: int = 0,
+        stop: int | None = None,
+    ) -> Iterator[bytes]:
+        """Read bytes start:stop of a packed paste (in chunks)."""
+        if (found := self._find(hashid)) is None:
+            return
+        pack, offset, length = found
+        paste, data_start = pack.metadata(offset)
+        stop = paste["size"] if stop is None else min(stop, paste["size"])
+        compressed = pack.compressed(data_start, offset + length)
+        # Compressed data can only be decompressed from the start.
+        decompressor = zlib.decompressobj()
+        position = 0
+        for compressed_start in range(0, len(compressed), chunk_size):
+            chunk: bytes | memoryview = compressed[
+                compressed_start : compressed_start + chunk_size
+            ]
+            while chunk and position < stop:
+                block = decompressor.decompress(chunk, chunk_size)
+                chunk = decompressor.unconsumed_tail
+                if part := block[max(start - position, 0) : stop - position]:
+                    yield part
+                position += len(block)
+
+    def entries(self) -> Iterator[dict[str, Any]]:
+        """Get the metadata of every packed paste (without duplicates)."""
+        seen = set()
+        for pack in self._current():
+            for digest, offset, _ in pack.entries():
+                if digest not in seen:
+                    seen.add(digest)
+                    yield pack.metadata(offset)[0]
+
+    def scan(
+        self, *, after: str = "", through: str | None = None, limit: int = 100
+    ) -> list[dict[str, Any]]:
+        """Get a page of packed pastes (with their data) in hashid order.
+
+        The data of pastes that can't be decompressed is None.
+        """
+        # (Ties go to the newest pack, which is listed first.)
+        found = heapq.merge(
+            *(
+                zip(itertools.repeat(pack), pack.entries(after=after))
+                for pack in self._current()
+            ),
+            key=lambda item: item[1][0],
+        )
+        pastes: list[dict[str, Any]] = []
+        for pack, (digest, offset, length) in found:
+            hashid = digest.hex()
+            if len(pastes) == limit or through is not None and hashid > through:
+                break
+            if pastes and pastes[-1]["hashid"] == hashid:
+                continue  # (It is an older copy.)
+            paste, start = pack.metadata(offset)
+            try:
+                paste["data"] = zlib.decompress(pack.compressed(start, offset + length))
+            except zlib.error:
+                paste["data"] = None
+            pastes.append(paste)
+        return pastes
+
+    def hashids(self) -> Iterator[str]:
+        """Get the hashids of the packed pastes (possibly with duplicates)."""
+        for pack in self._current():
+            for digest, _, _ in pack.entries():
+                yield digest.hex()
+
+    @contextlib.contextmanager
+    def writer(self) -> Iterator[_Writer]:
+        """Write a new pack, which is discarded if it is empty (or on error)."""
+        writer = _Writer(self._directory, level=self._level)
+        try:
+            yield writer
+        except BaseException:
+            writer.discard()
+            raise
+        if writer.digests:
+            writer.publish()
+        else:
+            writer.discard()
+
+    def remove(self, hashid: str, *, pack: str | None = None) -> dict[str, Any] | None:
+        """Remove a packed paste (from every pack, or just one).
+
+        Returns the metadata of the paste (or None if it wasn't packed).
+        """
+        if not _HASHID.fullmatch(hashid):
+            return None
+        digest = bytes.fromhex(hashid)
+        removed = None
+        with self.locked("remove"):  # (so that a repack can't lose it)
+            for current in self._current():
+                if (pack is None or current.name == pack) and (
+                    found := current.find(digest)
+                ):
+                    with current.removed_path.open("ab") as removed_file:
+                        removed_file.write(digest)
+                    removed = removed or current.metadata(found[0])[0]
+        return removed
+
+    def repack(self, *, expired_before: datetime) -> tuple[int, list[dict[str, Any]]]:
+        """Rewrite every pack into one, without removed (or expired) pastes.
+
+        Returns the number of pastes kept, and the metadata of expired pastes.
+        """
+        with self.locked("repack"):  # (one repack at a time)
+            packs = self._current()
+            removed = [pack.removed().copy() for pack in packs]
+            expired = {}
+            writer = _Writer(self._directory, level=self._level)
+            try:
+                for pack in packs:  # (newest first)
+                    for digest, offset, length in pack.entries():
+                        if digest in writer.digests or digest in expired:
+                            continue  # It is a duplicate (from an interrupted tier).
+                        paste = pack.metadata(offset)[0]
+                        if paste["sunset"] and paste["sunset"] <= expired_before:
+                            expired[digest] = paste
+                        else:
+                            writer.add_record(digest, pack.record(offset, length))
+            except BaseException:
+                writer.discard()
+                raise
+            with self.locked("remove"):  # (so that no removal is lost)
+                # Pastes removed since they were read stay removed.
+                newly_removed = set[bytes]().union(
+                    *(pack.removed() - before for pack, before in zip(packs, removed))
+                )
+                if writer.digests:
+                    writer.publish(removed=newly_removed & writer.digests)
+                else:
+                    writer.discard()
+                for pack in packs:
+                    for path in pack.paths():
+                        path.unlink()
+                    pack.removed_path.unlink(missing_ok=True)
+        return len(writer.digests - newly_removed), [
+            paste for digest, paste in expired.items() if digest not in newly_removed
+        ]
+
+    def stats(self) -> dict[str, int]:
+        """Get the number of packs and their total size (in bytes)."""
+        packs = self._current()
+        return {
+            "packs": len(packs),
+            "bytes": sum(
+                path.stat().st_size for pack in packs for path in pack.paths()
+            ),
+        }
+
+
+def init_app(app: Flask) -> None:
+    """Set up packs for the app (if PACK_DIR is set)."""
+    if directory := app.config.get("PACK_DIR"):
+        app.extensions[EXTENSION] = Packs(
+            directory,
+            level=app.config.get("PACK_LEVEL", zlib.Z_DEFAULT_COMPRESSION),
+        )
+
+
+def packs() -> Packs | None:
+    """Get the packs of the current app (if any)."""
+    return current_app.extensions.get(EXTENSION)
@@ -0,0 +1,196 @@
+"""Render markup (with docutils) in a pool of worker processes.
+
+docutils holds the GIL while it renders, so a large (or pathological) paste
+rendered on a request thread would stall every other thread in the worker.
+When RENDER_WORKERS is set, rendering is done by that many processes instead
+(started and warmed up with the app), and each render is limited to
+RENDER_TIMEOUT seconds (including any wait for a free process). A process
+whose render runs out of time is killed (wherever it is stuck, e.g. in C
+code) and replaced, so hostile pastes can't use up the pool.
+"""
+
+import atexit
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing.connection import Connection
+from multiprocessing.context import SpawnContext
+from typing import Any, cast
+
+from docutils.core import publish_string
+from flask import Flask, current_app
+
+EXTENSION = "pbnh.render"
+TIMEOUT_DEFAULT = 10.0  # seconds
+
+
+class RenderError(Exception):
+    pass
+
+
+class RenderTimeout(RenderError):
+    pass
+
+
+def _publish(source: str, *, source_path: str, parser: str) -> bytes:
+    html = publish_string(
+        source,
+        source_path=source_path,
+        parser=parser,
+        writer="html5",
+        settings_overrides={"stylesheet_path": ["minimal.css"]},
+    )
+    return cast(bytes, html)
+
+
+def _work(connection: Connection) -> None:
+    # (This is the main loop of each worker process.)
+    # Import the parsers up front (so the first render is not slower).
+    for parser in ("markdown", "restructuredtext"):
+        _publish("warm-up", source_path="warm-up", parser=parser)
+    while True:
+        try:
+            source, kwargs = connection.recv()
+        except EOFError:
+            return  # The pool was closed.
+        try:
+            result: tuple[str, Any] = ("html", _publish(source, **kwargs))
+        except Exception as exc:
+            result = ("error", exc)
+        connection.send(result)
+
+
+class _Worker:
+    """A worker process (and the connection to it)."""
+
+    def __init__(self, context: SpawnContext) -> None:
+        self.connection, child = context.Pipe()
+        self.process = context.Process(target=_work, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self) -> None:
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class Pool:
+    """Render markup in worker processes (with time limits)."""
+
+    def __init__(self, *, workers: int, timeout: float = TIMEOUT_DEFAULT) -> None:
+        self._workers = workers
+        self._timeout = timeout
+        # Forking a threaded process is unsafe, so workers are spawned.
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(
+            ("active", "completed", "failed", "timed_out", "replaced", "unavailable"),
+            0,
+        )
+        self._closed = False
+        self._started: set[_Worker] = set()
+        self._idle: queue.Queue[_Worker] = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(self._start())
+
+    def _count(self, key: str, delta: int = 1) -> None:
+        with self._lock:
+            self._stats[key] += delta
+
+    def _start(self) -> _Worker:
+        worker = _Worker(self._context)
+        with self._lock:
+            self._started.add(worker)
+        return worker
+
+    def _replace(self, worker: _Worker) -> None:
+        worker.stop()
+        with self._lock:
+            self._started.discard(worker)
+        if not self._closed:
+            self._idle.put(self._start())
+            self._count("replaced")
+
+    @staticmethod
+    def _render(
+        worker: _Worker, request: tuple[str, dict[str, str]], timeout: float
+    ) -> tuple[str, Any]:
+        try:
+            worker.connection.send(request)
+            if worker.connection.poll(timeout):
+                return cast(tuple[str, Any], worker.connection.recv())
+        except (OSError, EOFError) as exc:
+            raise RenderError("The render process died.") from exc
+        raise RenderTimeout("The render did not finish in time.")
+
+    def publish(self, source: str, *, source_path: str, parser: str) -> bytes:
+        """Render markup as HTML (like docutils.core.publish_string)."""
+        if self._closed:
+            self._count("unavailable")
+            raise RenderError("The render pool is closed.")
+        deadline = time.monotonic() + self._timeout
+        self._count("active")
+        try:
+            try:
+                worker = self._idle.get(timeout=self._timeout)
+            except queue.Empty as exc:
+                self._count("timed_out")
+                raise RenderTimeout("No render process was free in time.") from exc
+            try:
+                kind, value = self._render(
+                    worker,
+                    (source, {"source_path": source_path, "parser": parser}),
+                    max(deadline - time.monotonic(), 0),
+                )
+            except RenderError as exc:
+                # The worker may be stuck (e.g. in C code) or dead, so it is replaced.
+                self._replace(worker)
+                self._count("timed_out" if isinstance(exc, RenderTimeout) else "failed")
+                raise
+            self._idle.put(worker)
+            if kind == "error":
+                self._count("failed")
+                raise value
+            self._count("completed")
+            return cast(bytes, value)
+        finally:
+            self._count("active", -1)
+
+    def stats(self) -> dict[str, int]:
+        """Get the number of workers and counts of renders (by outcome)."""
+        with self._lock:
+            return {"workers": self._workers, **self._stats}
+
+    def close(self) -> None:
+        """Stop the workers (abandoning any renders in progress)."""
+        self._closed = True
+        with self._lock:
+            workers = list(self._started)
+            self._started.clear()
+        for worker in workers:
+            worker.stop()
+
+
+def init_app(app: Flask) -> None:
+    """Start a render pool for the app (if RENDER_WORKERS is set)."""
+    if workers := app.config.get("RENDER_WORKERS"):
+        pool = Pool(
+            workers=workers,
+            timeout=app.config.get("RENDER_TIMEOUT", TIMEOUT_DEFAULT),
+        )
+        app.extensions[EXTENSION] = pool
+        atexit.register(pool.close)
+
+
+def pool() -> Pool | None:
+    """Get the render pool for the current app (if any)."""
+    return current_app.extensions.get(EXTENSION)
+
+
+def publish(source: str, *, source_path: str, parser: str) -> bytes:
+    """Render markup as HTML (with the app's pool, if it has one)."""
+    if render_pool := pool():
+        return render_pool.publish(source, source_path=source_path, parser=parser)
+    return _publish(source, source_path=source_path, parser=parser)
@@ -0,0 +1,73 @@
+"""Verify the integrity of stored pastes (including packed pastes).
+
+Pastes are read a page at a time (with a short transaction each, so a scrub
+can run against a live DB), and their data is checked by a pool of processes
+while the next page is read. Only two pages are held in memory at once.
+"""
+
+import concurrent.futures
+import functools
+import hashlib
+import multiprocessing
+from collections.abc import Iterator
+from typing import Any
+
+import magic
+
+from pbnh import db
+
+
+def check(paste: dict[str, Any], *, mime: bool = False) -> list[str]:
+    """Find problems with a paste (as returned by _Paster.scan)."""
+    data = paste["data"]
+    if data is None:
+        return ["the data is missing"]
+    problems = []
+    digest = hashlib.sha1(data, usedforsecurity=False).hexdigest()
+    if digest != paste["hashid"]:
+        problems.append(f"the data hashes to {digest}")
+    if paste["size"] is not None and paste["size"] != len(data):
+        problems.append(f"the size is {paste['size']} (instead of {len(data)})")
+    if mime:
+        # MIME types may be given when pastes are created (e.g. text/markdown),
+        # so only disagreements about the type (e.g. text vs. image) count.
+        detected = magic.from_buffer(data, mime=True)
+        if detected.split("/")[0] != str(paste["mime"]).split("/")[0]:
+            problems.append(
+                f"the MIME type is {paste['mime']} (but {detected} was detected)"
+            )
+    return problems
+
+
+def _page(*, after: str, through: str | None, limit: int) -> list[dict[str, Any]]:
+    with db.paster_context() as paster:
+        return paster.scan(after=after, through=through, limit=limit)
+
+
+def scrub(
+    *,
+    after: str = "",
+    through: str | None = None,
+    batch_size: int = 100,
+    jobs: int | None = None,
+    mime: bool = False,
+) -> Iterator[tuple[str, int, list[tuple[str, list[str]]]]]:
+    """Check pastes in hashid order (after a hashid, and through another).
+
+    For each page, the last hashid (to resume after), the number of pastes,
+    and the (hashid, problems) of each paste with problems are yielded.
+    """
+    page = _page(after=after, through=through, limit=batch_size)
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        while page:
+            results = pool.map(functools.partial(check, mime=mime), page)
+            last = page[-1]["hashid"]
+            next_page = _page(after=last, through=through, limit=batch_size)
+            yield last, len(page), [
+                (paste["hashid"], problems)
+                for paste, problems in zip(page, results)
+                if problems
+            ]
+            page = next_page
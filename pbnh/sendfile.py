@@ -0,0 +1,106 @@
+"""Hand raw pastes to the front proxy to serve (when SENDFILE_DIR is set).
+
+Paste data is materialized (the first time it is served) in files named by
+hashid, which the proxy can read. Raw responses then only have headers,
+including SENDFILE_HEADER: X-Accel-Redirect (for nginx, with a URI of
+SENDFILE_PREFIX + the file's path in the directory) or X-Sendfile (for Apache
+and lighttpd, with the file's full path). Files of removed pastes are removed
+by `flask paste remove` (and `purge`), and of expired pastes by
+`flask paste clean-files`.
+"""
+
+import os
+import re
+import threading
+from collections.abc import Iterable, Iterator
+from datetime import datetime, timezone
+from pathlib import Path
+
+from flask import Flask, current_app
+
+EXTENSION = "pbnh.sendfile"
+HEADERS = ("X-Accel-Redirect", "X-Sendfile")
+# Other "pastes" (e.g. about, which varies by host) are never materialized.
+_HASHID = re.compile("[0-9a-f]{40}")
+
+
+class Files:
+    """Paste data materialized in a directory."""
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        header: str = HEADERS[0],
+        prefix: str | None = None,
+    ) -> None:
+        if header not in HEADERS:
+            raise ValueError(f"{header} is not a supported SENDFILE_HEADER.")
+        self._directory = Path(directory).absolute()
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._header = header
+        self._prefix = prefix or f"{self._directory}/"
+
+    @staticmethod
+    def servable(hashid: str) -> bool:
+        """Get whether a paste can be materialized."""
+        return bool(_HASHID.fullmatch(hashid))
+
+    def _path(self, hashid: str) -> Path:
+        # (Subdirectories keep each directory small.)
+        return self._directory / hashid[:2] / hashid
+
+    def headers(self, hashid: str) -> dict[str, str]:
+        """Get the headers that make the proxy serve a paste."""
+        if self._header == "X-Sendfile":
+            return {self._header: str(self._path(hashid))}
+        return {self._header: f"{self._prefix}{hashid[:2]}/{hashid}"}
+
+    def materialize(
+        self, hashid: str, chunks: Iterable[bytes], *, timestamp: datetime
+    ) -> None:
+        """Write the data of a paste (unless it is already materialized)."""
+        path = self._path(hashid)
+        if path.exists():
+            return
+        path.parent.mkdir(exist_ok=True)
+        # Write a temporary file first (so the proxy never serves a partial one).
+        temp_path = path.with_suffix(f".{os.getpid()}-{threading.get_ident()}")
+        with temp_path.open("wb") as temp_file:
+            for chunk in chunks:
+                temp_file.write(chunk)
+        # The proxy's Last-Modified header should match pbnh's.
+        mtime = timestamp.replace(tzinfo=timezone.utc).timestamp()
+        os.utime(temp_path, (mtime, mtime))
+        temp_path.replace(path)
+
+    def remove(self, hashid: str) -> bool:
+        """Remove the file of a paste (and get whether it existed)."""
+        if not self.servable(hashid):
+            return False
+        try:
+            self._path(hashid).unlink()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def hashids(self) -> Iterator[str]:
+        """Get the hashids of the materialized pastes."""
+        for path in self._directory.glob("??/*"):
+            if self.servable(path.name):
+                yield path.name
+
+
+def init_app(app: Flask) -> None:
+    """Set up materialized pastes for the app (if SENDFILE_DIR is set)."""
+    if directory := app.config.get("SENDFILE_DIR"):
+        app.extensions[EXTENSION] = Files(
+            directory,
+            header=app.config.get("SENDFILE_HEADER", HEADERS[0]),
+            prefix=app.config.get("SENDFILE_PREFIX"),
+        )
+
+
+def files() -> Files | None:
+    """Get the materialized pastes of the current app (if any)."""
+    return current_app.extensions.get(EXTENSION)
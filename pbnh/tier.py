@@ -0,0 +1,84 @@
+"""Move old pastes into packs on a schedule (when PACK_TIER_INTERVAL is set).
+
+Every PACK_TIER_INTERVAL seconds, a thread in each worker moves pastes created
+more than PACK_TIER_AFTER days ago into packs (like `flask paste tier`), unless
+another worker (or `flask paste tier`) is already moving them.
+"""
+
+import atexit
+import threading
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask, current_app
+
+from pbnh import db, pack
+
+EXTENSION = "pbnh.tier"
+LIMIT_DEFAULT = 10000  # pastes per pack
+
+
+class Scheduler:
+    """Move old pastes into packs periodically (with a thread)."""
+
+    def __init__(
+        self,
+        app: Flask,
+        *,
+        interval: float,
+        after: float = pack.TIER_AFTER_DEFAULT,
+        limit: int = LIMIT_DEFAULT,
+    ) -> None:
+        self._app = app
+        self._interval = interval
+        self._after = timedelta(days=after)
+        self._limit = limit
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def tier(self) -> int:
+        """Move old pastes into packs (and get how many were moved)."""
+        packs = pack.packs()
+        if packs is None:
+            raise db.PasteDBError("PACK_DIR is not set in the config.")
+        moved = 0
+        with packs.locked("tier", blocking=False) as acquired:
+            if not acquired:
+                return moved  # Another worker is moving them.
+            before = datetime.now(timezone.utc).replace(tzinfo=None) - self._after
+            with db.paster_context() as paster:
+                while result := paster.tier(before=before, limit=self._limit):
+                    moved += result[1]
+        return moved
+
+    def _run(self) -> None:
+        with self._app.app_context():
+            while not self._closed.wait(self._interval):
+                try:
+                    if moved := self.tier():
+                        current_app.logger.info(f"{moved} pastes were moved to packs.")
+                except Exception:
+                    current_app.logger.exception("Old pastes were not moved to packs.")
+
+    def close(self) -> None:
+        """Stop moving pastes."""
+        self._closed.set()
+        self._thread.join()
+
+
+def init_app(app: Flask) -> None:
+    """Start a scheduler for the app (if PACK_TIER_INTERVAL is set)."""
+    if interval := app.config.get("PACK_TIER_INTERVAL"):
+        scheduler = Scheduler(
+            app,
+            interval=interval,
+            after=app.config.get("PACK_TIER_AFTER", pack.TIER_AFTER_DEFAULT),
+            limit=app.config.get("PACK_TIER_LIMIT", LIMIT_DEFAULT),
+        )
+        app.extensions[EXTENSION] = scheduler
+        atexit.register(scheduler.close)
+
+
+def scheduler() -> Scheduler | None:
+    """Get the scheduler for the current app (if any)."""
+    return current_app.extensions.get(EXTENSION)
@@ -0,0 +1,69 @@
+"""Time the phases of each request (when SERVER_TIMING is set).
+
+The duration of each phase (e.g. querying the DB or rendering the paste) is
+reported in a Server-Timing header (which browsers show in their devtools)
+and in a JSON line that is logged for the request.
+"""
+
+import contextlib
+import json
+import time
+from collections.abc import Iterator
+
+from flask import Flask, Response, current_app, g, request
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a phase of the current request (if it is being timed)."""
+    timings: dict[str, float] | None = g.get("timings")
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # Phases that repeat (e.g. queries) are summed.
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+
+def _start() -> None:
+    if current_app.config.get("SERVER_TIMING"):
+        g.timings = {}
+        g.timing_start = time.perf_counter()
+
+
+def _finish(response: Response) -> Response:
+    timings: dict[str, float] | None = g.get("timings")
+    if timings is None:
+        return response
+    durations = {
+        name: round(seconds * 1000, 3)  # milliseconds
+        for name, seconds in {
+            **timings,
+            "total": time.perf_counter() - g.timing_start,
+        }.items()
+    }
+    response.headers["Server-Timing"] = ", ".join(
+        f"{name};dur={duration}" for name, duration in durations.items()
+    )
+    current_app.logger.info(
+        json.dumps(
+            {
+                "method": request.method,
+                "path": request.path,
+                "endpoint": request.endpoint,
+                "status": response.status_code,
+                "duration_ms": durations.pop("total"),
+                "phases_ms": durations,
+            }
+        )
+    )
+    return response
+
+
+def init_app(app: Flask) -> None:
+    """Time the app's requests (if SERVER_TIMING is set)."""
+    app.before_request(_start)
+    app.after_request(_finish)
@@ -0,0 +1,269 @@
+"""Stage resumable uploads on disk (when UPLOAD_DIR is set).
+
+An upload is created with its size, its chunks are written at their offsets
+(in any order, and retried as needed), and then it is finished as a paste.
+Each upload is a data file (of its full size) and a JSON state file,
+which is updated under a lock, so chunks can be sent to any worker on the host.
+Uploads that go UPLOAD_TTL seconds without a request are removed.
+
+The received prefix of each upload is hashed as its chunks arrive (by each
+worker they are sent to, since a hash can't be handed over), so finishing
+an upload only hashes what that worker hasn't, and the data is then
+streamed from its file.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import re
+import threading
+import time
+import uuid
+from collections.abc import Iterator
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any
+
+from flask import Flask, current_app
+
+EXTENSION = "pbnh.upload"
+TTL_DEFAULT = 24 * 60 * 60  # seconds
+MAX_BYTES_DEFAULT = 1024 * 1024 * 1024  # (PostgreSQL can't store larger pastes.)
+_BLOCK_SIZE = 1024 * 1024
+_ID = re.compile("[0-9a-f]{32}")
+
+
+class UploadError(Exception):
+    """An upload request was invalid."""
+
+
+class UploadNotFound(UploadError):
+    pass
+
+
+class UploadIncomplete(UploadError):
+    pass
+
+
+def _merge(ranges: list[list[int]], start: int, stop: int) -> list[list[int]]:
+    merged: list[list[int]] = []
+    for range_ in sorted([*ranges, [start, stop]]):
+        if merged and range_[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], range_[1])
+        else:
+            merged.append(range_)
+    return merged
+
+
+def _mtime(path: Path) -> float | None:
+    try:
+        return path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+
+class Uploads:
+    """Uploads staged in a directory."""
+
+    def __init__(self, directory: str, *, ttl: float = TTL_DEFAULT) -> None:
+        self._directory = Path(directory)
+        self._directory.mkdir(parents=True, exist_ok=True)
+        self._ttl = ttl
+        # upload ID -> (the number of bytes hashed, the hash so far)
+        self._hashes: dict[str, tuple[int, Any]] = {}
+        self._hashes_lock = threading.Lock()
+
+    def _paths(self, upload_id: str) -> tuple[Path, Path]:
+        if not _ID.fullmatch(upload_id):
+            raise UploadNotFound(upload_id)
+        return (
+            self._directory / f"{upload_id}.json",
+            self._directory / f"{upload_id}.data",
+        )
+
+    @contextlib.contextmanager
+    def _state(self, upload_id: str) -> Iterator[dict[str, Any]]:
+        # Chunks can be written concurrently (by different workers), so the
+        # state is read and written back under a lock.
+        state_path, _ = self._paths(upload_id)
+        try:
+            state_file = state_path.open("r+")
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id) from None
+        with state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            state: dict[str, Any] = json.load(state_file)
+            yield state
+            # (This also marks the upload as active.)
+            state_file.seek(0)
+            state_file.truncate()
+            json.dump(state, state_file)
+
+    @staticmethod
+    def _progress(upload_id: str, state: dict[str, Any]) -> dict[str, Any]:
+        return {
+            "id": upload_id,
+            "size": state["size"],
+            "received": sum(stop - start for start, stop in state["ranges"]),
+            "ranges": state["ranges"],
+        }
+
+    def _hash(self, upload_id: str, data_file: IO[bytes], *, stop: int) -> str:
+        # Hash (more of) the data, through byte stop.
+        with self._hashes_lock:
+            hashed, digest = self._hashes.get(upload_id) or (
+                0,
+                hashlib.sha1(usedforsecurity=False),
+            )
+            if hashed < stop:
+                data_file.seek(hashed)
+                while hashed < stop and (
+                    block := data_file.read(min(stop - hashed, _BLOCK_SIZE))
+                ):
+                    digest.update(block)
+                    hashed += len(block)
+                self._hashes[upload_id] = hashed, digest
+            return str(digest.hexdigest())
+
+    def create(
+        self,
+        *,
+        size: int,
+        mime: str | None = None,
+        sunset: datetime | None = None,
+        ip: str | None = None,
+    ) -> str:
+        """Start an upload (and get its ID)."""
+        self.clean()
+        upload_id = uuid.uuid4().hex
+        state_path, data_path = self._paths(upload_id)
+        with data_path.open("wb") as data_file:
+            data_file.truncate(size)  # (sparsely)
+        temp_path = state_path.with_suffix(".tmp")
+        temp_path.write_text(
+            json.dumps(
+                {
+                    "size": size,
+                    "mime": mime,
+                    "sunset": sunset and sunset.isoformat(),
+                    "ip": ip,
+                    "ranges": [],  # [start, stop) of the chunks received
+                }
+            )
+        )
+        temp_path.replace(state_path)
+        return upload_id
+
+    def write(
+        self,
+        upload_id: str,
+        *,
+        start: int,
+        stop: int,
+        stream: IO[bytes],
+        size: int | None = None,
+    ) -> dict[str, Any]:
+        """Write a chunk of an upload (and get its progress).
+
+        size (e.g. from a Content-Range header) is checked if it is given.
+        """
+        _, data_path = self._paths(upload_id)
+        with self._state(upload_id) as state:
+            upload_size = state["size"]
+        if size is not None and size != upload_size:
+            raise UploadError(f"The upload is {upload_size} bytes (not {size}).")
+        if not 0 <= start < stop <= upload_size:
+            raise UploadError(
+                f"The chunk ({start}-{stop - 1}) is outside of the upload"
+                f" (0-{upload_size - 1})."
+            )
+        # The data is written without the lock, so chunks can be written at once.
+        try:
+            data_file = data_path.open("r+b")
+        except FileNotFoundError:
+            raise UploadNotFound(upload_id) from None
+        with data_file:
+            data_file.seek(start)
+            remaining = stop - start
+            while remaining and (block := stream.read(min(remaining, _BLOCK_SIZE))):
+                data_file.write(block)
+                remaining -= len(block)
+        if remaining:
+            raise UploadError(f"The chunk is {remaining} bytes shorter than its range.")
+        with self._state(upload_id) as state:
+            state["ranges"] = _merge(state["ranges"], start, stop)
+            progress = self._progress(upload_id, state)
+        if (prefix := progress["ranges"][0])[0] == 0:
+            with data_path.open("rb") as prefix_file:
+                self._hash(upload_id, prefix_file, stop=prefix[1])
+        return progress
+
+    def progress(self, upload_id: str) -> dict[str, Any]:
+        """Get the progress of an upload."""
+        with self._state(upload_id) as state:
+            return self._progress(upload_id, state)
+
+    @contextlib.contextmanager
+    def open(self, upload_id: str) -> Iterator[tuple[IO[bytes], dict[str, Any]]]:
+        """Open a complete upload (and get the arguments to create it with)."""
+        _, data_path = self._paths(upload_id)
+        with self._state(upload_id) as state:
+            if state["ranges"] != [[0, state["size"]]]:
+                progress = self._progress(upload_id, state)
+                raise UploadIncomplete(
+                    f"{progress['received']} of {state['size']} bytes were received."
+                )
+            data_file = data_path.open("rb")
+        with data_file:
+            hashid = self._hash(upload_id, data_file, stop=state["size"])
+            data_file.seek(0)
+            yield data_file, {
+                "mime": state["mime"],
+                "sunset": state["sunset"] and datetime.fromisoformat(state["sunset"]),
+                "ip": state["ip"],
+                "hashid": hashid,
+            }
+
+    def remove(self, upload_id: str) -> bool:
+        """Remove an upload (and get whether it existed)."""
+        state_path, data_path = self._paths(upload_id)
+        existed = _mtime(state_path) is not None
+        state_path.unlink(missing_ok=True)
+        data_path.unlink(missing_ok=True)
+        with self._hashes_lock:
+            self._hashes.pop(upload_id, None)
+        return existed
+
+    def clean(self) -> int:
+        """Remove uploads that have gone the TTL without a request.
+
+        Returns the number of uploads removed.
+        """
+        cutoff = time.time() - self._ttl
+        removed = 0
+        for path in self._directory.iterdir():
+            # Only the state file is updated by each request.
+            mtime = _mtime(path.with_suffix(".json")) or _mtime(path)
+            if mtime is not None and mtime < cutoff:
+                removed += path.suffix == ".json"
+                path.unlink(missing_ok=True)
+        with self._hashes_lock:
+            # (Uploads may have been removed by other workers.)
+            for upload_id in list(self._hashes):
+                if _mtime(self._directory / f"{upload_id}.json") is None:
+                    del self._hashes[upload_id]
+        return removed
+
+
+def init_app(app: Flask) -> None:
+    """Set up uploads for the app (if UPLOAD_DIR is set)."""
+    if directory := app.config.get("UPLOAD_DIR"):
+        app.extensions[EXTENSION] = Uploads(
+            directory, ttl=app.config.get("UPLOAD_TTL", TTL_DEFAULT)
+        )
+
+
+def uploads() -> Uploads | None:
+    """Get the uploads of the current app (if any)."""
+    return current_app.extensions.get(EXTENSION)
@@ -1,29 +1,67 @@
+import base64
+import contextlib
 import functools
 import hashlib
+import hmac
 import json
+import math
 import mimetypes
 import urllib.parse
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator
 from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Any, cast
+from typing import IO, Any, cast
 
 import flask.typing
-from docutils.core import publish_string
 from flask import (
     Blueprint,
     Response,
     abort,
+    current_app,
     make_response,
     redirect,
     render_template,
     request,
+    stream_with_context,
+)
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.http import parse_content_range_header
+
+from pbnh import (
+    archive,
+    asciicast,
+    bloom,
+    cache,
+    db,
+    ingest,
+    lines,
+    render,
+    sendfile,
+    timing,
+    upload,
 )
-
-from pbnh import db
 
 blueprint = Blueprint("views", __name__)
-REDIRECT_MIME = "text/x.pbnh.redirect"
+REDIRECT_MIME = db.REDIRECT_MIME
+
+# Raw paste data is content-addressed, so it never changes (until it is removed).
+# Rendered pastes also depend on pbnh itself, so they are revalidated by default.
+# Policies can be overridden per mode with the CACHE_CONTROL config key.
+CACHE_CONTROL_DEFAULT = "no-cache"
+CACHE_CONTROL_DEFAULTS = {
+    "raw": "public, max-age=31536000, immutable",
+    "member": "public, max-age=31536000, immutable",  # of an archive
+}
+
+# Raw pastes larger than this (in bytes) are streamed from the DB in chunks this size,
+# so that workers never hold all of a large paste in memory:
+STREAM_CHUNK_SIZE_DEFAULT = 256 * 1024
+
+# Rendering modes (which take precedence over members at the root of archives):
+MODES = {"cast", "md", "members", "raw", "redirect", "rst", "text", "txt"}
+
+# Query params (and their defaults) for slicing a time range out of an asciicast:
+ASCIICAST_RANGE_ARGS = {"start": 0.0, "end": math.inf}
 
 # https://github.com/asciinema/asciinema/issues/224
 mimetypes.add_type("application/x-asciicast", ".cast", strict=False)
@@ -59,7 +97,34 @@ def _etag(paste: dict[str, Any], extension: str, mode: str) -> str:
     return etag
 
 
-def _get_paste(hashid: str) -> dict[str, Any]:
+def _as_utc(timestamp: datetime) -> datetime:
+    # The DB returns naive timestamps (in UTC).
+    return timestamp.replace(tzinfo=timezone.utc)
+
+
+def _set_cache_headers(response: Response, paste: dict[str, Any], mode: str) -> None:
+    hashid = paste["hashid"]
+    if hashid == "about":
+        # The about page is not content-addressed.
+        response.headers["Cache-Control"] = CACHE_CONTROL_DEFAULT
+        return
+    policies = {**CACHE_CONTROL_DEFAULTS, **current_app.config.get("CACHE_CONTROL", {})}
+    response.headers["Cache-Control"] = policies.get(mode, CACHE_CONTROL_DEFAULT)
+    if (max_age := response.cache_control.max_age) is not None:
+        now = datetime.now(timezone.utc)
+        expires = now + timedelta(seconds=max_age)
+        if paste["sunset"] and (sunset := _as_utc(paste["sunset"])) < expires:
+            # Caches must not outlive the paste.
+            expires = max(sunset, now)
+            response.cache_control.max_age = int((expires - now).total_seconds())
+        response.expires = expires
+    response.last_modified = _as_utc(paste["timestamp"])
+    # Surrogate keys allow a CDN to purge every variant of a paste (or mode) at once.
+    response.headers["Surrogate-Key"] = f"{hashid} mode/{mode}"
+
+
+def _get_paste(hashid: str, *, max_data: int | None = None) -> dict[str, Any]:
+    # If max_data is set, larger data is left out (to be streamed).
     if hashid == "about":
         about_path = Path(__file__).parent / "static" / "about.md"
         about_text = about_path.read_text().replace("pbnh.example.com", request.host)
@@ -71,8 +136,37 @@ def _get_paste(hashid: str) -> dict[str, Any]:
             "sunset": None,
             "timestamp": request.date,
         }
+    if (paste := cache.get_paste(hashid)) is not None:
+        return paste
+    if _definitely_missing(hashid):
+        abort(404)
+    with db.paster_context() as paster, timing.phase("query"):
+        if max_data is None:
+            paste = paster.query(hashid=hashid)
+        else:
+            paste = paster.query_metadata(hashid=hashid, max_data=max_data)
+    if paste is not None and "data" in paste:
+        cache.set_paste(paste)
+    if paste is None and (writer := ingest.writer()):
+        paste = writer.pending(hashid)
+    if paste is None and (paste_filter := bloom.paste_filter()):
+        paste_filter.false_positive()
+    return paste or abort(404)
+
+
+def _definitely_missing(hashid: str) -> bool:
+    # Scanners (and broken links) shouldn't cost a query each.
+    if hashid == "about" or not (paste_filter := bloom.paste_filter()):
+        return False
+    return not paste_filter.might_contain(hashid)
+
+
+def _read(hashid: str, *, start: int = 0, stop: int | None = None) -> Iterator[bytes]:
+    chunk_size = current_app.config.get("STREAM_CHUNK_SIZE", STREAM_CHUNK_SIZE_DEFAULT)
     with db.paster_context() as paster:
-        return paster.query(hashid=hashid) or abort(404)
+        yield from paster.read(
+            hashid=hashid, chunk_size=chunk_size, start=start, stop=stop
+        )
 
 
 def _guess_extension(mime: str) -> str:
@@ -110,54 +204,228 @@ class _RenderRequest:
         self.paste = paste
         self.extension = extension
 
+    def _data(self) -> bytes:
+        if "data" not in self.paste:
+            # The data was left out (to be streamed), but all of it is needed.
+            self.paste = _get_paste(self.paste["hashid"])
+        return cast(bytes, self.paste["data"])
+
     def _render_asciicast(self) -> str:
         extension = self.extension or "cast"
+        url = f"/{self.paste['hashid']}.{extension}"
+        # Time ranges are sliced by the server (see _trimmed_asciicast).
+        if time_range := {
+            key: value
+            for key, value in request.args.items()
+            if key in ASCIICAST_RANGE_ARGS
+        }:
+            url += "?" + urllib.parse.urlencode(time_range)
         # Prepare query params such that
         # {{params|tojson}} produces a valid JS object:
         params = {}
         for key, value in request.args.items():
+            if key in ASCIICAST_RANGE_ARGS:
+                continue
             try:
                 params[key] = json.loads(value)
             except json.JSONDecodeError:
                 params[key] = str(value)
         params.setdefault("preload", True)
-        return render_template(
-            "asciinema.html.jinja",
-            url=f"/{self.paste['hashid']}.{extension}",
-            params=params,
-        )
+        return render_template("asciinema.html.jinja", url=url, params=params)
+
+    def _index(
+        self, kind: str, build: Callable[[bytes], dict[str, Any]]
+    ) -> dict[str, Any]:
+        hashid = self.paste["hashid"]
+        with db.paster_context() as paster:
+            if index := paster.query_index(hashid=hashid, kind=kind):
+                return cast(dict[str, Any], json.loads(index))
+            # Build the index on first use (and save it for next time).
+            new_index = build(self._data())
+            paster.create_index(
+                hashid=hashid, kind=kind, data=json.dumps(new_index).encode()
+            )
+        return new_index
+
+    def _trimmed_asciicast(self) -> bytes:
+        time_range = {}
+        for key in ASCIICAST_RANGE_ARGS:
+            try:
+                time_range[key] = float(
+                    request.args.get(key, ASCIICAST_RANGE_ARGS[key])
+                )
+            except ValueError as exc:
+                abort(400, f"{key}: {exc}")
+            # NaN and infinities would make the asciicast invalid JSON
+            # (but the default end is unbounded).
+            if not math.isfinite(time_range[key]) and key in request.args:
+                abort(400, f"{key} must be a finite number of seconds.")
+        try:
+            index = self._index(asciicast.INDEX_KIND, asciicast.build_index)
+            # Only the header and the window around the range are fetched.
+            base, stop = asciicast.window(index, **time_range)
+            return asciicast.trim(
+                b"".join(self._read_range(0, index["header_end"])),
+                b"".join(self._read_range(base, stop)),
+                index,
+                **time_range,
+            )
+        except asciicast.AsciicastError as exc:
+            abort(422, f"The paste cannot be sliced as an asciicast ({exc}).")
+
+    def _sliced_lines(self, spec: str) -> tuple[bytes, str]:
+        if self.paste["hashid"] == "about":
+            index = lines.build_index(self._data())
+        else:
+            index = self._index(lines.INDEX_KIND, lines.build_index)
+        try:
+            start, end = lines.parse_range(spec, count=index["count"])
+        except ValueError as exc:
+            abort(400, f"lines: {exc}")
+        data = b""
+        if start <= end:
+            # Only the window around the lines is fetched (not the whole paste).
+            base, stop = lines.window(index, start=start, end=end)
+            data = lines.slice_lines(
+                b"".join(self._read_range(base, stop)),
+                index,
+                start=start,
+                end=end,
+                base=base,
+            )
+        line_range = f"{start}-{end}" if start <= end else "*"
+        return data, f"lines {line_range}/{index['count']}"
 
     def _render_docutils(self, *, parser: str) -> Response:
+        max_size = current_app.config.get("RENDER_MAX_BYTES")
+        if max_size is not None and len(self._data()) > max_size:
+            abort(413, f"Pastes larger than {max_size} bytes cannot be rendered.")
         source_path = self.paste["hashid"]
         if self.extension:
             source_path += f".{self.extension}"
-        return make_response(
-            publish_string(
-                _decoded_data(self.paste["data"]),
-                source_path=source_path,
-                parser=parser,
-                writer="html5",
-                settings_overrides={"stylesheet_path": ["minimal.css"]},
-            )
-        )
+        # Renders outlive removed pastes, but are only served once the paste is found.
+        key = f"render/{parser}/{source_path}"
+        if (html := cache.get(key)) is None:
+            try:
+                html = render.publish(
+                    _decoded_data(self._data()),
+                    source_path=source_path,
+                    parser=parser,
+                )
+            except render.RenderError as exc:
+                abort(503, f"The paste cannot be rendered right now ({exc}).")
+            cache.set(key, html, sunset=self.paste["sunset"])
+        return make_response(html)
 
     def _render_raw(self) -> Response:
-        return Response(
-            self.paste["data"],
-            mimetype=_guess_mime(request.url) if self.extension else self.paste["mime"],
-        )
+        headers = {}
+        mime = _guess_mime(request.path) if self.extension else self.paste["mime"]
+        # Asciicasts may be stored as text (e.g. if the MIME type was guessed),
+        # so the extension counts too.
+        is_asciicast = "cast" in {
+            _mode_for_mime(self.paste["mime"]),
+            _mode_for_mime(mime),
+        }
+        if is_asciicast and request.args.keys() & ASCIICAST_RANGE_ARGS.keys():
+            data = self._trimmed_asciicast()
+        elif "lines" in request.args:
+            data, headers["X-Line-Range"] = self._sliced_lines(request.args["lines"])
+        elif (files := sendfile.files()) and files.servable(self.paste["hashid"]):
+            # The proxy serves the data (from a file, so no worker is tied up).
+            files.materialize(
+                self.paste["hashid"],
+                (
+                    [self.paste["data"]]
+                    if "data" in self.paste
+                    else _read(self.paste["hashid"])
+                ),
+                timestamp=self.paste["timestamp"],
+            )
+            headers.update(files.headers(self.paste["hashid"]))
+            return Response(headers=headers, mimetype=mime)
+        elif "data" in self.paste:
+            data = self.paste["data"]
+        else:
+            headers["Content-Length"] = str(self.paste["size"])
+            return Response(
+                stream_with_context(_read(self.paste["hashid"])),
+                headers=headers,
+                mimetype=mime,
+            )
+        return Response(data, headers=headers, mimetype=mime)
 
     def _render_redirect(self) -> flask.typing.ResponseReturnValue:
         if self.extension:
             abort(400, "Extensions are not supported for redirects.")
-        return redirect(_decoded_data(self.paste["data"]), 302)
+        return redirect(_decoded_data(self._data()), 302)
 
     def _render_text(self) -> str:
         extension = self.extension or _guess_extension(self.paste["mime"])
         return render_template(
-            "editor.html.jinja", url=f"/{self.paste['hashid']}.{extension}"
+            "editor.html.jinja",
+            url=f"/{self.paste['hashid']}.{extension}",
+            page_lines=current_app.config.get("EDITOR_PAGE_LINES", 10000),
         )
 
+    def _archive_index(self) -> dict[str, Any]:
+        try:
+            return self._index(archive.INDEX_KIND, archive.build_index)
+        except archive.ArchiveError as exc:
+            abort(422, f"The paste cannot be read as an archive ({exc}).")
+
+    def _render_members(self) -> dict[str, Any]:
+        index = self._archive_index()
+        return {
+            "format": index["format"],
+            "members": [
+                {"name": name, "size": member["size"]}
+                for name, member in index["members"].items()
+            ],
+        }
+
+    def _read_range(self, start: int, stop: int | None) -> Iterable[bytes]:
+        if "data" in self.paste:
+            return [self.paste["data"][start:stop]]
+        return _read(self.paste["hashid"], start=start, stop=stop)
+
+    def member(self, name: str) -> Response:
+        """Serve a member of an archive (found with its index)."""
+        try:
+            member = self._archive_index()["members"][name]
+        except KeyError:
+            abort(404, f"The archive has no member {name}.")
+        with timing.phase("etag"):
+            etag = _etag(self.paste, self.extension, f"member/{name}")
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            size = member["size"]
+            start, stop, content_range = 0, size, None
+            # Members never change, so only a mismatched If-Range voids a Range.
+            if request.range and request.if_range.etag in {None, etag}:
+                if (bounds := request.range.range_for_length(size)) is None:
+                    raise RequestedRangeNotSatisfiable(length=size)
+                start, stop = bounds
+                content_range = request.range.to_content_range_header(size)
+            try:
+                chunks = archive.read_member(
+                    self._read_range, member, start=start, stop=stop
+                )
+            except archive.ArchiveError as exc:
+                abort(422, f"The member cannot be extracted ({exc}).")
+            response = Response(
+                stream_with_context(chunks),
+                206 if content_range else 200,
+                headers={"Content-Length": str(stop - start)},
+                mimetype=_guess_mime(name) or "application/octet-stream",
+            )
+            if content_range:
+                response.headers["Content-Range"] = content_range
+        response.accept_ranges = "bytes"
+        response.set_etag(etag)
+        _set_cache_headers(response, self.paste, "member")
+        return response
+
     def _renderer_for_mode(
         self,
         mode: str,
@@ -166,6 +434,7 @@ class _RenderRequest:
             renderer = {
                 "cast": self._render_asciicast,
                 "md": functools.partial(self._render_docutils, parser="markdown"),
+                "members": self._render_members,
                 "raw": self._render_raw,
                 "redirect": self._render_redirect,
                 "rst": functools.partial(
@@ -184,17 +453,19 @@ class _RenderRequest:
             return renderer
 
         def _render_unless_unmodified(*args: object, **kwargs: object) -> Response:
-            etag = _etag(
-                self.paste,
-                self.extension or _guess_extension(self.paste["mime"]),
-                mode,
-            )
-            response = make_response(
-                Response(status=304)
-                if request.if_none_match.contains_weak(etag)
-                else renderer(*args, **kwargs)
-            )
+            with timing.phase("etag"):
+                etag = _etag(
+                    self.paste,
+                    self.extension or _guess_extension(self.paste["mime"]),
+                    mode,
+                )
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                with timing.phase("render"):
+                    response = make_response(renderer(*args, **kwargs))
             response.set_etag(etag)
+            _set_cache_headers(response, self.paste, mode)
             return response
 
         return _render_unless_unmodified
@@ -203,19 +474,72 @@ class _RenderRequest:
         return self._renderer_for_mode(mode or _mode_for_mime(self.paste["mime"]))()
 
 
-@blueprint.post("/")
-def create_paste() -> flask.typing.ResponseReturnValue:
-    """Create a new paste."""
+def _enforce_quota(size: int) -> None:
+    max_count = current_app.config.get("IP_QUOTA_COUNT")
+    max_size = current_app.config.get("IP_QUOTA_BYTES")
+    if max_count is None and max_size is None:
+        return
+    since = None
+    if days := current_app.config.get("IP_QUOTA_DAYS"):
+        # Use the server's clock (as the stats do), not the client's Date header.
+        now = datetime.now(timezone.utc)
+        since = (now - timedelta(days=days - 1)).date()
+    with db.paster_context() as paster:
+        (usage,) = paster.stats(ip=request.remote_addr or "", since=since)
+    if max_count is not None and usage["count"] + 1 > max_count:
+        abort(429, f"The quota of {max_count} pastes per IP address has been reached.")
+    if max_size is not None and usage["size"] + size > max_size:
+        abort(429, f"The quota of {max_size} bytes per IP address has been reached.")
+
+
+def _sunset() -> datetime | None:
     # Calculate the expiration.
     now = request.date or datetime.now(timezone.utc)
     try:
         sunset = now + timedelta(seconds=int(request.form["sunset"]))
     except KeyError:
-        sunset = None
+        return None
     except ValueError as exc:
         abort(400, f"sunset: {exc}")
-    if sunset and sunset <= now:
+    if sunset <= now:
         abort(400, f"sunset ({sunset}) cannot be at/before the request time ({now}).")
+    return sunset
+
+
+def _create(
+    data: bytes | IO[bytes],
+    *,
+    mime: str | None,
+    sunset: datetime | None,
+    ip: str | None,
+    hashid: str | None = None,
+) -> tuple[str, int]:
+    # Create a paste (and get its hashid and the status to respond with).
+    try:
+        # Streams (i.e. uploads) are already durable, so they aren't journaled.
+        if (writer := ingest.writer()) and isinstance(data, bytes):
+            hashid = writer.submit(data, mime=mime, ip=ip, sunset=sunset)
+        else:
+            with db.paster_context() as paster, timing.phase("create"):
+                hashid = paster.create(
+                    data, mime=mime, ip=ip, sunset=sunset, hashid=hashid
+                )
+    except db.HashCollision as exc:
+        return str(exc), 409
+    except db.PasteExists as exc:
+        hashid, status = str(exc), 200
+    else:
+        status = 201
+    if paste_filter := bloom.paste_filter():
+        # Other workers add it with their next refresh.
+        paste_filter.add(hashid)
+    return hashid, status
+
+
+@blueprint.post("/")
+def create_paste() -> flask.typing.ResponseReturnValue:
+    """Create a new paste."""
+    sunset = _sunset()
 
     # Get the paste data and MIME type.
     mime = None
@@ -237,22 +561,234 @@ def create_paste() -> flask.typing.ResponseReturnValue:
         abort(400, "No content was sent (via the redirect/r or content/c fields).")
 
     # Create the paste.
+    with timing.phase("quota"):
+        _enforce_quota(len(data))
+    hashid, status = _create(data, mime=mime, sunset=sunset, ip=request.remote_addr)
+
+    # Return the paste.
+    return {"hashid": hashid, "link": request.url + hashid}, status
+
+
+def _uploads() -> upload.Uploads:
+    if not (uploads := upload.uploads()):
+        abort(404)
+    return uploads
+
+
+@contextlib.contextmanager
+def _handling_upload_errors() -> Iterator[None]:
+    try:
+        yield
+    except upload.UploadNotFound:
+        abort(404)
+    except upload.UploadIncomplete as exc:
+        abort(409, str(exc))
+    except upload.UploadError as exc:
+        abort(400, str(exc))
+
+
+@blueprint.post("/uploads")
+def create_upload() -> flask.typing.ResponseReturnValue:
+    """Start a resumable upload (of a paste with the given size)."""
+    uploads = _uploads()
+    try:
+        size = int(request.form["size"])
+    except KeyError:
+        abort(400, "The size of the upload is required.")
+    except ValueError as exc:
+        abort(400, f"size: {exc}")
+    max_size = current_app.config.get("UPLOAD_MAX_BYTES", upload.MAX_BYTES_DEFAULT)
+    if not 0 < size <= max_size:
+        abort(400, f"size ({size}) must be from 1 to {max_size} bytes.")
+    sunset = _sunset()
+    mime = request.form.get("mime")
+    with timing.phase("quota"):
+        _enforce_quota(size)
+    upload_id = uploads.create(
+        size=size, mime=mime, sunset=sunset, ip=request.remote_addr
+    )
+    return {"id": upload_id, "size": size, "link": f"{request.url}/{upload_id}"}, 201
+
+
+@blueprint.put("/uploads/<string:upload_id>")
+def write_upload(upload_id: str) -> flask.typing.ResponseReturnValue:
+    """Write a chunk of an upload (at the range in its Content-Range header)."""
+    uploads = _uploads()
+    content_range = parse_content_range_header(request.headers.get("Content-Range"))
+    if (
+        content_range is None
+        or content_range.start is None
+        or content_range.stop is None
+    ):
+        abort(400, "A Content-Range header (e.g. bytes 0-1023/4096) is required.")
+    with _handling_upload_errors():
+        return uploads.write(
+            upload_id,
+            start=content_range.start,
+            stop=content_range.stop,
+            stream=request.stream,
+            size=content_range.length,
+        )
+
+
+@blueprint.get("/uploads/<string:upload_id>")
+def get_upload(upload_id: str) -> flask.typing.ResponseReturnValue:
+    """Get the progress of an upload (e.g. to resume it)."""
+    uploads = _uploads()
+    with _handling_upload_errors():
+        return uploads.progress(upload_id)
+
+
+@blueprint.post("/uploads/<string:upload_id>")
+def finish_upload(upload_id: str) -> flask.typing.ResponseReturnValue:
+    """Create a paste from a complete upload."""
+    uploads = _uploads()
+    with _handling_upload_errors(), uploads.open(upload_id) as (data, kwargs):
+        # The data is streamed from the upload's file (not read into memory).
+        hashid, status = _create(data, **kwargs)
+    uploads.remove(upload_id)
+    return {"hashid": hashid, "link": request.host_url + hashid}, status
+
+
+@blueprint.delete("/uploads/<string:upload_id>")
+def remove_upload(upload_id: str) -> flask.typing.ResponseReturnValue:
+    """Cancel an upload."""
+    uploads = _uploads()
+    with _handling_upload_errors():
+        if not uploads.remove(upload_id):
+            abort(404)
+    return "", 204
+
+
+def _batch_item(
+    hashid: str, paste: dict[str, Any] | None, *, now: datetime
+) -> dict[str, object]:
+    sunset = paste and paste["sunset"] and _as_utc(paste["sunset"])
+    if not paste or (sunset and sunset <= now):
+        return {"hashid": hashid, "status": 404}
+    return {
+        "hashid": hashid,
+        "status": 200,
+        "mime": paste["mime"],
+        "timestamp": _as_utc(paste["timestamp"]),
+        "sunset": sunset,
+        "data": base64.b64encode(paste["data"]).decode(),
+    }
+
+
+@blueprint.post("/batch")
+def retrieve_pastes() -> flask.typing.ResponseReturnValue:
+    """Retrieve many pastes as newline-delimited JSON."""
+    body = request.get_json(silent=True)
+    hashids = body.get("hashids") if isinstance(body, dict) else None
+    if not isinstance(hashids, list) or not all(isinstance(h, str) for h in hashids):
+        abort(400, 'A JSON object with a "hashids" list of strings is required.')
+    limit = current_app.config.get("BATCH_MAX_HASHIDS", 1000)
+    if len(hashids) > limit:
+        abort(400, f"No more than {limit} hashids may be requested at once.")
+    chunk_size = current_app.config.get("BATCH_CHUNK_SIZE", 100)
+
+    def _lines() -> Iterator[str]:
+        now = datetime.now(timezone.utc)
+        writer = ingest.writer()
+        with db.paster_context() as paster:
+            for hashid, paste in paster.query_many(
+                hashids=hashids, chunk_size=chunk_size
+            ):
+                if paste is None and writer:
+                    paste = writer.pending(hashid)
+                item = _batch_item(hashid, paste, now=now)
+                yield json.dumps(item, default=datetime.isoformat) + "\n"
+
+    return Response(stream_with_context(_lines()), mimetype="application/x-ndjson")
+
+
+@blueprint.get("/search")
+def search_pastes() -> flask.typing.ResponseReturnValue:
+    """Search text pastes."""
+    if not current_app.config.get("SEARCH_INDEX"):
+        abort(404)
+    query = request.args.get("q", "")
+    if not query.strip():
+        abort(400, "A search query (q) is required.")
+    params = {"before": None, "limit": 20}
+    for key in params:
+        try:
+            params[key] = int(request.args[key])
+        except KeyError:
+            pass
+        except ValueError as exc:
+            abort(400, f"{key}: {exc}")
+    limit = min(cast(int, params["limit"]), 100)
+    if limit < 1:
+        abort(400, f"limit ({limit}) must be at least 1.")
+    with db.paster_context() as paster:
+        results = paster.search(query, before=params["before"], limit=limit)
+    for result in results:
+        result["link"] = request.host_url + result["hashid"]
+    return {
+        "results": results,
+        "next": results[-1]["cursor"] if len(results) == limit else None,
+    }
+
+
+@blueprint.get("/admin/pastes")
+def list_pastes() -> flask.typing.ResponseReturnValue:
+    """List pastes (newest first) for moderators."""
+    if not (token := current_app.config.get("ADMIN_TOKEN")):
+        abort(404)
+    if not hmac.compare_digest(
+        request.headers.get("Authorization", "").encode(), f"Bearer {token}".encode()
+    ):
+        abort(401)
+    params: dict[str, int | None] = {
+        "limit": 20,
+        "min_size": None,
+        "max_size": None,
+    }
+    for key in params:
+        try:
+            params[key] = int(request.args[key])
+        except KeyError:
+            pass
+        except ValueError as exc:
+            abort(400, f"{key}: {exc}")
+    limit = min(cast(int, params.pop("limit")), 100)
+    if limit < 1:
+        abort(400, f"limit ({limit}) must be at least 1.")
     try:
         with db.paster_context() as paster:
-            hashid = paster.create(
-                data, mime=mime, ip=request.remote_addr, sunset=sunset
+            pastes = paster.list(
+                before=request.args.get("before"),
+                limit=limit,
+                mime=request.args.get("mime"),
+                ip=request.args.get("ip"),
+                **params,
             )
-    except db.HashCollision as exc:
-        hashid = str(exc)
-        status = 409
-    except db.PasteExists as exc:
-        hashid = str(exc)
-        status = 200
-    else:
-        status = 201
+    except ValueError as exc:
+        abort(400, f"before: {exc}")
+    for paste in pastes:
+        paste["link"] = request.host_url + paste["hashid"]
+    return {
+        "pastes": pastes,
+        "next": pastes[-1]["cursor"] if len(pastes) == limit else None,
+    }
 
-    # Return the paste.
-    return {"hashid": hashid, "link": request.url + hashid}, status
+
+@blueprint.get("/stats/render")
+def render_stats() -> flask.typing.ResponseReturnValue:
+    """Get stats for the render pool (of this process)."""
+    if not (render_pool := render.pool()):
+        abort(404)
+    return render_pool.stats()
+
+
+@blueprint.get("/stats/filter")
+def filter_stats() -> flask.typing.ResponseReturnValue:
+    """Get stats for the paste filter (of this process)."""
+    if not (paste_filter := bloom.paste_filter()):
+        abort(404)
+    return paste_filter.stats()
 
 
 @blueprint.get("/")
@@ -269,7 +805,10 @@ def retrieve_paste(
     hashid: str, extension: str = "", mode: str = ""
 ) -> flask.typing.ResponseReturnValue:
     """Retrieve a paste."""
-    paste = _get_paste(hashid)
+    paste = _get_paste(
+        hashid,
+        max_data=current_app.config.get("STREAM_CHUNK_SIZE", STREAM_CHUNK_SIZE_DEFAULT),
+    )
     if not extension:
         extension = _guess_extension(paste["mime"])
         suffix = ""
@@ -296,7 +835,44 @@ def render_paste(
     hashid: str, extension: str = "", mode: str = ""
 ) -> flask.typing.ResponseReturnValue:
     """Render a paste."""
-    return _RenderRequest(paste=_get_paste(hashid), extension=extension).rendered(mode)
+    paste = None
+    # Cached pastes are rendered without a query (so only misses look up redirects).
+    if (
+        not extension
+        and mode in {"", "redirect"}
+        and not (paste := cache.get_paste(hashid))
+    ):
+        if _definitely_missing(hashid):
+            abort(404)
+        # Redirects are followed without fetching (or building) the whole paste.
+        with db.paster_context() as paster, timing.phase("query"):
+            location = paster.query_redirect(hashid=hashid)
+        if location is not None:
+            return redirect(location, 302)
+    if extension in archive.EXTENSIONS and mode not in MODES:
+        # (A member at the root of an archive, unless it's named like a mode.)
+        return retrieve_member(hashid, extension, mode)
+    if not paste:
+        # Raw data is streamed (or sliced), so large data is left out.
+        max_data = None
+        if mode == "raw":
+            max_data = current_app.config.get(
+                "STREAM_CHUNK_SIZE", STREAM_CHUNK_SIZE_DEFAULT
+            )
+        paste = _get_paste(hashid, max_data=max_data)
+    return _RenderRequest(paste=paste, extension=extension).rendered(mode)
+
+
+@blueprint.get("/<string:hashid>.<any(tar, zip):extension>/<path:member>")
+def retrieve_member(
+    hashid: str, extension: str, member: str
+) -> flask.typing.ResponseReturnValue:
+    """Retrieve a member of an archive (e.g. /<hashid>.zip/dir/file.txt)."""
+    paste = _get_paste(
+        hashid,
+        max_data=current_app.config.get("STREAM_CHUNK_SIZE", STREAM_CHUNK_SIZE_DEFAULT),
+    )
+    return _RenderRequest(paste=paste, extension=extension).member(member)
 
 
 @blueprint.get("/<string:hashid>/")
@@ -1,3 +1,7 @@
+import http.server
+import socketserver
+import threading
+
 import pytest
 
 import pbnh.db
@@ -24,3 +28,72 @@ def app(override_config, request):
     yield app
     with app.app_context():
         pbnh.db.undo_db()
+        pbnh.db.dispose()
+
+
+@pytest.fixture
+def purge_server():
+    """Run a local HTTP server that stands in for a CDN purge API."""
+    requests = []
+
+    class _Handler(http.server.BaseHTTPRequestHandler):
+        def _record(self):
+            requests.append(
+                {"method": self.command, "path": self.path, "headers": self.headers}
+            )
+            self.send_response(404 if "missing" in self.path else 200)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        do_POST = do_PURGE = _record
+
+        def log_message(self, *args, **kwargs):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.requests = requests
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def memcached_server():
+    """Run a local TCP server that stands in for memcached (with its text protocol)."""
+    store = {}
+
+    class _Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            while command := self.rfile.readline().split():
+                name, key, *args = command
+                if name == b"set":
+                    value = self.rfile.read(int(args[2]) + 2)[:-2]
+                if self.server.reply is not None:
+                    self.wfile.write(self.server.reply)
+                elif name == b"get" and key in store:
+                    value = store[key]
+                    self.wfile.write(
+                        b"VALUE %s 0 %d\r\n%s\r\nEND\r\n" % (key, len(value), value)
+                    )
+                elif name == b"get":
+                    self.wfile.write(b"END\r\n")
+                elif name == b"set":
+                    store[key] = value
+                    self.wfile.write(b"STORED\r\n")
+                else:
+                    found = store.pop(key, None) is not None
+                    self.wfile.write(b"DELETED\r\n" if found else b"NOT_FOUND\r\n")
+
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    server.store = store
+    server.reply = None  # (to send instead of handling commands)
+    server.url = f"memcached://127.0.0.1:{server.server_address[1]}"
+    yield server
+    server.shutdown()
+    server.server_close()
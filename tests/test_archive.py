@@ -0,0 +1,116 @@
+import io
+import struct
+import tarfile
+import zipfile
+
+import pytest
+
+from pbnh import archive
+
+
+def _zip(*members):
+    data = io.BytesIO()
+    with zipfile.ZipFile(data, "w") as zip_file:
+        for name, content, compress_type in members:
+            zip_file.writestr(name, content, compress_type=compress_type)
+    return data.getvalue()
+
+
+def _tar(*members, mode="w"):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode=mode) as tar_file:
+        directory = tarfile.TarInfo("dir")
+        directory.type = tarfile.DIRTYPE
+        tar_file.addfile(directory)
+        for name, content in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar_file.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+def _read(data):
+    # Read in small chunks (like paster.read).
+    def read(start, stop):
+        return [
+            data[offset : min(offset + 3, stop)] for offset in range(start, stop, 3)
+        ]
+
+    return read
+
+
+@pytest.mark.parametrize(
+    "data,archive_format",
+    [
+        (
+            _zip(
+                ("dir/", b"", zipfile.ZIP_STORED),
+                ("a.txt", b"abc" * 100, zipfile.ZIP_DEFLATED),
+                ("dir/b.txt", b"abcdefgh", zipfile.ZIP_STORED),
+            ),
+            "zip",
+        ),
+        (_tar(("a.txt", b"abc" * 100), ("dir/b.txt", b"abcdefgh")), "tar"),
+    ],
+    ids=["zip", "tar"],
+)
+def test_read_member(data, archive_format):
+    index = archive.build_index(data)
+    assert index["format"] == archive_format
+    assert [(name, member["size"]) for name, member in index["members"].items()] == [
+        ("a.txt", 300),
+        ("dir/b.txt", 8),
+    ]
+    a, b = index["members"].values()
+    for member, content in [(a, b"abc" * 100), (b, b"abcdefgh")]:
+        assert b"".join(archive.read_member(_read(data), member)) == content
+        for start, stop in [(1, 5), (0, 1), (5, member["size"])]:
+            assert (
+                b"".join(
+                    archive.read_member(_read(data), member, start=start, stop=stop)
+                )
+                == content[start:stop]
+            )
+
+
+def test_read_member_unsupported():
+    data = _zip(("a.txt", b"abc", zipfile.ZIP_BZIP2))
+    member = archive.build_index(data)["members"]["a.txt"]
+    with pytest.raises(archive.ArchiveError, match="unsupported method"):
+        archive.read_member(_read(data), member)
+
+
+def test_read_member_corrupt():
+    data = _zip(("a.txt", b"abc" * 100, zipfile.ZIP_DEFLATED))
+    member = archive.build_index(data)["members"]["a.txt"]
+    with pytest.raises(archive.ArchiveError, match="is corrupt"):
+        list(archive.read_member(lambda start, stop: [b"\xff" * 8], member))
+
+
+def _truncated_zip():
+    # The central directory says the member's data is longer than it is.
+    data = _zip(("a.txt", b"abc", zipfile.ZIP_STORED))
+    entry = data.index(b"PK\x01\x02")
+    return data[: entry + 20] + struct.pack("<L", 1000) + data[entry + 24 :]
+
+
+@pytest.mark.parametrize(
+    "data,message",
+    [
+        (b"", "not a zip"),
+        (b"abc" * 1000, "not a zip"),
+        (_tar(("a.txt", b"abc"), mode="w:gz"), "not a zip"),
+        (_tar(("a.txt", b"abc" * 1000))[:1024], "not a zip"),
+        (
+            _zip(("a.txt", b"abc", zipfile.ZIP_STORED)).replace(
+                b"PK\x03\x04", b"XX\x03\x04"
+            ),
+            "header of a.txt is corrupt",
+        ),
+        (_truncated_zip(), "data of a.txt is truncated"),
+    ],
+    ids=["empty", "text", "tar.gz", "truncated tar", "corrupt zip", "truncated zip"],
+)
+def test_build_index_invalid(data, message):
+    with pytest.raises(archive.ArchiveError, match=message):
+        archive.build_index(data)
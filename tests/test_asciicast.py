@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from pbnh import asciicast
+
+
+def _cast(version, times, **header):
+    lines = [json.dumps({"version": version, "width": 80, "height": 24, **header})]
+    lines += [json.dumps([time, "o", f"event {i}"]) for i, time in enumerate(times)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _events(data):
+    return [json.loads(line) for line in data.decode().splitlines()[1:]]
+
+
+def _trim(data, index, **time_range):
+    start, stop = asciicast.window(index, **time_range)
+    return asciicast.trim(
+        data[: index["header_end"]], data[start:stop], index, **time_range
+    )
+
+
+@pytest.fixture(params=[1, 1024 * 1024], ids=["dense", "sparse"])
+def checkpoint_bytes(request, monkeypatch):
+    monkeypatch.setattr(asciicast, "CHECKPOINT_BYTES", request.param)
+    return request.param
+
+
+def test_trim_v2(checkpoint_bytes):
+    data = _cast(2, [0.5, 1.0, 1.5, 2.0, 2.5], duration=2.5)
+    index = asciicast.build_index(data)
+    assert len(index["checkpoints"]) == (5 if checkpoint_bytes == 1 else 1)
+    start, stop = asciicast.window(index, start=1.0, end=2.0)
+    if checkpoint_bytes == 1:
+        # The window holds just the events from 1.0 through 2.0.
+        window = [json.loads(line) for line in data[start:stop].splitlines()]
+        assert window == _events(data)[1:4]
+    else:
+        assert (start, stop) == (index["header_end"], None)
+    trimmed = _trim(data, index, start=1.0, end=2.0)
+    assert json.loads(trimmed.splitlines()[0])["duration"] == 1.0
+    assert _events(trimmed) == [
+        [0.0, "o", "event 1"],
+        [0.5, "o", "event 2"],
+        [1.0, "o", "event 3"],
+    ]
+
+
+def test_trim_v3(checkpoint_bytes):
+    data = _cast(3, [0.5, 0.5, 0.5, 0.5, 0.5])
+    data = data.replace(b"\n", b"\n# comment\n\n", 1)
+    index = asciicast.build_index(data)
+    trimmed = _trim(data, index, start=1.2)
+    assert _events(trimmed) == [
+        [0.3, "o", "event 2"],
+        [0.5, "o", "event 3"],
+        [0.5, "o", "event 4"],
+    ]
+
+
+def test_trim_defaults():
+    data = _cast(2, [0.5, 1.0])
+    assert _events(_trim(data, asciicast.build_index(data))) == _events(data)
+
+
+def test_trim_empty():
+    data = _cast(2, [])
+    trimmed = _trim(data, asciicast.build_index(data), start=1.0)
+    assert trimmed == data
+
+
+@pytest.mark.parametrize(
+    "data,match",
+    [
+        (b"not json", "header"),
+        (b'{"version": 1}', "v2"),
+        (b"[]", "v2"),
+        (b'{"version": 2}\n["bad", "o", ""]', "event"),
+    ],
+)
+def test_build_index_invalid(data, match):
+    with pytest.raises(asciicast.AsciicastError, match=match):
+        asciicast.build_index(data)
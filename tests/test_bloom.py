@@ -0,0 +1,133 @@
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import pbnh
+import pbnh.db
+from pbnh import bloom, pack
+
+
+def test_bloom_filter():
+    bloom_filter = bloom.BloomFilter.for_items(1024, items=1000)
+    assert bloom_filter.hashes == 6
+    keys = [uuid.uuid4().hex for _ in range(1000)]
+    for key in keys:
+        bloom_filter.add(key)
+    # There are no false negatives (and few false positives).
+    assert all(key in bloom_filter for key in keys)
+    others = [uuid.uuid4().hex for _ in range(1000)]
+    assert sum(key in bloom_filter for key in others) < 100
+    assert 0.01 < bloom_filter.false_positive_rate() < 0.05
+
+
+@pytest.mark.parametrize("items,hashes", [(0, bloom.MAX_HASHES), (10**9, 1)])
+def test_bloom_filter_hashes(items, hashes):
+    assert bloom.BloomFilter.for_items(1024, items=items).hashes == hashes
+
+
+@pytest.fixture
+def paste_filter(app):
+    """Start a paste filter (that only updates when told to)."""
+    paste_filter = bloom.PasteFilter(app, size=1024, refresh=3600)
+    assert paste_filter.wait(10)
+    yield paste_filter
+    paste_filter.close()
+
+
+def test_paste_filter(app):
+    with app.app_context(), pbnh.db.paster_context() as paster:
+        hashid = paster.create(b"abc")
+    paste_filter = bloom.PasteFilter(app, size=1024, refresh=0.01)
+    assert paste_filter.might_contain("x")  # (It isn't built yet.)
+    assert paste_filter.wait(10)
+    assert paste_filter.might_contain(hashid)
+    assert not paste_filter.might_contain("x")
+    paste_filter.false_positive()
+    # Pastes created since are added by refreshes.
+    with app.app_context(), pbnh.db.paster_context() as paster:
+        new_hashid = paster.create(b"new")
+    deadline = time.monotonic() + 10
+    while new_hashid not in paste_filter._filter and time.monotonic() < deadline:
+        time.sleep(0.01)
+    paste_filter.close()
+    stats = paste_filter.stats()
+    assert (stats["rebuilds"], stats["false_positives"]) == (1, 1)
+    assert stats["negatives"] >= 1
+    assert stats["refreshes"] >= 1
+    assert stats["added"] >= 2
+
+
+def test_paste_filter_packed(app, tmp_path):
+    app.extensions[pack.EXTENSION] = pack.Packs(str(tmp_path / "packs"))
+    with app.app_context(), pbnh.db.paster_context() as paster:
+        hashid = paster.create(b"abc", timestamp=datetime.now() - timedelta(days=2))
+        paster.tier(before=datetime.now() - timedelta(days=1))
+    paste_filter = bloom.PasteFilter(app, size=1024, refresh=3600)
+    assert paste_filter.wait(10)
+    paste_filter.close()
+    assert paste_filter.might_contain(hashid)
+
+
+def test_paste_filter_refresh(app, paste_filter):
+    with app.app_context(), pbnh.db.paster_context() as paster:
+        hashid = paster.create(b"abc")
+        paste_filter._refresh(paste_filter._filter)
+    assert hashid in paste_filter._filter
+    paste_filter.add("x")
+    assert paste_filter.might_contain("x")
+    assert paste_filter.stats()["refreshes"] == 1
+
+
+def test_paste_filter_catch_up(app, paste_filter):
+    """Pastes created by other workers since the last scan are never missed."""
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashid = paster.create(b"abc")
+        assert paste_filter.might_contain(hashid)
+        assert not paste_filter.might_contain("0" * 40)
+        assert paste_filter.stats()["catch_ups"] == 2
+        # A miss that started before the last catch-up is covered by it.
+        paste_filter._catch_up(paste_filter._filter, since=0.0)
+    assert paste_filter.stats()["catch_ups"] == 2
+    assert paste_filter.stats()["negatives"] == 1
+
+
+def test_paste_filter_add_while_building(app, paste_filter, monkeypatch):
+    scan_hashids = pbnh.db._Paster.scan_hashids
+
+    def _scan_hashids(self, **kwargs):
+        paste_filter.add("x")
+        return scan_hashids(self, **kwargs)
+
+    monkeypatch.setattr(pbnh.db._Paster, "scan_hashids", _scan_hashids)
+    with app.app_context():
+        paste_filter._rebuild()
+    assert paste_filter.might_contain("x")
+
+
+def test_paste_filter_failure(app, monkeypatch, caplog):
+    def _last_id(self):
+        raise pbnh.db.PasteDBError("The database is not usable.")
+
+    monkeypatch.setattr(pbnh.db._Paster, "last_id", _last_id)
+    with caplog.at_level(logging.ERROR):
+        paste_filter = bloom.PasteFilter(app, size=1024, refresh=3600)
+        paste_filter.close()
+    assert not paste_filter.wait(0)
+    # Lookups before the filter is built don't count against it.
+    paste_filter.false_positive()
+    assert paste_filter.stats()["false_positives"] == 0
+    assert paste_filter.stats()["failures"] == 1
+    assert paste_filter.stats()["estimated_false_positive_rate"] == 1.0
+    assert "The paste filter was not updated." in caplog.text
+
+
+def test_init_app(app):
+    app = pbnh.create_app({**app.config, "PASTE_FILTER_BYTES": 1024})
+    with app.app_context():
+        paste_filter = bloom.paste_filter()
+    assert paste_filter.wait(10)
+    paste_filter.close()
@@ -0,0 +1,150 @@
+import logging
+from datetime import datetime, timedelta, timezone
+
+import flask
+import pytest
+
+import pbnh
+from pbnh import cache
+
+
+@pytest.fixture(params=["memory", "file", "memcached"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return cache.MemoryCache()
+    if request.param == "file":
+        return cache.FileCache(directory=str(tmp_path / "cache"))
+    server = request.getfixturevalue("memcached_server")
+    return cache.MemcachedCache(host="127.0.0.1", port=server.server_address[1])
+
+
+@pytest.fixture
+def cache_app():
+    """Create an app context with an in-memory cache."""
+    app = flask.Flask(__name__)
+    app.extensions[cache.EXTENSION] = cache.MemoryCache()
+    with app.app_context():
+        yield app
+
+
+def test_backend(backend):
+    assert backend.get("a b") is None
+    backend.set("a b", b"abc\r\nEND\r\n", ttl=60)
+    assert backend.get("a b") == b"abc\r\nEND\r\n"
+    backend.set("a b", b"", ttl=60)
+    assert backend.get("a b") == b""
+    backend.delete("a b")
+    backend.delete("a b")
+    assert backend.get("a b") is None
+
+
+@pytest.mark.parametrize("backend", ["memory", "file"], indirect=True)
+def test_backend_expired(backend):
+    backend.set("abc", b"abc", ttl=0)
+    assert backend.get("abc") is None
+    assert backend.get("abc") is None
+
+
+def test_memory_cache_evicts():
+    memory_cache = cache.MemoryCache(max_items=2)
+    memory_cache.set("a", b"a", ttl=60)
+    memory_cache.set("b", b"b", ttl=60)
+    assert memory_cache.get("a") == b"a"
+    memory_cache.set("c", b"c", ttl=60)
+    assert memory_cache.get("b") is None
+    assert memory_cache.get("a") == b"a"
+
+
+@pytest.mark.parametrize(
+    "reply",
+    [b"SERVER_ERROR out of memory\r\n", b"VALUE key 0 1\r\na\r\nVALUE\r\n"],
+)
+def test_memcached_cache_errors(memcached_server, reply):
+    port = memcached_server.server_address[1]
+    memcached_cache = cache.MemcachedCache(host="127.0.0.1", port=port, timeout=0.1)
+    memcached_server.reply = reply
+    with pytest.raises(cache.CacheError):
+        memcached_cache.get("abc")
+    with pytest.raises(cache.CacheError):
+        memcached_cache.set("abc", b"abc", ttl=60)
+    memcached_server.reply = b""  # (no response)
+    with pytest.raises(OSError):
+        memcached_cache.delete("abc")
+    # The connection is reopened.
+    memcached_server.reply = None
+    memcached_cache.set("abc", b"abc", ttl=cache.MemcachedCache.MAX_TTL + 1)
+    assert memcached_cache.get("abc") == b"abc"
+
+
+@pytest.mark.parametrize(
+    "url,backend_type",
+    [
+        ("memory://?max_items=10", cache.MemoryCache),
+        ("file://{tmp_path}/cache", cache.FileCache),
+        ("memcached://localhost", cache.MemcachedCache),
+        ("memcached://localhost:11212", cache.MemcachedCache),
+    ],
+)
+def test_init_app(url, backend_type, tmp_path):
+    app = pbnh.create_app({"CACHE_URL": url.format(tmp_path=tmp_path)})
+    assert isinstance(app.extensions[cache.EXTENSION], backend_type)
+
+
+@pytest.mark.parametrize("url", ["redis://localhost", "memcached://"])
+def test_init_app_unsupported(url):
+    with pytest.raises(ValueError, match="is not a supported CACHE_URL"):
+        pbnh.create_app({"CACHE_URL": url})
+
+
+def test_uncached():
+    with flask.Flask(__name__).app_context():
+        cache.set("abc", b"abc")
+        assert cache.get("abc") is None
+        cache.delete("abc")
+
+
+def test_cache_unavailable(caplog):
+    app = flask.Flask(__name__)
+    # Nothing listens on port 9 (discard) here.
+    app.extensions[cache.EXTENSION] = cache.MemcachedCache(host="127.0.0.1", port=9)
+    with app.app_context(), caplog.at_level(logging.WARNING):
+        cache.set("abc", b"abc")
+        assert cache.get("abc") is None
+        cache.delete("abc")
+    assert [record.getMessage().split(" (")[0] for record in caplog.records] == [
+        "The cache could not be written",
+        "The cache could not be read",
+        "The cache could not be written",
+    ]
+
+
+def test_set_limits(cache_app):
+    cache_app.config["CACHE_MAX_BYTES"] = 2
+    cache.set("abc", b"abc")
+    assert cache.get("abc") is None
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    cache.set("ab", b"ab", sunset=now - timedelta(seconds=1))
+    assert cache.get("ab") is None
+    cache.set("ab", b"ab", sunset=now + timedelta(days=1))
+    assert cache.get("ab") == b"ab"
+
+
+def test_paste(cache_app):
+    timestamp = datetime(2026, 1, 2, 3, 4, 5)
+    paste = {
+        "hashid": "abc",
+        "ip": None,
+        "mime": "text/plain",
+        "size": 5,
+        "sunset": None,
+        "timestamp": timestamp,
+        "data": b"a\nb\nc",
+    }
+    assert cache.get_paste("abc") is None
+    cache.set_paste(paste)
+    assert cache.get_paste("abc") == paste
+    paste["sunset"] = timestamp + timedelta(days=365 * 100)
+    cache.set_paste(paste)
+    assert cache.get_paste("abc") == paste
+    cache.delete_paste("abc")
+    assert cache.get_paste("abc") is None
@@ -0,0 +1,42 @@
+import pytest
+
+import pbnh.cdn
+
+
+def test_purge_unconfigured(app):
+    with app.app_context():
+        assert not pbnh.cdn.purge("abc123")
+
+
+def test_purge(app, purge_server):
+    app.config["CDN_PURGE_URL"] = purge_server.url + "/purge/{hashid}"
+    app.config["CDN_PURGE_HEADERS"] = {"Fastly-Key": "secret"}
+    with app.app_context():
+        assert pbnh.cdn.purge("abc123")
+    (request,) = purge_server.requests
+    assert request["method"] == "PURGE"
+    assert request["path"] == "/purge/abc123"
+    assert request["headers"]["Surrogate-Key"] == "abc123"
+    assert request["headers"]["Fastly-Key"] == "secret"
+
+
+def test_purge_method(app, purge_server):
+    app.config["CDN_PURGE_URL"] = purge_server.url + "/"
+    app.config["CDN_PURGE_METHOD"] = "POST"
+    with app.app_context():
+        assert pbnh.cdn.purge("abc123")
+    assert purge_server.requests[0]["method"] == "POST"
+
+
+def test_purge_http_error(app, purge_server):
+    app.config["CDN_PURGE_URL"] = purge_server.url + "/missing/{hashid}"
+    with app.app_context():
+        with pytest.raises(pbnh.cdn.CDNPurgeError, match="abc123"):
+            pbnh.cdn.purge("abc123")
+
+
+def test_purge_bad_scheme(app):
+    app.config["CDN_PURGE_URL"] = "file:///etc/passwd"
+    with app.app_context():
+        with pytest.raises(pbnh.cdn.CDNPurgeError, match="HTTP"):
+            pbnh.cdn.purge("abc123")
@@ -1,7 +1,16 @@
 import contextlib
+import json
 import unittest.mock
+from datetime import datetime, timedelta, timezone
 
 import pytest
+import sqlalchemy
+
+import pbnh.cache
+import pbnh.db
+import pbnh.pack
+import pbnh.sendfile
+import pbnh.upload
 
 
 def fake_paster_context_factory(hashid, data):
@@ -36,6 +45,29 @@ def test_cli_db_init(test_cli_runner, monkeypatch):
     assert "initialized" in result.output
 
 
+@pytest.mark.parametrize(
+    "completed, message", [(True, "checkpointed"), (False, "WARNING")]
+)
+def test_cli_db_checkpoint(test_cli_runner, monkeypatch, completed, message):
+    def fake_checkpoint_db(*, vacuum_pages):
+        return vacuum_pages, completed
+
+    monkeypatch.setattr("pbnh.db.checkpoint_db", fake_checkpoint_db)
+    result = test_cli_runner.invoke(args=["db", "checkpoint", "--vacuum-pages", "7"])
+    assert "released 7 free pages" in result.output
+    assert message in result.output
+
+
+def test_cli_db_downgrade_upgrade(app, test_cli_runner):
+    with app.app_context():
+        result = test_cli_runner.invoke(args=["db", "downgrade", "--to", "0"])
+        assert "downgraded to version 0" in result.output
+        assert "the database is at version 0" in result.output
+        result = test_cli_runner.invoke(args=["db", "upgrade", "--batch-size", "1"])
+        assert "upgraded to version 1" in result.output
+        assert f"the database is at version {pbnh.db.SCHEMA_VERSION}" in result.output
+
+
 def test_cli_paste_info(test_cli_runner, monkeypatch):
     """Pastes can be looked up from the CLI."""
     data = b"Example Data"
@@ -77,3 +109,296 @@ def test_cli_paste_remove(app, test_cli_runner):
     with app.app_context():
         result = test_cli_runner.invoke(args=["paste", "remove", hashid])
     assert hashid in result.output
+
+
+@pytest.mark.parametrize(
+    "path,message,purges",
+    [(None, "removed", 0), ("/{hashid}", "purged", 1), ("/missing", "WARNING", 1)],
+)
+def test_cli_paste_remove_purge(
+    app, test_cli_runner, purge_server, path, message, purges
+):
+    """Removed pastes are purged from the CDN (if configured)."""
+    if path:
+        app.config["CDN_PURGE_URL"] = purge_server.url + path
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashid = paster.create(b"Example Data")
+        result = test_cli_runner.invoke(args=["paste", "remove", hashid, "abc123"])
+    assert f"{hashid} removed" in result.output
+    assert message in result.output
+    assert len(purge_server.requests) == purges
+
+
+def test_cli_paste_remove_cached(app, test_cli_runner):
+    """Removed pastes are removed from the cache (if configured)."""
+    app.extensions[pbnh.cache.EXTENSION] = pbnh.cache.MemoryCache()
+    test_client = app.test_client()
+    hashid = test_client.post("/", data={"content": "abc"}).json["hashid"]
+    assert test_client.get(f"/{hashid}").status_code == 200
+    with app.app_context():
+        test_cli_runner.invoke(args=["paste", "remove", hashid])
+    assert test_client.get(f"/{hashid}").status_code == 404
+
+
+def test_cli_paste_purge(app, test_cli_runner, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("time.sleep", sleeps.append)
+    app.extensions[pbnh.cache.EXTENSION] = pbnh.cache.MemoryCache()
+    test_client = app.test_client()
+    hashids = [
+        test_client.post("/", data={"content": f"spam {i}"}).json["hashid"]
+        for i in range(3)
+    ]
+    assert test_client.get(f"/{hashids[0]}").status_code == 200
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            ham = paster.create(b"ham", ip="5.6.7.8")
+        result = test_cli_runner.invoke(args=["paste", "purge"])
+        assert "At least one of" in result.output
+        args = ["paste", "purge", "--ip", "127.0.0.1", "--before", "2100-01-01"]
+        result = test_cli_runner.invoke(args=[*args, "--dry-run"])
+        assert "would remove 3 pastes (18 bytes)" in result.output
+        result = test_cli_runner.invoke(
+            args=[*args, "--batch-size", 2, "--rate", 1000, "--larger-than", 1]
+        )
+        assert "removed 2 pastes (through id 2)" in result.output
+        assert result.output.endswith("removed 3 pastes\n")
+        assert len(sleeps) == 2
+        result = test_cli_runner.invoke(args=[*args, "--mime", "text/plain"])
+        assert result.output == "removed 0 pastes\n"
+        hashids.append(test_client.post("/", data={"content": "spam"}).json["hashid"])
+        result = test_cli_runner.invoke(args=args)
+        assert result.output.endswith("removed 1 pastes\n")
+        assert len(sleeps) == 2
+    # Purged pastes are removed from the cache too.
+    assert test_client.get(f"/{hashids[0]}").status_code == 404
+    assert test_client.get(f"/{ham}").status_code == 200
+
+
+def test_cli_paste_purge_packed(app, test_cli_runner, tmp_path):
+    """Packed pastes are purged too."""
+    app.extensions[pbnh.pack.EXTENSION] = pbnh.pack.Packs(str(tmp_path))
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashids = [
+                paster.create(f"spam {i}".encode(), ip="1.2.3.4") for i in range(3)
+            ]
+            paster.tier(before=datetime.now() + timedelta(days=1))
+            hashids.append(paster.create(b"spam", ip="1.2.3.4"))
+        args = ["paste", "purge", "--ip", "1.2.3.4"]
+        result = test_cli_runner.invoke(args=[*args, "--dry-run"])
+        assert "would remove 4 pastes (22 bytes)" in result.output
+        result = test_cli_runner.invoke(args=[*args, "--batch-size", 2])
+        lines = result.output.splitlines()
+        assert lines[:2] == [
+            "removed 2 pastes (from packs)",
+            "removed 3 pastes (from packs)",
+        ]
+        assert lines[2].startswith("removed 4 pastes (through id ")
+        assert lines[3:] == ["removed 4 pastes"]
+        with pbnh.db.paster_context() as paster:
+            assert not any(paster.exists(hashid=hashid) for hashid in hashids)
+            assert paster.stats() == [{"count": 0, "size": 0}]
+
+
+@pytest.mark.parametrize("rebuild", [[], ["--rebuild"]])
+def test_cli_paste_stats(app, test_cli_runner, rebuild):
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            paster.create(b"Example Data", ip="1.2.3.4")
+        result = test_cli_runner.invoke(args=["paste", "stats", *rebuild])
+        assert "total: 1 pastes (12 bytes)" in result.output
+        result = test_cli_runner.invoke(args=["paste", "stats", "--by", "ip"])
+        assert "1.2.3.4: 1 pastes (12 bytes)" in result.output
+
+
+def test_cli_paste_clean_uploads(app, test_cli_runner, tmp_path):
+    with app.app_context():
+        result = test_cli_runner.invoke(args=["paste", "clean-uploads"])
+        assert "UPLOAD_DIR is not set" in result.output
+        uploads = pbnh.upload.Uploads(str(tmp_path), ttl=0)
+        app.extensions[pbnh.upload.EXTENSION] = uploads
+        uploads.create(size=1)
+        result = test_cli_runner.invoke(args=["paste", "clean-uploads"])
+        assert "removed 1 uploads" in result.output
+
+
+def test_cli_paste_clean_files(app, test_cli_runner, tmp_path):
+    with app.app_context():
+        result = test_cli_runner.invoke(args=["paste", "clean-files"])
+        assert "SENDFILE_DIR is not set" in result.output
+        files = pbnh.sendfile.Files(str(tmp_path))
+        app.extensions[pbnh.sendfile.EXTENSION] = files
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with pbnh.db.paster_context() as paster:
+            hashids = [
+                paster.create(b"live"),
+                paster.create(b"expired", sunset=now - timedelta(seconds=1)),
+                paster.create(b"removed"),
+            ]
+        for hashid in hashids:
+            files.materialize(hashid, [b""], timestamp=now)
+        test_cli_runner.invoke(args=["paste", "remove", hashids[2]])
+        result = test_cli_runner.invoke(
+            args=["paste", "clean-files", "--batch-size", 1]
+        )
+        assert "removed 1 files" in result.output
+        assert list(files.hashids()) == hashids[:1]
+
+
+def test_cli_paste_tier(app, test_cli_runner, tmp_path):
+    with app.app_context():
+        for command in ("tier", "repack"):
+            result = test_cli_runner.invoke(args=["paste", command])
+            assert "PACK_DIR is not set" in result.output
+        app.extensions[pbnh.pack.EXTENSION] = pbnh.pack.Packs(str(tmp_path))
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        with pbnh.db.paster_context() as paster:
+            hashids = [
+                paster.create(b"old", timestamp=now - timedelta(days=31)),
+                paster.create(
+                    b"expired",
+                    timestamp=now - timedelta(days=2),
+                    sunset=now - timedelta(seconds=1),
+                ),
+                paster.create(b"new"),
+            ]
+        result = test_cli_runner.invoke(args=["paste", "tier"])
+        assert "moved 1 pastes to pack " in result.output
+        assert result.output.endswith("moved 1 pastes\n")
+        app.config["PACK_TIER_AFTER"] = 1
+        result = test_cli_runner.invoke(
+            args=["paste", "tier", "--older-than", 0.5, "--limit", 1]
+        )
+        assert result.output.endswith("moved 1 pastes\n")
+        test_cli_runner.invoke(args=["paste", "remove", hashids[0]])
+        result = test_cli_runner.invoke(args=["paste", "repack"])
+        assert "kept 0 pastes (1 expired), reclaiming " in result.output
+        with pbnh.db.paster_context() as paster:
+            assert paster.stats() == [{"count": 1, "size": 3}]
+            assert paster.query(hashid=hashids[2])
+
+
+def test_cli_paste_list(app, test_cli_runner):
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashids = [paster.create(f"{i}".encode(), ip="1.2.3.4") for i in range(3)]
+            paster.create(b"other", ip="5.6.7.8")
+        result = test_cli_runner.invoke(
+            args=["paste", "list", "--ip", "1.2.3.4", "--limit", 2]
+        )
+        assert hashids[2] in result.output
+        assert hashids[0] not in result.output
+        cursor = result.output.split("--before ")[1].rstrip(")\n")
+        result = test_cli_runner.invoke(
+            args=["paste", "list", "--ip", "1.2.3.4", "--before", cursor]
+        )
+        assert result.output.startswith(f"{hashids[0]} ")
+        assert "1.2.3.4 application/octet-stream (1 bytes)" in result.output
+        assert "--before" not in result.output
+        result = test_cli_runner.invoke(args=["paste", "list", "--before", "x"])
+        assert "Invalid value for --before" in result.output
+
+
+def test_cli_paste_search(app, test_cli_runner):
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashids = [paster.create(f"{i} found".encode()) for i in range(3)]
+        result = test_cli_runner.invoke(args=["paste", "reindex", "--batch-size", 2])
+        assert "indexed all pastes" in result.output
+        result = test_cli_runner.invoke(args=["paste", "search", "found", "--limit", 2])
+        assert hashids[2] in result.output
+        assert hashids[0] not in result.output
+        assert "--before" in result.output
+        result = test_cli_runner.invoke(args=["paste", "search", "missing"])
+        assert not result.output
+        result = test_cli_runner.invoke(args=["paste", "search", "x", "--limit", 0])
+        assert result.exit_code == 2  # usage error
+
+
+def test_cli_pbnh_loadtest(test_cli_runner):
+    result = test_cli_runner.invoke(
+        args=[
+            "pbnh",
+            "loadtest",
+            "--duration",
+            "0.2",
+            "--concurrency",
+            "1",
+            "--mix",
+            "raw=2, missing=1",
+            "--sizes",
+            "10,20",
+            "--count",
+            "1",
+        ]
+    )
+    assert result.exit_code == 0
+    report = json.loads(result.output)
+    assert report["endpoints"].keys() == {"raw", "missing"}
+
+
+def test_cli_pbnh_loadtest_url(test_cli_runner, monkeypatch):
+    def fake_run(new_request, **kwargs):
+        return {"url": new_request.args[0]}
+
+    monkeypatch.setattr("pbnh.loadtest.run", fake_run)
+    result = test_cli_runner.invoke(
+        args=["pbnh", "loadtest", "--url", "http://pbnh.example.com"]
+    )
+    assert json.loads(result.output) == {"url": "http://pbnh.example.com"}
+
+
+@pytest.mark.parametrize(
+    "args", [["--mix", "raw"], ["--mix", "bogus=1"], ["--sizes", "big"]]
+)
+def test_cli_pbnh_loadtest_invalid(test_cli_runner, args):
+    result = test_cli_runner.invoke(args=["pbnh", "loadtest", "--count", "1", *args])
+    assert result.exit_code == 2
+
+
+def test_cli_paste_verify(app, test_cli_runner, tmp_path):
+    checkpoint = tmp_path / "checkpoint"
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashids = sorted(paster.create(f"{i}".encode()) for i in range(3))
+        args = ["paste", "verify", "--checkpoint", checkpoint, "--batch-size", 2]
+        result = test_cli_runner.invoke(args=[*args, "--jobs", 1, "--mime"])
+        assert result.exit_code == 0
+        assert "checked 3 pastes (0 with problems)" in result.output
+        assert checkpoint.read_text() == hashids[-1]
+        with pbnh.db.paster_context() as paster:
+            assert paster.create(b"b") > hashids[-1]
+        with pbnh.db._get_engine().begin() as connection:
+            connection.execute(
+                sqlalchemy.update(pbnh.db._Paste)
+                .where(pbnh.db._Paste.hashid == hashids[1])
+                .values(data=b"corrupt")
+            )
+        # Only new pastes are checked (since the checkpoint).
+        result = test_cli_runner.invoke(args=args)
+        assert f"resuming after {hashids[-1]}" in result.output
+        assert "checked 1 pastes (0 with problems)" in result.output
+        result = test_cli_runner.invoke(args=["paste", "verify"])
+        assert result.exit_code == 1
+        assert f"{hashids[1]}: the data hashes to" in result.output
+        assert "checked 4 pastes (1 with problems)" in result.output
+
+
+def test_cli_paste_verify_packed(app, test_cli_runner, tmp_path):
+    """Packed pastes are verified too."""
+    app.extensions[pbnh.pack.EXTENSION] = pbnh.pack.Packs(str(tmp_path))
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            packed = paster.create(b"packed")
+            paster.tier(before=datetime.now() + timedelta(days=1))
+            paster.create(b"unpacked")
+        result = test_cli_runner.invoke(args=["paste", "verify", "--jobs", 1])
+        assert "checked 2 pastes (0 with problems)" in result.output
+        (path,) = tmp_path.glob("*.pack")
+        path.write_bytes(path.read_bytes()[:-1] + b"x")
+        app.extensions[pbnh.pack.EXTENSION] = pbnh.pack.Packs(str(tmp_path))
+        result = test_cli_runner.invoke(args=["paste", "verify", "--jobs", 1])
+        assert result.exit_code == 1
+        assert f"{packed}: the data is missing" in result.output
@@ -1,8 +1,15 @@
-from datetime import datetime
+import hashlib
+import io
+import os
+from datetime import date, datetime, timedelta, timezone
 
 import pytest
+import sqlalchemy
+from sqlalchemy import delete, text
 
+import pbnh
 import pbnh.db
+import pbnh.pack
 
 
 def test_db_config_missing(app, monkeypatch):
@@ -44,15 +51,16 @@ def test_create_new(paster):
         )
 
 
-def test_create_dupe(paster):
+def test_create_dupe(paster, upsert):
     data = b"This is a test paste"
     with paster as p:
         hashid = p.create(data)
         with pytest.raises(pbnh.db.PasteExists, match=hashid):
             p.create(data)
+        assert p.stats() == [{"count": 1, "size": len(data)}]
 
 
-def test_create_collision(paster):
+def test_create_collision(paster, upsert):
     """Collisions cause an exception."""
     with paster as p:
         with open("tests/shattered-1.pdf", mode="rb") as f:
@@ -62,6 +70,127 @@ def test_create_collision(paster):
                 p.create(f.read())
 
 
+def test_create_removed(paster, monkeypatch):
+    """A paste that is removed while it is compared is created again."""
+    query_duplicate = pbnh.db._Paster._query_duplicate
+
+    def _query_duplicate(self, *, hashid, data):
+        monkeypatch.setattr(pbnh.db._Paster, "_query_duplicate", query_duplicate)
+        self.delete(hashid=hashid)
+        return None
+
+    with paster as p:
+        hashid = p.create(b"a")
+        monkeypatch.setattr(pbnh.db._Paster, "_query_duplicate", _query_duplicate)
+        assert p.create(b"a", mime="text/x-a") == hashid
+        assert p.query(hashid=hashid)["mime"] == "text/x-a"
+        with pytest.raises(pbnh.db.PasteExists):
+            p.create(b"a")
+
+
+@pytest.fixture
+def stream_chunk_size(monkeypatch):
+    monkeypatch.setattr(pbnh.db, "_STREAM_CHUNK_SIZE", 1024)
+
+
+def test_create_streamed(app, paster, upsert, stream_chunk_size):
+    """Streams are inserted (and compared) a chunk at a time."""
+    app.config["SEARCH_INDEX"] = True
+    data = b"streamed\n" + os.urandom(2000).hex().encode()
+    with paster as p:
+        hashid = p.create(io.BytesIO(data), mime="text/plain")
+        assert hashid == hashlib.sha1(data).hexdigest()
+        assert p.query(hashid=hashid)["data"] == data
+        assert [result["hashid"] for result in p.search("streamed")] == [hashid]
+        with pytest.raises(pbnh.db.PasteExists, match=hashid):
+            p.create(io.BytesIO(data), hashid=hashid)
+        assert p.stats() == [{"count": 1, "size": len(data)}]
+
+
+def test_create_streamed_collision(paster, stream_chunk_size):
+    with paster as p:
+        with open("tests/shattered-1.pdf", mode="rb") as f:
+            hashid = p.create(f)
+            assert p.query(hashid=hashid)["mime"] == "application/pdf"
+        with open("tests/shattered-2.pdf", mode="rb") as f:
+            with pytest.raises(pbnh.db.HashCollision, match=f"^{hashid}$"):
+                p.create(f)
+        # (Or if the size differs.)
+        with pytest.raises(pbnh.db.HashCollision):
+            p.create(io.BytesIO(os.urandom(2000)), hashid=hashid)
+
+
+@pytest.mark.parametrize(
+    "data,mime", [(b"small", None), (b"https://example.com/" * 100, "redirect")]
+)
+def test_create_streamed_whole(paster, stream_chunk_size, data, mime):
+    """Small (and redirect) streams are created like data."""
+    if mime == "redirect":
+        mime = pbnh.db.REDIRECT_MIME
+    with paster as p:
+        hashid = p.create(io.BytesIO(data), mime=mime)
+        assert p.query(hashid=hashid)["data"] == data
+        assert (p.query_redirect(hashid=hashid) is None) is (mime is None)
+
+
+def test_create_streamed_removed(paster, monkeypatch, stream_chunk_size):
+    """A paste that is removed while it is compared is created again."""
+    compare_streamed = pbnh.db._Paster._compare_streamed
+    data = b"\0\\x" + os.urandom(2000)
+
+    def _compare_streamed(self, stream, *, hashid):
+        monkeypatch.setattr(pbnh.db._Paster, "_compare_streamed", compare_streamed)
+        self.delete(hashid=hashid)
+        return compare_streamed(self, stream, hashid=hashid)
+
+    with paster as p:
+        hashid = p.create(data)
+        monkeypatch.setattr(pbnh.db._Paster, "_compare_streamed", _compare_streamed)
+        assert p.create(io.BytesIO(data), mime="text/x-a") == hashid
+        assert p.query(hashid=hashid)["mime"] == "text/x-a"
+
+
+def test_create_many(paster):
+    with open("tests/shattered-1.pdf", mode="rb") as f:
+        shattered_1 = f.read()
+    with open("tests/shattered-2.pdf", mode="rb") as f:
+        shattered_2 = f.read()
+    with paster as p:
+        existing = p.create(b"a")
+        pastes = [{"data": data} for data in [b"a", b"b", b"b", shattered_1]]
+        pastes.append({"data": shattered_2, "ip": "1.2.3.4"})
+        for dry_run in [True, False]:
+            results = p.create_many(pastes, dry_run=dry_run)
+            assert [type(result) for result in results] == [
+                pbnh.db.PasteExists,
+                str,
+                pbnh.db.PasteExists,
+                str,
+                pbnh.db.HashCollision,
+            ]
+            assert str(results[0]) == existing
+            assert bool(p.query(hashid=results[1])) is not dry_run
+
+
+def test_create_many_race(paster, monkeypatch):
+    """Pastes created concurrently are handled one at a time."""
+    add = pbnh.db._Paster._add
+    racing = []
+
+    def _add(self, paste):
+        if not racing:
+            racing.append(paste)
+            with pbnh.db.paster_context() as other:
+                other.create(paste.data)
+        add(self, paste)
+
+    monkeypatch.setattr(pbnh.db._Paster, "_add", _add)
+    with paster as p:
+        results = p.create_many([{"data": b"a"}, {"data": b"b"}])
+    assert isinstance(results[0], pbnh.db.PasteExists)
+    assert isinstance(results[1], str)
+
+
 def test_query(paster):
     data = b"This is a test paste"
     timestamp = datetime.now()
@@ -81,6 +210,33 @@ def test_query_nonexistent(paster):
         assert p.query(hashid="nonexistent") is None
 
 
+def test_exists(paster):
+    with paster as p:
+        assert not p.exists(hashid="nonexistent")
+        assert p.exists(hashid=p.create(b"a"))
+
+
+def test_engine_pooled(app, monkeypatch):
+    with app.app_context():
+        engine = pbnh.db._get_engine()
+    with app.app_context():
+        assert pbnh.db._get_engine() is engine
+        # A forked process gets an engine of its own.
+        monkeypatch.setattr(os, "getpid", lambda: -1)
+        forked = pbnh.db._get_engine()
+        assert forked is not engine
+        assert pbnh.db._get_engine() is forked
+        pbnh.db.dispose()
+        assert pbnh.db._get_engine() is not forked
+
+
+def test_engine_options(app):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_pre_ping": True}
+    with app.app_context():
+        pbnh.db.dispose()
+        assert pbnh.db._get_engine().pool._pre_ping
+
+
 def test_delete(paster):
     with paster as p:
         hashid = p.create(b"This is a test paste")
@@ -91,3 +247,752 @@ def test_delete(paster):
 def test_delete_nonexistent(paster):
     with paster as p:
         assert not p.delete(hashid="nonexistent")
+
+
+def test_query_many(paster):
+    with paster as p:
+        hashids = [p.create(data) for data in [b"a", b"b", b"c"]]
+        requested = [hashids[2], "nonexistent", *hashids]
+        results = list(p.query_many(hashids=requested, chunk_size=2))
+    assert [hashid for hashid, _ in results] == requested
+    assert [paste and paste["data"] for _, paste in results] == [
+        b"c",
+        None,
+        b"a",
+        b"b",
+        b"c",
+    ]
+
+
+def test_scan_hashids(paster):
+    with paster as p:
+        assert p.last_id() == 0
+        hashids = [p.create(f"{i}".encode()) for i in range(3)]
+        page = p.scan_hashids(limit=2)
+        assert [hashid for _, hashid in page] == hashids[:2]
+        assert p.scan_hashids(after_id=page[-1][0]) == [(p.last_id(), hashids[2])]
+
+
+def test_unexpired(paster):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with paster as p:
+        hashids = [
+            p.create(b"a"),
+            p.create(b"b", sunset=now + timedelta(days=1)),
+            p.create(b"c", sunset=now - timedelta(seconds=1)),
+        ]
+        assert p.unexpired(hashids=[*hashids, "nonexistent"]) == set(hashids[:2])
+
+
+def test_scan(paster):
+    with paster as p:
+        hashids = sorted(p.create(data) for data in [b"a", b"b", b"c"])
+        assert [paste["hashid"] for paste in p.scan(limit=2)] == hashids[:2]
+        (paste,) = p.scan(after=hashids[0], through=hashids[1])
+    assert paste.keys() == {"hashid", "mime", "size", "data"}
+    assert paste["hashid"] == hashids[1]
+
+
+def test_list(paster):
+    timestamp = datetime(2026, 1, 2, 3, 4, 5)
+    with paster as p:
+        hashids = [
+            p.create(
+                data,
+                ip=ip,
+                mime=mime,
+                # Pastes can share a timestamp (so pages are split by id too).
+                timestamp=timestamp + timedelta(seconds=i // 2),
+            )
+            for i, (data, ip, mime) in enumerate(
+                [
+                    (b"a", "1.2.3.4", "text/plain"),
+                    (b"bc", "1.2.3.4", "text/markdown"),
+                    (b"def", "5.6.7.8", "text/plain"),
+                    (b"ghij", None, "text/plain"),
+                    (b"klmno", "1.2.3.4", "text/plain"),
+                ]
+            )
+        ]
+        pages = [p.list(limit=2)]
+        while len(pages[-1]) == 2:
+            pages.append(p.list(before=pages[-1][-1]["cursor"], limit=2))
+        assert [[paste["hashid"] for paste in page] for page in pages] == [
+            hashids[:2:-1],
+            hashids[2:0:-1],
+            hashids[:1],
+        ]
+        assert pages[0][0].keys() == {
+            "cursor",
+            "hashid",
+            "ip",
+            "mime",
+            "timestamp",
+            "sunset",
+            "size",
+        }
+
+        def _list(**kwargs):
+            return [hashids.index(paste["hashid"]) for paste in p.list(**kwargs)]
+
+        assert _list(mime="text/plain", ip="1.2.3.4") == [4, 0]
+        assert _list(min_size=2, max_size=4) == [3, 2, 1]
+        assert _list(before=pages[0][0]["cursor"], ip="5.6.7.8") == [2]
+        for cursor in ["abc", "2026-01-02T03:04:05,abc"]:
+            with pytest.raises(ValueError):
+                p.list(before=cursor)
+
+
+def test_query_metadata(paster):
+    with paster as p:
+        hashid = p.create(b"abcd")
+        paste = p.query_metadata(hashid=hashid)
+        assert paste.keys() == {"hashid", "ip", "mime", "sunset", "timestamp", "size"}
+        assert paste["size"] == 4
+        assert p.query_metadata(hashid=hashid, max_data=4)["data"] == b"abcd"
+        assert p.query_metadata(hashid="nonexistent") is None
+        with p._session.begin():
+            p._session.execute(sqlalchemy.update(pbnh.db._Paste).values(size=None))
+        # Data is included when the size is unknown (e.g. during an upgrade).
+        paste = p.query_metadata(hashid=hashid)
+        assert (paste["size"], paste["data"]) == (4, b"abcd")
+
+
+@pytest.mark.parametrize("data", [b"abcdefghij", b"abcdefgh", b""])
+def test_read(paster, data):
+    with paster as p:
+        hashid = p.create(data)
+        chunks = list(p.read(hashid=hashid, chunk_size=4))
+        assert b"".join(chunks) == data
+        assert all(isinstance(chunk, bytes) for chunk in chunks)
+        assert not list(p.read(hashid="nonexistent"))
+        assert b"".join(p.read(hashid=hashid, chunk_size=4, start=1, stop=6)) == (
+            data[1:6]
+        )
+
+
+def test_query_redirect(paster):
+    with paster as p:
+        hashid = p.create(b"https://example.com", mime=pbnh.db.REDIRECT_MIME)
+        assert p.query_redirect(hashid=hashid) == "https://example.com"
+        # Redirects that can't be decoded are not followed.
+        undecodable = p.create(b"\xff", mime=pbnh.db.REDIRECT_MIME)
+        assert p.query_redirect(hashid=undecodable) is None
+        assert p.query_redirect(hashid=p.create(b"abc")) is None
+        p.delete(hashid=hashid)
+        assert p.query_redirect(hashid=hashid) is None
+
+
+def test_index(paster):
+    with paster as p:
+        hashid = p.create(b"This is a test paste")
+        assert p.query_index(hashid=hashid, kind="test") is None
+        p.create_index(hashid=hashid, kind="test", data=b"index")
+        p.create_index(hashid=hashid, kind="test", data=b"index")  # no-op
+        assert p.query_index(hashid=hashid, kind="test") == b"index"
+        p.delete(hashid=hashid)
+        assert p.query_index(hashid=hashid, kind="test") is None
+
+
+@pytest.fixture(params=["native", "fallback"])
+def upsert(request, monkeypatch):
+    """Test with and without dialect-specific upserts."""
+    if request.param == "fallback":
+        monkeypatch.setattr(pbnh.db, "_UPSERTS", {})
+
+
+def test_stats(paster, upsert):
+    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
+    with paster as p:
+        assert p.stats() == [{"count": 0, "size": 0}]
+        p.create(b"a", ip="1.2.3.4", mime="text/plain")
+        p.create(b"bb", ip="1.2.3.4", mime="text/plain")
+        p.create(b"ccc", ip="1.2.3.4", mime="text/plain", timestamp=yesterday)
+        hashid = p.create(b"dddd", mime="text/x-rst")
+        with pytest.raises(pbnh.db.PasteExists):
+            p.create(b"dddd", mime="text/x-rst")
+        assert p.stats() == [{"count": 4, "size": 10}]
+        assert p.stats(by="ip") == [
+            {"ip": "1.2.3.4", "count": 3, "size": 6},
+            {"ip": "", "count": 1, "size": 4},
+        ]
+        assert p.stats(by="mime", since=datetime.now(timezone.utc).date()) == [
+            {"mime": "text/x-rst", "count": 1, "size": 4},
+            {"mime": "text/plain", "count": 2, "size": 3},
+        ]
+        assert p.stats(by="day", ip="1.2.3.4") == [
+            {"day": yesterday.date(), "count": 1, "size": 3},
+            {"day": datetime.now(timezone.utc).date(), "count": 2, "size": 3},
+        ]
+        p.delete(hashid=hashid)
+        assert p.stats(by="ip") == [{"ip": "1.2.3.4", "count": 3, "size": 6}]
+
+
+def test_rebuild_stats(paster):
+    with paster as p:
+        p.create(b"a", ip="1.2.3.4")
+        p.create(b"bb")
+        expected = p.stats(by="ip")
+        p.rebuild_stats()
+        assert p.stats(by="ip") == expected
+
+
+def test_stats_day(paster):
+    """Stats are kept under the day of the (UTC) paste timestamp."""
+    with paster as p:
+        timestamp = p.query(hashid=p.create(b"a"))["timestamp"]
+        assert timestamp.tzinfo is None
+        (row,) = p.stats(by="day")
+        assert row["day"] == timestamp.date()
+
+
+def test_rebuild_stats_days(paster, upsert):
+    with paster as p:
+        for data, timestamp in [
+            (b"a", datetime(2020, 1, 1, 23, 59)),
+            (b"bb", datetime(2020, 1, 2)),
+            (b"ccc", datetime(2020, 1, 2, 12)),
+        ]:
+            p.create(data, timestamp=timestamp)
+        p.delete(hashid=p.create(b"dddd", timestamp=datetime(2020, 1, 3)))
+        expected = p.stats(by="day")
+        assert [row["count"] for row in expected] == [2, 1]
+        with p._session.begin():
+            # Drift (e.g. from before stats were kept):
+            p._session.execute(delete(pbnh.db._PasteStats))
+            p._update_stats(
+                ip=None, mime="text/plain", day=date(2020, 1, 3), count=1, size=1
+            )
+        for _ in range(2):  # Rebuilds can be rerun.
+            p.rebuild_stats()
+            assert p.stats(by="day") == expected
+
+
+@pytest.fixture
+def search_paster(app):
+    app.config["SEARCH_INDEX"] = True
+    with app.app_context():
+        yield pbnh.db.paster_context()
+
+
+def test_search(search_paster):
+    past = datetime.now(timezone.utc) - timedelta(seconds=1)
+    with search_paster as p:
+        first = p.create(b"Traceback: KeyError in foo.py", mime="text/plain")
+        p.create(b"Traceback: KeyError (expired)", mime="text/plain", sunset=past)
+        p.create(b"Traceback: KeyError in binary", mime="application/octet-stream")
+        third = p.create(b"Traceback: ValueError", mime="text/plain")
+        second = p.create(b'"Traceback": KeyError in bar.py\x00', mime="text/x-log")
+        results = p.search("keyerror traceback", limit=1)
+        assert [result["hashid"] for result in results] == [second]
+        results = p.search("keyerror traceback", before=results[0]["cursor"])
+        assert [result["hashid"] for result in results] == [first]
+        assert results[0]["size"] == 29
+        assert [result["hashid"] for result in p.search('"traceback"')] == [
+            second,
+            third,
+            first,
+        ]
+        assert p.search(" ") == []
+        p.delete(hashid=second)
+        assert [result["hashid"] for result in p.search("bar")] == []
+
+
+def test_purge(search_paster):
+    old = datetime(2026, 1, 1)
+    with search_paster as p:
+        spam = [
+            p.create(
+                f"spam {i}".encode(), ip="1.2.3.4", mime="text/plain", timestamp=old
+            )
+            for i in range(3)
+        ]
+        spam.append(
+            p.create(b"https://example.com", ip="1.2.3.4", mime=pbnh.db.REDIRECT_MIME)
+        )
+        p.create_index(hashid=spam[0], kind="lines", data=b"")
+        ham = p.create(b"ham", ip="5.6.7.8", mime="text/plain", timestamp=old)
+        assert p.count_purge(ip="1.2.3.4") == {"count": 4, "size": 37}
+        assert p.count_purge(ip="1.2.3.4", before=old + timedelta(days=1)) == {
+            "count": 3,
+            "size": 18,
+        }
+        assert p.count_purge(mime="text/plain", larger_than=3) == {
+            "count": 3,
+            "size": 18,
+        }
+        after, hashids = p.purge(ip="1.2.3.4", limit=2)
+        assert hashids == spam[:2]
+        after, hashids = p.purge(ip="1.2.3.4", after=after, limit=2)
+        assert hashids == spam[2:]
+        assert p.purge(ip="1.2.3.4", after=after) is None
+        assert p.count_purge(ip="1.2.3.4") == {"count": 0, "size": 0}
+        assert p.query(hashid=ham)
+        assert p.query_index(hashid=spam[0], kind="lines") is None
+        assert p.query_redirect(hashid=spam[3]) is None
+        assert [result["hashid"] for result in p.search("spam")] == []
+        assert p.stats(by="ip") == [{"ip": "5.6.7.8", "count": 1, "size": 3}]
+
+
+def test_purge_unindexed(paster):
+    with paster as p:
+        hashid = p.create(b"abc", mime="text/plain")
+        assert p.purge(mime="text/plain") == (1, [hashid])
+        assert p.query(hashid=hashid) is None
+        assert p.purge_packed(mime="text/plain") is None  # (without PACK_DIR)
+
+
+@pytest.fixture
+def packs(app, tmp_path):
+    packs = pbnh.pack.Packs(str(tmp_path / "packs"))
+    app.extensions[pbnh.pack.EXTENSION] = packs
+    return packs
+
+
+@pytest.fixture
+def pack_paster(app, packs):
+    app.config["SEARCH_INDEX"] = True
+    with app.app_context():
+        yield pbnh.db.paster_context()
+
+
+def test_tier(pack_paster):
+    old = datetime(2026, 1, 1)
+    tomorrow = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(days=1)
+    with pack_paster as p:
+        text = p.create(b"old text", mime="text/plain", timestamp=old, sunset=tomorrow)
+        redirect = p.create(
+            b"https://example.com",
+            ip="1.2.3.4",
+            mime=pbnh.db.REDIRECT_MIME,
+            timestamp=old,
+        )
+        p.create_index(hashid=redirect, kind="lines", data=b"index")
+        expired = p.create(b"expired", timestamp=old, sunset=old)
+        new = p.create(b"new text", mime="text/plain")
+        pastes = {
+            hashid: p.query(hashid=hashid) for hashid in (text, redirect, expired)
+        }
+        stats = p.stats(by="ip")
+        before = old + timedelta(days=1)
+        pack, count = p.tier(before=before, limit=2, batch_size=1)
+        assert count == 2
+        assert p.tier(before=before)[1] == 1
+        assert p.tier(before=before) is None
+        assert [paste["hashid"] for paste in p.list()] == [new]
+        # Packed pastes can still be looked up (but not searched).
+        for hashid, paste in pastes.items():
+            assert p.query(hashid=hashid) == paste
+            assert p.exists(hashid=hashid)
+        assert dict(p.query_many(hashids=[text, new, "nonexistent"])) == {
+            text: pastes[text],
+            new: p.query(hashid=new),
+            "nonexistent": None,
+        }
+        assert p.query_metadata(hashid=text, max_data=8)["data"] == b"old text"
+        assert "data" not in p.query_metadata(hashid=text)
+        assert b"".join(p.read(hashid=text, chunk_size=2, start=1, stop=7)) == (
+            b"ld tex"
+        )
+        assert not list(p.read(hashid="nonexistent"))
+        assert not p.exists(hashid="nonexistent")
+        assert p.unexpired(hashids=[text, expired, new, "nonexistent"]) == {text, new}
+        assert p.query_redirect(hashid=redirect) == "https://example.com"
+        assert p.query_index(hashid=redirect, kind="lines") == b"index"
+        assert [result["hashid"] for result in p.search("text")] == [new]
+        assert p.stats(by="ip") == stats
+        p.rebuild_stats()
+        assert p.stats(by="ip") == stats
+
+
+def test_tier_removed_since_packed(pack_paster, monkeypatch):
+    """Pastes removed while they are packed stay removed."""
+    publish = pbnh.pack._Writer.publish
+
+    def _publish(self, **kwargs):
+        publish(self, **kwargs)
+        with pbnh.db.paster_context() as other:
+            assert other.delete(hashid=hashid)
+
+    with pack_paster as p:
+        hashid = p.create(b"abc")
+        monkeypatch.setattr(pbnh.pack._Writer, "publish", _publish)
+        assert p.tier(before=datetime.now() + timedelta(days=1))[1] == 1
+        assert p.query(hashid=hashid) is None
+        assert p.stats() == [{"count": 0, "size": 0}]
+
+
+def test_tier_unsupported(paster):
+    with paster as p:
+        for method, kwargs in [(p.tier, {"before": datetime.now()}), (p.repack, {})]:
+            with pytest.raises(pbnh.db.PasteDBError, match="PACK_DIR is not set"):
+                method(**kwargs)
+
+
+def test_delete_packed(app, packs):
+    with app.app_context(), pbnh.db.paster_context() as p:
+        hashid = p.create(b"https://example.com", mime=pbnh.db.REDIRECT_MIME)
+        p.create_index(hashid=hashid, kind="lines", data=b"")
+        p.tier(before=datetime.now() + timedelta(days=1))
+        assert p.delete(hashid=hashid)
+        assert p.query(hashid=hashid) is None
+        assert p.query_redirect(hashid=hashid) is None
+        assert p.query_index(hashid=hashid, kind="lines") is None
+        assert p.stats() == [{"count": 0, "size": 0}]
+        assert not p.delete(hashid=hashid)
+        # Pastes in the paste table and a pack (e.g. after a tier was
+        # interrupted) are removed from both (and only counted once).
+        hashid = p.create(b"abc")
+        with packs.writer() as writer:
+            writer.add({**p.query_metadata(hashid=hashid, max_data=3), "size": 3})
+        assert p.delete(hashid=hashid)
+        assert p.query(hashid=hashid) is None
+        assert p.stats() == [{"count": 0, "size": 0}]
+
+
+def test_create_packed(app, packs, stream_chunk_size):
+    with open("tests/shattered-1.pdf", mode="rb") as f:
+        shattered_1 = f.read()
+    with open("tests/shattered-2.pdf", mode="rb") as f:
+        shattered_2 = f.read()
+    with app.app_context(), pbnh.db.paster_context() as p:
+        hashid = p.create(shattered_1)
+        p.tier(before=datetime.now() + timedelta(days=1))
+        with pytest.raises(pbnh.db.PasteExists):
+            p.create(shattered_1)
+        with pytest.raises(pbnh.db.HashCollision):
+            p.create(shattered_2)
+        with pytest.raises(pbnh.db.PasteExists):
+            p.create(io.BytesIO(shattered_1), hashid=hashid)
+        with pytest.raises(pbnh.db.HashCollision):
+            p.create(io.BytesIO(shattered_2), hashid=hashid)
+        results = p.create_many(
+            [{"data": shattered_1}, {"data": shattered_2}, {"data": b"new"}]
+        )
+        assert [type(result) for result in results] == [
+            pbnh.db.PasteExists,
+            pbnh.db.HashCollision,
+            str,
+        ]
+        assert str(results[0]) == hashid
+        assert p.stats() == [{"count": 2, "size": len(shattered_1) + 3}]
+
+
+def test_repack(app, packs):
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    with app.app_context(), pbnh.db.paster_context() as p:
+        kept = p.create(b"kept", ip="1.2.3.4", sunset=now + timedelta(days=1))
+        expired = p.create(
+            b"https://example.com",
+            ip="1.2.3.4",
+            mime=pbnh.db.REDIRECT_MIME,
+            sunset=now - timedelta(seconds=1),
+        )
+        p.create_index(hashid=expired, kind="lines", data=b"")
+        removed = p.create(b"removed")
+        p.tier(before=now + timedelta(days=1))
+        p.delete(hashid=removed)
+        assert p.repack() == (1, 1)
+        assert p.query(hashid=kept)["data"] == b"kept"
+        assert p.query(hashid=expired) is None
+        assert p.query_redirect(hashid=expired) is None
+        assert p.query_index(hashid=expired, kind="lines") is None
+        assert p.stats(by="ip") == [{"ip": "1.2.3.4", "count": 1, "size": 4}]
+
+
+def test_purge_packed(app, packs):
+    old = datetime(2026, 1, 1)
+    with app.app_context(), pbnh.db.paster_context() as p:
+        assert p.purge_packed(ip="1.2.3.4") is None
+        spam = [
+            p.create(f"spam {i}".encode(), ip="1.2.3.4", timestamp=old)
+            for i in range(3)
+        ]
+        spam.append(
+            p.create(b"https://example.com", ip="1.2.3.4", mime=pbnh.db.REDIRECT_MIME)
+        )
+        ham = p.create(b"ham", ip="5.6.7.8", timestamp=old)
+        p.tier(before=datetime.now() + timedelta(days=1))
+        # A copy left in the paste table (by an interrupted tier) is counted once.
+        unpacked = p.create(b"spam 3", ip="1.2.3.4", timestamp=old)
+        with packs.writer() as writer:
+            writer.add({**p.query_metadata(hashid=unpacked, max_data=6), "size": 6})
+        assert p.count_purge(ip="1.2.3.4") == {"count": 5, "size": 43}
+        assert p.count_purge(ip="1.2.3.4", larger_than=6) == {"count": 1, "size": 19}
+        assert p.count_purge(ip="1.2.3.4", before=old + timedelta(days=1)) == {
+            "count": 4,
+            "size": 24,
+        }
+        assert p.count_purge(mime="text/plain", ip="5.6.7.8") == {
+            "count": 1,
+            "size": 3,
+        }
+        removed = p.purge_packed(ip="1.2.3.4", limit=3)
+        assert len(removed) == 3
+        while (batch := p.purge_packed(ip="1.2.3.4", limit=3)) is not None:
+            removed += batch
+        assert sorted(removed) == sorted([*spam, unpacked])
+        assert not any(pbnh.pack.packs().query(hashid) for hashid in spam)
+        assert p.query(hashid=spam[0]) is None
+        assert p.query_redirect(hashid=spam[3]) is None
+        # The copy in the paste table is left to purge (which counts it).
+        assert p.query(hashid=unpacked)["data"] == b"spam 3"
+        assert p.purge(ip="1.2.3.4")[1] == [unpacked]
+        assert p.query(hashid=ham)["data"] == b"ham"
+        assert p.stats(by="ip") == [{"ip": "5.6.7.8", "count": 1, "size": 3}]
+
+
+def test_scan_packed(app, packs):
+    with app.app_context(), pbnh.db.paster_context() as p:
+        hashids = sorted(p.create(f"paste {i}".encode()) for i in range(4))
+        p.tier(before=datetime.now() + timedelta(days=1))
+        # Pastes in the paste table and in packs are scanned in hashid order.
+        unpacked = p.create(b"unpacked")
+        with packs.writer() as writer:
+            writer.add({**p.query_metadata(hashid=unpacked, max_data=8), "size": 8})
+        hashids = sorted([*hashids, unpacked])
+        pastes = p.scan(limit=3)
+        assert [paste["hashid"] for paste in pastes] == hashids[:3]
+        assert pastes[0] == {
+            "hashid": hashids[0],
+            "mime": "text/plain",
+            "size": 7,
+            "data": p.query(hashid=hashids[0])["data"],
+        }
+        pastes = p.scan(after=hashids[2], through=hashids[3])
+        assert [paste["hashid"] for paste in pastes] == hashids[3:4]
+        assert [paste["hashid"] for paste in p.scan(after=hashids[3])] == hashids[4:]
+
+
+def test_reindex_search(app):
+    with app.app_context():
+        with pbnh.db.paster_context() as p:
+            hashids = [
+                p.create(f"word {i}".encode(), mime="text/plain") for i in range(3)
+            ]
+        app.config["SEARCH_INDEX"] = True
+        with pbnh.db.paster_context() as p:
+            assert p.search("word") == []
+            after = p.reindex_search(limit=2)
+            assert len(p.search("word")) == 2
+            after = p.reindex_search(after=0, limit=2)  # Reindexing is idempotent.
+            after = p.reindex_search(after=after, limit=2)
+            assert p.reindex_search(after=after, limit=2) is None
+            assert [r["hashid"] for r in p.search("word")] == hashids[::-1]
+
+
+def test_search_unsupported(search_paster, monkeypatch):
+    monkeypatch.setattr(pbnh.db, "_SEARCH_SQL", {})
+    with search_paster as p:
+        with pytest.raises(pbnh.db.PasteDBError, match="not supported"):
+            p.search("word")
+
+
+@pytest.fixture
+def sqlite_app(tmp_path):
+    """Create an app with a new SQLite database (and some pragmas)."""
+
+    def _create_app(**pragmas):
+        app = pbnh.create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'pastes.sqlite'}",
+                "SQLITE_PRAGMAS": pragmas,
+            }
+        )
+        with app.app_context():
+            pbnh.db.init_db()
+        return app
+
+    return _create_app
+
+
+def test_sqlite_pragmas(sqlite_app):
+    app = sqlite_app(synchronous="full", mmap_size=None)
+    with app.app_context():
+        with pbnh.db._get_engine().connect() as connection:
+            for pragma, value in [
+                ("journal_mode", "wal"),
+                ("synchronous", 2),  # full
+                ("mmap_size", 0),
+                ("busy_timeout", 5000),
+            ]:
+                assert (
+                    connection.execute(text(f"PRAGMA {pragma}")).scalar_one() == value
+                )
+
+
+@pytest.mark.parametrize(
+    "pragmas",
+    [{"journal_mode": "wal; DROP TABLE paste"}, {"mmap_size = 0; --": 0}],
+)
+def test_sqlite_pragmas_malformed(sqlite_app, pragmas):
+    with pytest.raises(pbnh.db.PasteDBError, match="SQLITE_PRAGMAS"):
+        sqlite_app(**pragmas)
+
+
+@pytest.mark.parametrize(
+    "auto_vacuum, vacuum_pages, released",
+    [("incremental", 0, "all"), ("incremental", 10, 10), ("none", 0, 0)],
+)
+def test_checkpoint_db(sqlite_app, auto_vacuum, vacuum_pages, released):
+    app = sqlite_app(auto_vacuum=auto_vacuum)
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            for i in range(10):
+                paster.delete(hashid=paster.create(bytes([i]) * 100_000))
+        with pbnh.db._get_engine().connect() as connection:
+            free_pages = connection.execute(text("PRAGMA freelist_count")).scalar_one()
+        assert free_pages > 10
+        assert pbnh.db.checkpoint_db(vacuum_pages=vacuum_pages) == (
+            free_pages if released == "all" else released,
+            True,
+        )
+
+
+def test_checkpoint_db_busy(sqlite_app):
+    app = sqlite_app(busy_timeout=0)
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            paster.create(b"abc")
+        with pbnh.db._get_engine().connect() as reader:
+            # An open read transaction prevents the WAL from being truncated.
+            reader.exec_driver_sql("BEGIN")
+            reader.execute(text("SELECT * FROM paste")).all()
+            assert pbnh.db.checkpoint_db() == (0, False)
+
+
+def test_checkpoint_db_unsupported(app):
+    with app.app_context():
+        if pbnh.db._get_engine().dialect.name == "sqlite":
+            pytest.skip("SQLite databases are checkpointed.")
+        with pytest.raises(pbnh.db.PasteDBError, match="not checkpointed"):
+            pbnh.db.checkpoint_db()
+
+
+def test_db_version(app):
+    with app.app_context():
+        assert pbnh.db.db_version() == pbnh.db.SCHEMA_VERSION
+        pbnh.db.undo_db()
+        assert pbnh.db.db_version() is None
+        with pytest.raises(pbnh.db.PasteDBError, match="not initialized"):
+            list(pbnh.db.upgrade_db())
+        with pytest.raises(pbnh.db.PasteDBError, match="not initialized"):
+            list(pbnh.db.downgrade_db(to=0))
+
+
+def _indexed_columns(inspector):
+    return {
+        column
+        for index in inspector.get_indexes("paste")
+        if index["name"].startswith("ix_")
+        for column in index["column_names"]
+    }
+
+
+def test_migrations(app):
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashids = [paster.create(data) for data in [b"a", b"bc", b"def"]]
+        messages = list(pbnh.db.downgrade_db(to=0))
+        assert len(messages) == pbnh.db.SCHEMA_VERSION
+        engine = pbnh.db._get_engine()
+        inspector = sqlalchemy.inspect(engine)
+        assert "size" not in {
+            column["name"] for column in inspector.get_columns("paste")
+        }
+        assert not inspector.has_table("paste_stats")
+        assert not _indexed_columns(inspector)
+        # Existing DBs are not stamped by init_db (since they may need upgrades).
+        pbnh.db.init_db()
+        assert pbnh.db.db_version() == 0
+        with engine.begin() as connection:
+            connection.execute(text("DROP TABLE paste_stats"))
+            connection.execute(text("DROP TABLE schema_version"))
+        assert pbnh.db.db_version() == 0
+
+        # Upgrades can be interrupted (and resumed):
+        upgrade = pbnh.db.upgrade_db(batch_size=2)
+        assert next(upgrade) == "backfilled paste.size through id 2"
+        upgrade.close()
+        assert pbnh.db.db_version() == 0
+        messages = list(pbnh.db.upgrade_db(to=1, batch_size=2))
+        assert messages[-1] == "upgraded to version 1 (add paste.size)"
+        assert len(list(pbnh.db.upgrade_db())) > 1
+        assert pbnh.db.db_version() == pbnh.db.SCHEMA_VERSION
+        assert not list(pbnh.db.upgrade_db())
+
+        inspector = sqlalchemy.inspect(engine)
+        assert _indexed_columns(inspector) == {"timestamp", "id", "sunset", "ip"}
+        assert "ix_paste_timestamp" not in {
+            index["name"] for index in inspector.get_indexes("paste")
+        }
+        with pbnh.db.paster_context() as paster:
+            assert paster.stats(by=None) == [{"count": 3, "size": 6}]
+            assert paster.create(b"ghij")
+            paster.delete(hashid=hashids[0])
+            assert paster.stats(by=None) == [{"count": 3, "size": 9}]
+
+
+def test_migrations_redirects(app):
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashids = [
+                paster.create(data, mime=pbnh.db.REDIRECT_MIME)
+                for data in [
+                    b"https://a.example.com",
+                    b"\xff",
+                    b"https://b.example.com",
+                ]
+            ]
+        list(pbnh.db.downgrade_db(to=3))
+        assert not sqlalchemy.inspect(pbnh.db._get_engine()).has_table("paste_redirect")
+        # The backfill can be interrupted (and resumed):
+        upgrade = pbnh.db.upgrade_db(batch_size=1)
+        assert next(upgrade).startswith("backfilled paste_redirect")
+        upgrade.close()
+        list(pbnh.db.upgrade_db(batch_size=2))
+        with pbnh.db.paster_context() as paster:
+            assert [paster.query_redirect(hashid=hashid) for hashid in hashids] == [
+                "https://a.example.com",
+                None,
+                "https://b.example.com",
+            ]
+
+
+def test_migrations_invalid_index(app):
+    """Indexes left invalid by interrupted (concurrent) builds are rebuilt."""
+    with app.app_context():
+        engine = pbnh.db._get_engine()
+        if engine.dialect.name != "postgresql":
+            pytest.skip("Only PostgreSQL builds indexes concurrently.")
+        list(pbnh.db.downgrade_db(to=1))
+        is_valid = (
+            "SELECT indisvalid FROM pg_index WHERE indexrelid = 'ix_paste_ip'::regclass"
+        )
+        with engine.begin() as connection:
+            connection.execute(text("CREATE INDEX ix_paste_ip ON paste (ip)"))
+            connection.execute(
+                text(
+                    "UPDATE pg_index SET indisvalid = false"
+                    " WHERE indexrelid = 'ix_paste_ip'::regclass"
+                )
+            )
+            assert connection.execute(text(is_valid)).scalar() is False
+        list(pbnh.db.upgrade_db())
+        with engine.connect() as connection:
+            assert connection.execute(text(is_valid)).scalar() is True
+
+
+@pytest.mark.parametrize(
+    "migrate, kwargs",
+    [
+        (pbnh.db.upgrade_db, {"to": pbnh.db.SCHEMA_VERSION + 1}),
+        (pbnh.db.upgrade_db, {"to": 0}),
+        (pbnh.db.downgrade_db, {"to": -1}),
+        (pbnh.db.downgrade_db, {"to": pbnh.db.SCHEMA_VERSION + 1}),
+    ],
+)
+def test_migrations_invalid(app, migrate, kwargs):
+    with app.app_context():
+        with pytest.raises(pbnh.db.PasteDBError, match="is not an? (up|down)grade"):
+            list(migrate(**kwargs))
@@ -0,0 +1,282 @@
+import concurrent.futures
+import fcntl
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime
+
+import pytest
+
+import pbnh
+import pbnh.db
+from pbnh import ingest
+
+
+@pytest.fixture
+def write_behind_app(app, tmp_path):
+    """Create an app that writes pastes in batches (and clean it up)."""
+    apps = []
+
+    def _create_app(**config):
+        new_app = pbnh.create_app({**app.config, **config})
+        apps.append(new_app)
+        return new_app
+
+    yield _create_app
+    for new_app in apps:
+        with new_app.app_context():
+            ingest.writer().close()
+
+
+def _post(app, content):
+    return app.test_client().post("/", data={"content": content})
+
+
+def test_commit(write_behind_app):
+    app = write_behind_app(
+        WRITE_BEHIND="commit",
+        WRITE_BEHIND_BATCH_SIZE=8,
+        WRITE_BEHIND_BATCH_DELAY=0.05,
+    )
+    contents = [f"paste {i}" for i in range(20)] * 2
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(contents)) as pool:
+        responses = list(pool.map(lambda content: _post(app, content), contents))
+    assert (
+        sorted(response.status_code for response in responses)
+        == [200] * 20 + [201] * 20
+    )
+    hashid = responses[0].json["hashid"]
+    assert app.test_client().get(f"/{hashid}.txt").data == b"paste 0"
+
+
+def test_commit_collision(write_behind_app):
+    app = write_behind_app(WRITE_BEHIND="commit")
+    client = app.test_client()
+    for path, status in [
+        ("tests/shattered-1.pdf", 201),
+        ("tests/shattered-2.pdf", 409),
+    ]:
+        with open(path, mode="rb") as f:
+            assert client.post("/", data={"content": (f, f.name)}).status_code == status
+
+
+def test_commit_failure(write_behind_app):
+    app = write_behind_app(WRITE_BEHIND="commit")
+    app.config["SQLALCHEMY_DATABASE_URI"] = "1*3451g/1*3/643h3i(&*^%$446"
+    with app.app_context():
+        with pytest.raises(pbnh.db.PasteDBError):
+            ingest.writer().submit(b"abc")
+
+
+def test_journal(write_behind_app, tmp_path):
+    app = write_behind_app(
+        WRITE_BEHIND="journal",
+        WRITE_BEHIND_JOURNAL=str(tmp_path),
+        WRITE_BEHIND_BATCH_DELAY=60,
+    )
+    client = app.test_client()
+    assert _post(app, "abc").status_code == 201
+    (journal,) = tmp_path.glob("*.journal")
+    assert journal.stat().st_size
+    # The paste is available before it is written:
+    hashid = hashlib.sha1(b"abc", usedforsecurity=False).hexdigest()
+    assert client.get(f"/{hashid}.txt").data == b"abc"
+    assert _post(app, "abc").status_code == 200
+    with app.app_context():
+        ingest.writer().close()
+        assert not journal.exists()
+        with pbnh.db.paster_context() as paster:
+            assert paster.query(hashid=hashid)["data"] == b"abc"
+    # Pastes that were already written are detected up front too:
+    app = write_behind_app(WRITE_BEHIND="journal", WRITE_BEHIND_JOURNAL=str(tmp_path))
+    assert _post(app, "abc").status_code == 200
+
+
+def test_journal_collision(write_behind_app, tmp_path):
+    app = write_behind_app(
+        WRITE_BEHIND="journal",
+        WRITE_BEHIND_JOURNAL=str(tmp_path),
+        WRITE_BEHIND_BATCH_DELAY=60,
+    )
+    client = app.test_client()
+    for path, status in [
+        ("tests/shattered-1.pdf", 201),
+        ("tests/shattered-2.pdf", 409),
+    ]:
+        with open(path, mode="rb") as f:
+            assert client.post("/", data={"content": (f, f.name)}).status_code == status
+
+
+def test_journal_replay(app, write_behind_app, tmp_path):
+    pastes = [
+        {"data": b"abc", "ip": None, "mime": "text/plain", "sunset": None},
+        {"data": b"def", "ip": "1.2.3.4", "mime": None, "sunset": None},
+    ]
+    timestamp = datetime(2000, 1, 1)
+    records = [ingest._encode({**paste, "timestamp": timestamp}) for paste in pastes]
+    # The last record was not completely written (so it was not acknowledged):
+    (tmp_path / "crashed.journal").write_bytes(b"".join(records)[:-1])
+    (tmp_path / "closed.journal").write_bytes(
+        ingest._encode({**pastes[0], "data": b"ghi", "timestamp": None})
+    )
+    (tmp_path / "live.journal").write_bytes(records[1])
+    with open(tmp_path / "live.journal", "rb") as live:
+        fcntl.flock(live, fcntl.LOCK_EX)
+        app = write_behind_app(
+            WRITE_BEHIND="journal", WRITE_BEHIND_JOURNAL=str(tmp_path)
+        )
+        with app.app_context():
+            ingest.writer().close()
+            with pbnh.db.paster_context() as paster:
+                assert (
+                    paster.query(
+                        hashid=hashlib.sha1(b"abc", usedforsecurity=False).hexdigest()
+                    )["timestamp"]
+                    == timestamp
+                )
+                assert paster.query(
+                    hashid=hashlib.sha1(b"ghi", usedforsecurity=False).hexdigest()
+                )
+                assert not paster.query(
+                    hashid=hashlib.sha1(b"def", usedforsecurity=False).hexdigest()
+                )
+    assert not (tmp_path / "crashed.journal").exists()
+    assert not (tmp_path / "closed.journal").exists()
+    assert (tmp_path / "live.journal").exists()
+
+
+def test_journal_failure(write_behind_app, tmp_path, monkeypatch, caplog):
+    """Pastes that fail to be written are retried (and replayed if they never are)."""
+    create_many = pbnh.db._Paster.create_many
+    down, failed = threading.Event(), threading.Event()
+    down.set()
+
+    def _create_many(self, pastes, *, dry_run=False):
+        if down.is_set() and not dry_run:
+            failed.set()
+            raise RuntimeError("The DB is down.")
+        return create_many(self, pastes, dry_run=dry_run)
+
+    monkeypatch.setattr(pbnh.db._Paster, "create_many", _create_many)
+    monkeypatch.setattr(ingest, "RETRY_DELAY", 0.01)
+    config = {
+        "WRITE_BEHIND": "journal",
+        "WRITE_BEHIND_JOURNAL": str(tmp_path),
+        "WRITE_BEHIND_BATCH_SIZE": 1,
+    }
+    app = write_behind_app(**config)
+    abc = _post(app, "abc").json["hashid"]
+    assert _post(app, "def").status_code == 201
+    assert failed.wait(10)
+    down.clear()
+    with app.app_context():
+        writer = ingest.writer()
+        for _ in range(1000):
+            if not writer.pending(abc):
+                break
+            time.sleep(0.01)
+        assert writer.pending(abc) is None
+    assert "queued pastes were not written" in caplog.text
+    (journal,) = tmp_path.glob("*.journal")
+    # Pastes that are still failing when the writer stops are kept.
+    down.set()
+    assert _post(app, "ghi").status_code == 201
+    with app.app_context():
+        ingest.writer().close()
+    assert journal.stat().st_size  # ghi was never written.
+    down.clear()
+    app = write_behind_app(**config)
+    with app.app_context():
+        ingest.writer().close()
+        with pbnh.db.paster_context() as paster:
+            for data in (b"abc", b"def", b"ghi"):
+                assert paster.query(
+                    hashid=hashlib.sha1(data, usedforsecurity=False).hexdigest()
+                )
+    assert not journal.exists()
+
+
+def test_journal_written_since_check(write_behind_app, tmp_path, monkeypatch):
+    """Pastes written since they were checked aren't acknowledged again."""
+    app = write_behind_app(WRITE_BEHIND="journal", WRITE_BEHIND_JOURNAL=str(tmp_path))
+    hashid = _post(app, "abc").json["hashid"]
+    with app.app_context():
+        writer = ingest.writer()
+    for _ in range(1000):
+        if not writer.pending(hashid):
+            break
+        time.sleep(0.01)
+    check = ingest.Writer._check
+
+    def _stale_check(paste):
+        # (As if abc were written just after it was checked.)
+        monkeypatch.setattr(ingest.Writer, "_check", staticmethod(check))
+        writer._written += 1
+        return hashid
+
+    monkeypatch.setattr(ingest.Writer, "_check", staticmethod(_stale_check))
+    assert _post(app, "abc").status_code == 200
+
+
+@pytest.mark.parametrize("kwargs", [{"durability": "never"}, {"durability": "journal"}])
+def test_writer_invalid(app, kwargs):
+    with pytest.raises(ValueError):
+        ingest.Writer(app, **kwargs)
+
+
+def test_journal_replay_failure(write_behind_app, tmp_path, monkeypatch):
+    """A failed replay is logged (and the journal is kept for the next one)."""
+    journal = tmp_path / "crashed.journal"
+    journal.write_bytes(
+        ingest._encode(
+            {
+                "data": b"abc",
+                "ip": None,
+                "mime": None,
+                "sunset": None,
+                "timestamp": None,
+            }
+        )
+    )
+
+    def _create_many(self, pastes, *, dry_run=False):
+        raise RuntimeError("The DB is down.")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(pbnh.db._Paster, "create_many", _create_many)
+        app = write_behind_app(
+            WRITE_BEHIND="journal", WRITE_BEHIND_JOURNAL=str(tmp_path)
+        )
+        with app.app_context():
+            writer = ingest.writer()
+            writer.close()
+    assert journal.exists()
+    app = write_behind_app(WRITE_BEHIND="journal", WRITE_BEHIND_JOURNAL=str(tmp_path))
+    with app.app_context():
+        ingest.writer().close()
+    assert not journal.exists()
+
+
+def test_writer_stopped(write_behind_app):
+    app = write_behind_app(WRITE_BEHIND="commit")
+    with app.app_context():
+        writer = ingest.writer()
+        writer.close()
+        with pytest.raises(pbnh.db.PasteDBError, match="not running"):
+            writer.submit(b"abc")
+
+
+def test_journal_batch(write_behind_app, tmp_path):
+    """Pastes that have not been written yet can be retrieved in batches."""
+    app = write_behind_app(
+        WRITE_BEHIND="journal",
+        WRITE_BEHIND_JOURNAL=str(tmp_path),
+        WRITE_BEHIND_BATCH_DELAY=60,
+    )
+    hashid = _post(app, "abc").json["hashid"]
+    response = app.test_client().post("/batch", json={"hashids": [hashid, "missing"]})
+    assert [json.loads(line)["status"] for line in response.data.splitlines()] == [
+        200,
+        404,
+    ]
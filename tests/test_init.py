@@ -5,6 +5,7 @@ from urllib.parse import urlsplit
 import pytest
 
 import pbnh
+import pbnh.db
 
 
 def test_create_app_check_db(app):
@@ -12,6 +13,14 @@ def test_create_app_check_db(app):
     assert pbnh.create_app(app.config, check_db=True)
 
 
+def test_create_app_check_db_outdated(app, caplog):
+    """Passing check_db to create_app warns if the DB needs to be upgraded."""
+    with app.app_context():
+        list(pbnh.db.downgrade_db(to=0))
+    assert pbnh.create_app(app.config, check_db=True)
+    assert any("flask db upgrade" in record.message for record in caplog.records)
+
+
 def test_create_app_check_db_fails(override_config, monkeypatch):
     """Passing check_db to create_app fails if the DB is not initialized."""
 
@@ -26,6 +35,23 @@ def test_create_app_check_db_fails(override_config, monkeypatch):
         pbnh.create_app(override_config, check_db=True)
 
 
+def test_create_app_check_db_uninitialized(app, monkeypatch, caplog):
+    """Passing check_db to create_app retries if the DB has no tables."""
+
+    class _TestDBCheckFailedError(Exception):
+        pass
+
+    def _fake_sleep(*args, **kwargs):
+        raise _TestDBCheckFailedError
+
+    with app.app_context():
+        pbnh.db.undo_db()
+    monkeypatch.setattr(pbnh.time, "sleep", _fake_sleep)
+    with pytest.raises(_TestDBCheckFailedError):
+        pbnh.create_app(app.config, check_db=True)
+    assert any("not initialized" in record.message for record in caplog.records)
+
+
 def test_config_nondebug(override_config):
     """Setting DEBUG in config enables debug logging."""
     override_config["DEBUG"] = True
@@ -0,0 +1,59 @@
+import pytest
+
+from pbnh import lines
+
+
+@pytest.fixture(params=[1, 2, 1024])
+def checkpoint_lines(request, monkeypatch):
+    monkeypatch.setattr(lines, "CHECKPOINT_LINES", request.param)
+    return request.param
+
+
+@pytest.mark.parametrize(
+    "data,count", [(b"", 0), (b"\n", 1), (b"a", 1), (b"a\nb", 2), (b"a\nb\n", 2)]
+)
+def test_build_index_count(data, count):
+    assert lines.build_index(data)["count"] == count
+
+
+@pytest.mark.parametrize(
+    "spec,start,end",
+    [
+        ("2-3", 2, 3),
+        ("3", 3, 5),
+        ("3-", 3, 5),
+        ("-2", 4, 5),
+        ("-3--2", 3, 4),
+        ("4-100", 4, 5),
+        ("-100-2", 1, 2),
+        ("6-7", 6, 5),
+    ],
+)
+def test_slice_lines(checkpoint_lines, spec, start, end):
+    data = b"1\n2\n3\n4\n5\n"
+    index = lines.build_index(data)
+    assert lines.parse_range(spec, count=index["count"]) == (start, end)
+    expected = "".join(f"{line}\n" for line in range(start, end + 1)).encode()
+    assert lines.slice_lines(data, index, start=start, end=end) == expected
+    if start <= end:
+        base, stop = lines.window(index, start=start, end=end)
+        sliced = lines.slice_lines(
+            data[base:stop], index, start=start, end=end, base=base
+        )
+        assert sliced == expected
+
+
+def test_slice_lines_unterminated(checkpoint_lines):
+    data = b"1\n2\n3"
+    index = lines.build_index(data)
+    assert lines.slice_lines(data, index, start=2, end=3) == b"2\n3"
+    base, stop = lines.window(index, start=2, end=3)
+    assert lines.slice_lines(data[base:stop], index, start=2, end=3, base=base) == (
+        b"2\n3"
+    )
+
+
+@pytest.mark.parametrize("spec", ["", "a-b", "1-2-3", "0", "1-0", "1:2"])
+def test_parse_range_invalid(spec):
+    with pytest.raises(ValueError):
+        lines.parse_range(spec, count=10)
@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+import werkzeug.serving
+
+import pbnh
+from pbnh import bloom, ingest, loadtest, render, tier
+
+
+@pytest.fixture
+def server(app):
+    """Serve the app over HTTP (in a thread)."""
+    server = werkzeug.serving.make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_run(app):
+    mix = {**loadtest.MIX_DEFAULT, "rst": 0}
+    with app.app_context(), loadtest.local_app() as local_app:
+        report = loadtest.run(
+            lambda: loadtest.app_request(local_app),
+            mix=mix,
+            duration=0.5,
+            concurrency=2,
+            count=2,
+            sizes=(10, 100),
+        )
+    assert report["requests"] == sum(
+        endpoint["requests"] for endpoint in report["endpoints"].values()
+    )
+    assert report["errors"] == 0
+    assert report["endpoints"].keys() == mix.keys() - {"rst"}
+    latencies = report["endpoints"]["raw"]["latency_ms"]
+    assert latencies["p50"] <= latencies["p95"] <= latencies["p99"]
+
+
+def test_run_url(server):
+    report = loadtest.run(
+        lambda: loadtest.url_request(server + "/"),
+        mix={"raw": 1, "missing": 1},
+        duration=0,
+        count=1,
+    )
+    assert report["endpoints"]["raw"] == {
+        "requests": 0,
+        "errors": 0,
+        "throughput": 0,
+        "latency_ms": {"p50": None, "p95": None, "p99": None},
+    }
+
+
+def test_run_errors(app):
+    """Failed requests and unexpected statuses are counted as errors."""
+    requests = []
+
+    def _new_request():
+        if not requests:
+            requests.append(loadtest.app_request(app))
+        else:
+            requests.append(loadtest.url_request("http://127.0.0.1:1"))
+        return requests[-1]
+
+    app.config["IP_QUOTA_COUNT"] = 4  # pastes (as seeded)
+    report = loadtest.run(
+        _new_request, mix={"create": 1}, duration=0.1, concurrency=1, count=1
+    )
+    assert report["errors"] == report["requests"] > 0
+    with pytest.raises(RuntimeError, match="status 429"):
+        loadtest.seed(loadtest.app_request(app), count=1)
+
+
+@pytest.mark.parametrize("mix", [{"bogus": 1}, {"raw": 0}])
+def test_run_invalid(mix):
+    with pytest.raises(ValueError):
+        loadtest.run(lambda: None, mix=mix)
+
+
+def test_url_request_https():
+    with pytest.raises(OSError):
+        loadtest.url_request("https://127.0.0.1:1")("GET", "/", {}, None)
+
+
+def test_local_app(app, tmp_path):
+    app.config.update(
+        {
+            "RENDER_WORKERS": 1,
+            "WRITE_BEHIND": "journal",
+            "WRITE_BEHIND_JOURNAL": str(tmp_path),
+            "PASTE_FILTER_BYTES": 1024,
+            "CACHE_URL": f"file://{tmp_path}/cache",
+            "CDN_PURGE_URL": "https://cdn.example.com/{hashid}",
+            "PACK_TIER_INTERVAL": 3600,
+            **{key: str(tmp_path / key) for key in loadtest._SHARED_DIRS},
+        }
+    )
+    with app.app_context(), loadtest.local_app() as local_app:
+        with local_app.app_context():
+            writer = ingest.writer()
+            render_pool = render.pool()
+            paste_filter = bloom.paste_filter()
+            assert tier.scheduler() is None
+        assert local_app.config["WRITE_BEHIND_JOURNAL"] != str(tmp_path)
+        assert not local_app.config.keys() & set(loadtest._SHARED_CONFIG)
+        for key in loadtest._SHARED_DIRS:
+            assert not local_app.config[key].startswith(str(tmp_path))
+    assert not paste_filter._thread.is_alive()
+    # Nothing was left in the current app's directories.
+    assert not any(tmp_path.iterdir())
+    with pytest.raises(pbnh.db.PasteDBError):
+        writer.submit(b"abc")
+    with pytest.raises(render.RenderError):
+        render_pool.publish("abc", source_path="abc", parser="restructuredtext")
+
+
+def test_local_app_scheduler(app, monkeypatch, tmp_path):
+    monkeypatch.setattr(loadtest, "_SHARED_CONFIG", ())
+    app.config.update({"PACK_DIR": str(tmp_path), "PACK_TIER_INTERVAL": 3600})
+    with app.app_context(), loadtest.local_app() as local_app:
+        with local_app.app_context():
+            scheduler = tier.scheduler()
+    assert not scheduler._thread.is_alive()
+
+
+def test_local_app_failure(app, monkeypatch):
+    monkeypatch.setattr(pbnh, "create_app", lambda config: None)
+    with app.app_context(), pytest.raises(RuntimeError):
+        with loadtest.local_app():
+            pass
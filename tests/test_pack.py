@@ -0,0 +1,217 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+import pbnh
+from pbnh import pack
+
+TIMESTAMP = datetime(2026, 1, 2, 3, 4, 5)
+
+
+def _paste(data, **metadata):
+    return {
+        "hashid": hashlib.sha1(data).hexdigest(),
+        "ip": None,
+        "mime": "text/plain",
+        "sunset": None,
+        "timestamp": TIMESTAMP,
+        "size": len(data),
+        **metadata,
+        "data": data,
+    }
+
+
+@pytest.fixture
+def packs(tmp_path):
+    return pack.Packs(str(tmp_path / "packs"))
+
+
+def _write(packs, *pastes):
+    with packs.writer() as writer:
+        for paste in pastes:
+            writer.add(paste)
+    return writer.name
+
+
+def test_query(packs):
+    data = os.urandom(1000) + b"a" * 100000
+    paste = _paste(data, ip="1.2.3.4", sunset=TIMESTAMP + timedelta(days=1))
+    _write(packs, paste, _paste(b"other"), paste)
+    assert packs.query(paste["hashid"]) == paste
+    assert packs.query(paste["hashid"], max_data=len(data)) == paste
+    del paste["data"]
+    assert packs.query(paste["hashid"], max_data=len(data) - 1) == paste
+    assert paste["hashid"] in packs
+    for hashid in (hashlib.sha1(b"missing").hexdigest(), "f" * 40, "about"):
+        assert packs.query(hashid) is None
+        assert hashid not in packs
+    assert sorted(packs.hashids()) == sorted(
+        [paste["hashid"], hashlib.sha1(b"other").hexdigest()]
+    )
+
+
+@pytest.mark.parametrize(
+    "start,stop", [(0, None), (0, 0), (5, 100), (1000, 1010), (99990, 200000)]
+)
+def test_read(packs, start, stop):
+    data = os.urandom(1000) + b"a" * 100000
+    hashid = _paste(data)["hashid"]
+    _write(packs, _paste(data))
+    chunks = list(packs.read(hashid, chunk_size=1024, start=start, stop=stop))
+    assert all(len(chunk) <= 1024 for chunk in chunks)
+    assert b"".join(chunks) == data[start:stop]
+    assert list(packs.read("f" * 40)) == []
+
+
+def test_scan(packs, tmp_path):
+    pastes = sorted((_paste(bytes([i])) for i in range(5)), key=lambda p: p["hashid"])
+    _write(packs, *pastes[:3])
+    name = _write(packs, *pastes[2:])
+    hashids = [paste["hashid"] for paste in pastes]
+    assert packs.scan(limit=4) == pastes[:4]
+    assert packs.scan(after=hashids[1], through=hashids[3]) == pastes[2:4]
+    assert packs.scan(after=hashids[4]) == []
+    # Data that can't be decompressed is missing.
+    path = tmp_path / "packs" / f"{name}.pack"
+    path.write_bytes(path.read_bytes()[:-1] + b"x")
+    assert pack.Packs(str(tmp_path / "packs")).scan(after=hashids[3]) == [
+        {**pastes[4], "data": None}
+    ]
+
+
+def test_newest_first(packs, tmp_path):
+    old = _paste(b"a", mime="text/x-old")
+    _write(packs, old)
+    new = _paste(b"a", mime="text/x-new")
+    _write(packs, new)
+    assert packs.query(old["hashid"])["mime"] == "text/x-new"
+    assert [paste["mime"] for paste in packs.entries()] == ["text/x-new"]
+    assert list(packs.hashids()) == [old["hashid"]] * 2
+
+
+def test_writer_empty(packs, tmp_path):
+    _write(packs)
+    with pytest.raises(RuntimeError), packs.writer() as writer:
+        writer.add(_paste(b"a"))
+        raise RuntimeError
+    assert os.listdir(tmp_path / "packs") == []
+    assert packs.stats() == {"packs": 0, "bytes": 0}
+
+
+def test_remove(packs, tmp_path):
+    a, b = _paste(b"a"), _paste(b"b")
+    first = _write(packs, a, b)
+    _write(packs, a)
+    assert packs.remove(a["hashid"], pack=first) == {
+        key: value for key, value in a.items() if key != "data"
+    }
+    # The newer pack still has it.
+    assert packs.query(a["hashid"]) == a
+    assert packs.remove(a["hashid"])
+    assert a["hashid"] not in packs
+    assert packs.remove(a["hashid"]) is None
+    assert packs.remove("about") is None
+    # A removal that was cut off is ignored.
+    with (tmp_path / "packs" / f"{first}.removed").open("ab") as removed:
+        removed.write(bytes.fromhex(b["hashid"])[:10])
+    assert packs.query(b["hashid"]) == b
+    assert list(packs.hashids()) == [b["hashid"]]
+
+
+def test_repack(packs, tmp_path):
+    expired = _paste(b"expired", sunset=TIMESTAMP)
+    unexpired = _paste(b"unexpired", sunset=TIMESTAMP + timedelta(seconds=1))
+    removed = _paste(b"removed", sunset=TIMESTAMP)
+    _write(packs, expired, _paste(b"a"), removed)
+    _write(packs, _paste(b"a"), unexpired, removed)
+    packs.remove(removed["hashid"])
+    size = packs.stats()["bytes"]
+    kept, expired_pastes = packs.repack(expired_before=TIMESTAMP)
+    assert kept == 2
+    assert expired_pastes == [
+        {key: value for key, value in expired.items() if key != "data"}
+    ]
+    assert packs.stats()["packs"] == 1
+    assert packs.stats()["bytes"] < size
+    assert packs.query(unexpired["hashid"]) == unexpired
+    assert packs.query(_paste(b"a")["hashid"]) == _paste(b"a")
+    assert expired["hashid"] not in packs
+    assert removed["hashid"] not in packs
+    assert sorted(path.suffix for path in (tmp_path / "packs").iterdir()) == [
+        ".idx",
+        ".lock",
+        ".lock",
+        ".pack",
+    ]
+    assert packs.repack(expired_before=TIMESTAMP + timedelta(days=1)) == (
+        1,
+        [{key: value for key, value in unexpired.items() if key != "data"}],
+    )
+    # Nothing is left (once everything is removed).
+    packs.remove(_paste(b"a")["hashid"])
+    assert packs.repack(expired_before=TIMESTAMP) == (0, [])
+    assert packs.stats() == {"packs": 0, "bytes": 0}
+    assert packs.repack(expired_before=TIMESTAMP) == (0, [])
+
+
+def test_repack_concurrent_remove(packs, monkeypatch):
+    """Pastes removed during a repack stay removed (and aren't expired)."""
+    pastes = [_paste(b"a"), _paste(b"b", sunset=TIMESTAMP), _paste(b"c")]
+    _write(packs, *pastes)
+    add_record = pack._Writer.add_record
+
+    def _add_record(self, digest, record):
+        for paste in pastes:
+            packs.remove(paste["hashid"])
+        add_record(self, digest, record)
+
+    monkeypatch.setattr(pack._Writer, "add_record", _add_record)
+    assert packs.repack(expired_before=TIMESTAMP) == (0, [])
+    monkeypatch.undo()
+    assert not any(paste["hashid"] in packs for paste in pastes)
+    assert packs.stats()["packs"] == 1  # (until the next repack)
+
+
+def test_repack_fails(packs, monkeypatch, tmp_path):
+    _write(packs, _paste(b"a"))
+    files = sorted(os.listdir(tmp_path / "packs"))
+
+    def _add_record(self, digest, record):
+        raise OSError
+
+    monkeypatch.setattr(pack._Writer, "add_record", _add_record)
+    with pytest.raises(OSError):
+        packs.repack(expired_before=TIMESTAMP)
+    assert sorted(os.listdir(tmp_path / "packs")) == [*files, "repack.lock"]
+    assert _paste(b"a")["hashid"] in packs
+
+
+def test_corrupt(packs, tmp_path):
+    name = _write(packs, _paste(b"a"))
+    (tmp_path / "packs" / f"{name}.idx").write_bytes(b"garbage")
+    with pytest.raises(pack.PackError, match="is not a pack index"):
+        pack.Packs(str(tmp_path / "packs")).query(_paste(b"a")["hashid"])
+
+
+def test_removed_since_listed(packs, tmp_path):
+    """Packs that are removed (e.g. by a repack) while they are opened are skipped."""
+    name = _write(packs, _paste(b"a"))
+    (tmp_path / "packs" / f"{name}.pack").unlink()
+    assert _paste(b"a")["hashid"] not in packs
+
+
+def test_locked(packs):
+    with packs.locked("test") as acquired:
+        assert acquired
+        with packs.locked("test", blocking=False) as acquired_again:
+            assert not acquired_again
+
+
+def test_init_app(tmp_path):
+    app = pbnh.create_app({"PACK_DIR": str(tmp_path), "PACK_LEVEL": 1})
+    with app.app_context():
+        assert pack.packs().stats() == {"packs": 0, "bytes": 0}
+    with pbnh.create_app({}).app_context():
+        assert pack.packs() is None
@@ -0,0 +1,104 @@
+import multiprocessing
+import threading
+
+import pytest
+
+from pbnh import render
+
+
+@pytest.fixture
+def pool():
+    """Start a render pool (and stop it)."""
+    pools = []
+
+    def _pool(**kwargs):
+        new_pool = render.Pool(workers=1, **kwargs)
+        pools.append(new_pool)
+        return new_pool
+
+    yield _pool
+    for old_pool in pools:
+        old_pool.close()
+
+
+def test_pool(pool):
+    render_pool = pool()
+    html = render_pool.publish(
+        "*abc*", source_path="abc.rst", parser="restructuredtext"
+    )
+    assert b"<em>abc</em>" in html
+    with pytest.raises(ImportError):
+        render_pool.publish("abc", source_path="abc", parser="nonexistent")
+    assert render_pool.stats() == {
+        "workers": 1,
+        "active": 0,
+        "completed": 1,
+        "failed": 1,
+        "timed_out": 0,
+        "replaced": 0,
+        "unavailable": 0,
+    }
+    render_pool.close()
+    with pytest.raises(render.RenderError):
+        render_pool.publish("abc", source_path="abc", parser="restructuredtext")
+    assert render_pool.stats()["unavailable"] == 1
+
+
+def test_pool_timeout(pool):
+    """Renders that run out of time are killed (and their workers replaced)."""
+    render_pool = pool(timeout=0.5)
+    (worker,) = render_pool._started
+    with pytest.raises(render.RenderTimeout, match="did not finish"):
+        render_pool.publish(
+            "*abc*\n\n" * 100000, source_path="abc", parser="restructuredtext"
+        )
+    assert not worker.process.is_alive()
+    render_pool._timeout = 60
+    html = render_pool.publish("*abc*", source_path="abc", parser="restructuredtext")
+    assert b"<em>abc</em>" in html
+    stats = render_pool.stats()
+    assert (stats["timed_out"], stats["replaced"], stats["completed"]) == (1, 1, 1)
+
+
+def test_pool_busy(pool):
+    """Renders time out while they wait for a free worker too."""
+    render_pool = pool(timeout=0.01)
+    worker = render_pool._idle.get()
+    with pytest.raises(render.RenderTimeout, match="No render process"):
+        render_pool.publish("abc", source_path="abc", parser="restructuredtext")
+    render_pool._idle.put(worker)
+    assert render_pool.stats()["timed_out"] == 1
+
+
+def test_pool_worker_died(pool):
+    render_pool = pool()
+    (worker,) = render_pool._started
+    worker.process.kill()
+    worker.process.join()
+    with pytest.raises(render.RenderError, match="died"):
+        render_pool.publish("abc", source_path="abc", parser="restructuredtext")
+    html = render_pool.publish("*abc*", source_path="abc", parser="restructuredtext")
+    assert b"<em>abc</em>" in html
+    stats = render_pool.stats()
+    assert (stats["failed"], stats["replaced"], stats["completed"]) == (1, 1, 1)
+    # Workers aren't replaced once the pool is closed.
+    render_pool.close()
+    render_pool._replace(worker)
+    assert not render_pool._started
+
+
+def test_work():
+    """Workers render requests until the pool closes their connection."""
+    connection, child = multiprocessing.Pipe()
+    thread = threading.Thread(target=render._work, args=(child,))
+    thread.start()
+    connection.send(("*abc*", {"source_path": "abc", "parser": "restructuredtext"}))
+    kind, html = connection.recv()
+    assert kind == "html"
+    assert b"<em>abc</em>" in html
+    connection.send(("abc", {"source_path": "abc", "parser": "nonexistent"}))
+    kind, exc = connection.recv()
+    assert kind == "error"
+    assert isinstance(exc, ImportError)
+    connection.close()
+    thread.join()
@@ -0,0 +1,46 @@
+import hashlib
+
+import pytest
+
+import pbnh.db
+from pbnh import scrub
+
+
+def _paste(data, **kwargs):
+    return {
+        "hashid": hashlib.sha1(data, usedforsecurity=False).hexdigest(),
+        "mime": "text/plain",
+        "size": len(data),
+        "data": data,
+        **kwargs,
+    }
+
+
+@pytest.mark.parametrize(
+    "paste,mime,problems",
+    [
+        (_paste(b"abc"), True, []),
+        (_paste(b"abc", size=None), False, []),
+        (_paste(b"abc", mime="text/markdown"), True, []),
+        (_paste(b"abc", hashid="0" * 40), False, ["the data hashes to"]),
+        (_paste(b"abc", size=4), False, ["the size is 4"]),
+        (_paste(b"abc", mime="image/png"), False, []),
+        (_paste(b"abc", mime="image/png"), True, ["the MIME type is image/png"]),
+        ({**_paste(b"abc"), "data": None}, False, ["the data is missing"]),
+    ],
+)
+def test_check(paste, mime, problems):
+    found = scrub.check(paste, mime=mime)
+    assert len(found) == len(problems)
+    for problem, expected in zip(found, problems):
+        assert problem.startswith(expected)
+
+
+def test_scrub(app):
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashids = sorted(paster.create(f"{i}".encode()) for i in range(5))
+        pages = list(
+            scrub.scrub(after=hashids[0], through=hashids[3], batch_size=2, jobs=1)
+        )
+    assert pages == [(hashids[2], 2, []), (hashids[3], 1, [])]
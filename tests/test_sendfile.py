@@ -0,0 +1,52 @@
+import os
+from datetime import datetime
+
+import pytest
+
+import pbnh
+from pbnh import sendfile
+
+HASHID = "a9993e364706816aba3e25717850c26c9cd0d89d"
+
+
+@pytest.fixture
+def files(tmp_path):
+    return sendfile.Files(str(tmp_path / "files"), prefix="/_pastes/")
+
+
+def test_materialize(files, tmp_path):
+    timestamp = datetime(2026, 1, 2, 3, 4, 5)
+    files.materialize(HASHID, [b"a", b"bc"], timestamp=timestamp)
+    path = tmp_path / "files" / "a9" / HASHID
+    assert path.read_bytes() == b"abc"
+    assert os.stat(path).st_mtime == 1767323045
+    # Materialized files aren't rewritten (or read from the chunks again).
+    files.materialize(HASHID, iter(()), timestamp=timestamp)
+    assert path.read_bytes() == b"abc"
+    # (A write may have been interrupted.)
+    path.with_suffix(".1-2").touch()
+    assert list(files.hashids()) == [HASHID]
+    assert files.headers(HASHID) == {"X-Accel-Redirect": f"/_pastes/a9/{HASHID}"}
+    assert files.remove(HASHID)
+    assert not files.remove(HASHID)
+    assert not files.remove("../a9")
+
+
+def test_x_sendfile(tmp_path):
+    files = sendfile.Files(str(tmp_path), header="X-Sendfile")
+    assert files.headers(HASHID) == {"X-Sendfile": f"{tmp_path}/a9/{HASHID}"}
+
+
+@pytest.mark.parametrize("hashid,servable", [(HASHID, True), ("about", False)])
+def test_servable(hashid, servable):
+    assert sendfile.Files.servable(hashid) is servable
+
+
+def test_init_app(tmp_path):
+    app = pbnh.create_app(
+        {"SENDFILE_DIR": str(tmp_path), "SENDFILE_HEADER": "X-Sendfile"}
+    )
+    with app.app_context():
+        assert sendfile.files().headers(HASHID)["X-Sendfile"].startswith(str(tmp_path))
+    with pytest.raises(ValueError, match="is not a supported SENDFILE_HEADER"):
+        pbnh.create_app({"SENDFILE_DIR": str(tmp_path), "SENDFILE_HEADER": "X-Other"})
@@ -0,0 +1,76 @@
+import logging
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import pbnh
+import pbnh.db
+from pbnh import pack, tier
+
+
+@pytest.fixture
+def packs(app, tmp_path):
+    packs = pack.Packs(str(tmp_path / "packs"))
+    app.extensions[pack.EXTENSION] = packs
+    return packs
+
+
+def test_scheduler(app, packs, caplog):
+    with app.app_context(), pbnh.db.paster_context() as paster:
+        old = paster.create(b"old", timestamp=datetime.now() - timedelta(days=2))
+        new = paster.create(b"new")
+    caplog.set_level(logging.INFO)
+    scheduler = tier.Scheduler(app, interval=0.01, after=1, limit=1)
+    deadline = time.monotonic() + 10
+    while old not in packs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.close()
+    assert old in packs
+    assert new not in packs
+    assert "1 pastes were moved to packs." in caplog.text
+
+
+def test_scheduler_locked(app, packs):
+    """Pastes aren't moved while another worker is moving them."""
+    with app.app_context(), pbnh.db.paster_context() as paster:
+        old = paster.create(b"old", timestamp=datetime.now() - timedelta(days=2))
+    scheduler = tier.Scheduler(app, interval=3600, after=1)
+    with app.app_context():
+        with packs.locked("tier"):
+            assert scheduler.tier() == 0
+        assert scheduler.tier() == 1
+    scheduler.close()
+    assert old in packs
+
+
+def test_scheduler_idle(app, monkeypatch, caplog):
+    """Nothing is logged when there is nothing to move."""
+    caplog.set_level(logging.INFO)
+    runs = []
+    monkeypatch.setattr(tier.Scheduler, "tier", lambda self: runs.append(1) or 0)
+    scheduler = tier.Scheduler(app, interval=0.01)
+    deadline = time.monotonic() + 10
+    while not runs and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.close()
+    assert runs
+    assert "moved" not in caplog.text
+
+
+def test_scheduler_fails(app, caplog):
+    scheduler = tier.Scheduler(app, interval=0.01)
+    deadline = time.monotonic() + 10
+    while "were not moved" not in caplog.text and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.close()
+    assert "PACK_DIR is not set" in caplog.text
+
+
+def test_init_app(override_config, tmp_path):
+    app = pbnh.create_app(
+        {**override_config, "PACK_DIR": str(tmp_path), "PACK_TIER_INTERVAL": 3600}
+    )
+    scheduler = app.extensions[tier.EXTENSION]
+    scheduler.close()
+    assert tier.EXTENSION not in pbnh.create_app(override_config).extensions
@@ -0,0 +1,48 @@
+import json
+import logging
+
+import pytest
+
+
+def _phases(response):
+    return {
+        entry.split(";")[0]: float(entry.split(";dur=")[1])
+        for entry in response.headers["Server-Timing"].split(", ")
+    }
+
+
+def test_server_timing(app, caplog):
+    app.config["SERVER_TIMING"] = True
+    client = app.test_client()
+    with caplog.at_level(logging.INFO, logger=app.logger.name):
+        response = client.post("/", data={"content": "abc"})
+    assert _phases(response).keys() == {
+        "quota",
+        "open",
+        "hash",
+        "magic",
+        "create",
+        "total",
+    }
+    (record,) = [
+        record for record in caplog.records if record.getMessage().startswith("{")
+    ]
+    line = json.loads(record.getMessage())
+    assert line["endpoint"] == "views.create_paste"
+    assert line["status"] == 201
+    assert line["phases_ms"].keys() == _phases(response).keys() - {"total"}
+    assert line["duration_ms"] >= max(line["phases_ms"].values())
+    hashid = response.json["hashid"]
+    response = client.get(f"/{hashid}")
+    assert _phases(response).keys() == {"open", "query", "etag", "render", "total"}
+    response = client.get(
+        f"/{hashid}", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+    assert "render" not in _phases(response)
+
+
+@pytest.mark.parametrize("path", ["/", "/about"])
+def test_server_timing_disabled(app, path):
+    response = app.test_client().get(path)
+    assert "Server-Timing" not in response.headers
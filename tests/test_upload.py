@@ -0,0 +1,146 @@
+import hashlib
+import io
+import os
+import time
+from datetime import datetime
+
+import pytest
+
+from pbnh import upload
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return upload.Uploads(str(tmp_path / "uploads"), ttl=60)
+
+
+@pytest.mark.parametrize(
+    "ranges,start,stop,merged",
+    [
+        ([], 0, 2, [[0, 2]]),
+        ([[0, 2]], 2, 4, [[0, 4]]),
+        ([[4, 6]], 0, 2, [[0, 2], [4, 6]]),
+        ([[0, 2], [4, 6]], 1, 5, [[0, 6]]),
+        ([[0, 6]], 2, 4, [[0, 6]]),
+    ],
+)
+def test_merge(ranges, start, stop, merged):
+    assert upload._merge(ranges, start, stop) == merged
+
+
+def test_upload(uploads):
+    sunset = datetime(2030, 1, 2, 3, 4, 5)
+    upload_id = uploads.create(size=6, mime="text/plain", sunset=sunset, ip="::1")
+    progress = uploads.write(upload_id, start=3, stop=6, stream=io.BytesIO(b"def"))
+    assert progress == {"id": upload_id, "size": 6, "received": 3, "ranges": [[3, 6]]}
+    with pytest.raises(upload.UploadIncomplete, match="3 of 6 bytes"):
+        with uploads.open(upload_id):
+            pass
+    # Chunks can be retried (and overlap).
+    for start, stop, chunk in [(0, 2, b"ab"), (0, 2, b"ab"), (1, 4, b"bcd")]:
+        uploads.write(upload_id, start=start, stop=stop, stream=io.BytesIO(chunk))
+    assert uploads.progress(upload_id)["ranges"] == [[0, 6]]
+    with uploads.open(upload_id) as (data_file, kwargs):
+        assert data_file.read() == b"abcdef"
+    assert kwargs == {
+        "mime": "text/plain",
+        "sunset": sunset,
+        "ip": "::1",
+        "hashid": hashlib.sha1(b"abcdef").hexdigest(),
+    }
+    assert uploads.remove(upload_id)
+    assert not uploads.remove(upload_id)
+    with pytest.raises(upload.UploadNotFound):
+        uploads.progress(upload_id)
+
+
+def test_upload_large_chunk(uploads, monkeypatch):
+    monkeypatch.setattr(upload, "_BLOCK_SIZE", 2)
+    upload_id = uploads.create(size=5)
+    uploads.write(upload_id, start=0, stop=5, stream=io.BytesIO(b"abcde"), size=5)
+    with uploads.open(upload_id) as (data_file, kwargs):
+        assert data_file.read() == b"abcde"
+    assert kwargs == {
+        "mime": None,
+        "sunset": None,
+        "ip": None,
+        "hashid": hashlib.sha1(b"abcde").hexdigest(),
+    }
+
+
+def test_upload_hash(uploads, tmp_path, monkeypatch):
+    """The received prefix is hashed as chunks arrive (by each worker)."""
+    upload_id = uploads.create(size=6)
+    for start, stop, hashed in [(2, 4, None), (0, 2, 4), (5, 6, 4), (4, 5, 6)]:
+        chunk = b"abcdef"[start:stop]
+        uploads.write(upload_id, start=start, stop=stop, stream=io.BytesIO(chunk))
+        assert uploads._hashes.get(upload_id, (None,))[0] == hashed
+    hashid = hashlib.sha1(b"abcdef").hexdigest()
+    # The hash isn't redone when the upload is finished.
+    monkeypatch.setattr(upload, "_BLOCK_SIZE", 0)
+    with uploads.open(upload_id) as (_, kwargs):
+        assert kwargs["hashid"] == hashid
+    monkeypatch.undo()
+    # Other workers hash it from the start.
+    other = upload.Uploads(str(tmp_path / "uploads"))
+    with other.open(upload_id) as (_, kwargs):
+        assert kwargs["hashid"] == hashid
+    # Hashes are forgotten with their uploads (even if another worker removed them).
+    uploads.clean()
+    assert uploads._hashes.keys() == {upload_id}
+    uploads.remove(upload_id)
+    assert uploads._hashes == {}
+    other.clean()
+    assert other._hashes == {}
+
+
+@pytest.mark.parametrize(
+    "start,stop,size,chunk,message",
+    [
+        (0, 2, 4, b"ab", "The upload is 3 bytes"),
+        (2, 4, None, b"cd", "outside of the upload"),
+        (0, 2, 3, b"a", "1 bytes shorter"),
+    ],
+)
+def test_upload_invalid_chunk(uploads, start, stop, size, chunk, message):
+    upload_id = uploads.create(size=3)
+    with pytest.raises(upload.UploadError, match=message):
+        uploads.write(
+            upload_id, start=start, stop=stop, stream=io.BytesIO(chunk), size=size
+        )
+    assert uploads.progress(upload_id)["received"] == 0
+
+
+@pytest.mark.parametrize("upload_id", ["../uploads", "0" * 32])
+def test_upload_not_found(uploads, upload_id):
+    with pytest.raises(upload.UploadNotFound):
+        uploads.write(upload_id, start=0, stop=1, stream=io.BytesIO(b"a"))
+
+
+def test_upload_removed_while_writing(uploads):
+    upload_id = uploads.create(size=1)
+    os.unlink(uploads._paths(upload_id)[1])
+    with pytest.raises(upload.UploadNotFound):
+        uploads.write(upload_id, start=0, stop=1, stream=io.BytesIO(b"a"))
+
+
+def test_clean(uploads):
+    stale, active = uploads.create(size=1), uploads.create(size=1)
+    past = time.time() - 61
+    # Only requests (which update the state file) keep uploads active.
+    state_path, data_path = uploads._paths(active)
+    os.utime(data_path, (past, past))
+    # (An upload may have been interrupted while it was created.)
+    orphan_path = uploads._directory / f"{'f' * 32}.tmp"
+    for path in [*uploads._paths(stale), orphan_path]:
+        path.touch()
+        os.utime(path, (past, past))
+    assert uploads.clean() == 1
+    assert {path.name for path in uploads._directory.iterdir()} == {
+        state_path.name,
+        data_path.name,
+    }
+    # Creating an upload cleans up too.
+    os.utime(state_path, (past, past))
+    new = uploads.create(size=1)
+    assert [path.stem for path in uploads._directory.iterdir()] == [new, new]
@@ -1,12 +1,16 @@
+import base64
 import contextlib
 import hashlib
 import json
+import zipfile
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
 
 import pytest
 
 import pbnh
-from pbnh import views
+import pbnh.db
+from pbnh import asciicast, bloom, cache, ingest, lines, pack, render, sendfile, views
 
 
 @pytest.fixture(params=["content", "c"])
@@ -115,6 +119,13 @@ def test_follow_redirect(redirect_key, test_client, mode):
     assert response.location == url
 
 
+def test_redirect_undecodable(app, test_client):
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            hashid = paster.create(b"\xff", mime=views.REDIRECT_MIME)
+    assert test_client.get(f"/{hashid}").status_code == 422
+
+
 def test_redirect_with_extension(redirect_key, test_client):
     url = "localhost:12345"
     hashid = hashlib.sha1(url.encode("utf-8"), usedforsecurity=False).hexdigest()
@@ -169,6 +180,168 @@ def test_restructuredtext_with_extension(content_key, test_client):
     assert response.status_code == 200
 
 
+@pytest.fixture
+def render_app(app):
+    """Create an app that renders markup in worker processes (and clean it up)."""
+    new_app = pbnh.create_app({**app.config, "RENDER_WORKERS": 1})
+    yield new_app
+    with new_app.app_context():
+        render.pool().close()
+
+
+def test_restructuredtext_pool(content_key, render_app):
+    test_client = render_app.test_client()
+    response = test_client.post("/", data={content_key: "abc", "mime": "text/x-rst"})
+    hashid = response.json["hashid"]
+    assert test_client.get(f"/{hashid}").status_code == 200
+    response = test_client.get("/stats/render")
+    assert response.json["completed"] == 1
+    with render_app.app_context():
+        render.pool().close()
+    assert test_client.get(f"/{hashid}").status_code == 503
+
+
+def test_restructuredtext_too_large(app, content_key, test_client):
+    app.config["RENDER_MAX_BYTES"] = 2
+    response = test_client.post("/", data={content_key: "abc", "mime": "text/x-rst"})
+    hashid = response.json["hashid"]
+    assert test_client.get(f"/{hashid}").status_code == 413
+    # Raw pastes are not rendered.
+    assert test_client.get(f"/{hashid}.rst").status_code == 200
+
+
+def test_paste_cached(app, monkeypatch, test_client, tmp_path):
+    app.extensions[cache.EXTENSION] = cache.FileCache(directory=str(tmp_path))
+    response = test_client.post("/", data={"content": "abc", "mime": "text/x-rst"})
+    hashid = response.json["hashid"]
+    assert test_client.get(f"/{hashid}").status_code == 200
+    # Cached pastes (and renders) are served without the DB (or docutils).
+    monkeypatch.setattr("pbnh.render.publish", None)
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            paster.delete(hashid=hashid)
+    monkeypatch.setattr(pbnh.db, "paster_context", None)
+    assert b"<p>abc</p>" in test_client.get(f"/{hashid}").data
+    assert test_client.get(f"/{hashid}.txt").data == b"abc"
+    monkeypatch.undo()
+    with app.app_context():
+        cache.delete_paste(hashid)
+    assert test_client.get(f"/{hashid}").status_code == 404
+
+
+@pytest.fixture
+def upload_client(app, tmp_path):
+    """Create a test client for an app that stages uploads."""
+    return pbnh.create_app({**app.config, "UPLOAD_DIR": str(tmp_path)}).test_client()
+
+
+def _put_chunk(client, upload_id, start, chunk, size=6):
+    content_range = f"bytes {start}-{start + len(chunk) - 1}/{size}"
+    return client.put(
+        f"/uploads/{upload_id}", data=chunk, headers={"Content-Range": content_range}
+    )
+
+
+def test_upload(upload_client):
+    response = upload_client.post(
+        "/uploads", data={"size": 6, "mime": "text/plain", "sunset": 3600}
+    )
+    assert response.status_code == 201
+    upload_id = response.json["id"]
+    assert response.json["link"].endswith(f"/uploads/{upload_id}")
+    response = _put_chunk(upload_client, upload_id, 3, b"def")
+    assert response.json["received"] == 3
+    response = upload_client.post(f"/uploads/{upload_id}")
+    assert response.status_code == 409
+    response = _put_chunk(upload_client, upload_id, 0, b"abc")
+    assert response.json["ranges"] == [[0, 6]]
+    assert upload_client.get(f"/uploads/{upload_id}").json["received"] == 6
+    response = upload_client.post(f"/uploads/{upload_id}")
+    assert response.status_code == 201
+    hashid = response.json["hashid"]
+    assert hashid == hashlib.sha1(b"abcdef").hexdigest()
+    assert response.json["link"].endswith(f"/{hashid}")
+    response = upload_client.get(f"/{hashid}/raw")
+    assert (response.data, response.mimetype) == (b"abcdef", "text/plain")
+    assert response.expires
+    assert upload_client.get(f"/uploads/{upload_id}").status_code == 404
+    # Uploads of existing pastes are finished too.
+    upload_id = upload_client.post("/uploads", data={"size": 6}).json["id"]
+    _put_chunk(upload_client, upload_id, 0, b"abcdef")
+    response = upload_client.post(f"/uploads/{upload_id}")
+    assert (response.status_code, response.json["hashid"]) == (200, hashid)
+
+
+def test_upload_streamed(app, tmp_path, monkeypatch):
+    """Uploads are streamed into the DB (and not journaled, since they're staged)."""
+    monkeypatch.setattr(pbnh.db, "_STREAM_CHUNK_SIZE", 4)
+    app = pbnh.create_app(
+        {
+            **app.config,
+            "UPLOAD_DIR": str(tmp_path / "uploads"),
+            "WRITE_BEHIND": "journal",
+            "WRITE_BEHIND_JOURNAL": str(tmp_path / "journal"),
+            "WRITE_BEHIND_BATCH_DELAY": 60,
+        }
+    )
+    test_client = app.test_client()
+    try:
+        upload_id = test_client.post("/uploads", data={"size": 6}).json["id"]
+        _put_chunk(test_client, upload_id, 0, b"abcdef")
+        response = test_client.post(f"/uploads/{upload_id}")
+        assert response.status_code == 201
+        with app.app_context(), pbnh.db.paster_context() as paster:
+            paste = paster.query(hashid=response.json["hashid"])
+        assert paste["data"] == b"abcdef"
+    finally:
+        with app.app_context():
+            ingest.writer().close()
+
+
+@pytest.mark.parametrize(
+    "data",
+    [{}, {"size": "x"}, {"size": 0}, {"size": 2**30 + 1}, {"size": 1, "sunset": 0}],
+)
+def test_upload_invalid(upload_client, data):
+    assert upload_client.post("/uploads", data=data).status_code == 400
+
+
+def test_upload_quota(app, upload_client):
+    upload_client.application.config["IP_QUOTA_BYTES"] = 5
+    assert upload_client.post("/uploads", data={"size": 6}).status_code == 429
+
+
+@pytest.mark.parametrize(
+    "headers,upload_id,status",
+    [
+        ({}, None, 400),
+        ({"Content-Range": "bytes */6"}, None, 400),
+        ({"Content-Range": "bytes 4-6/6"}, None, 400),
+        ({"Content-Range": "bytes 0-2/6"}, "0" * 32, 404),
+    ],
+)
+def test_write_upload_invalid(upload_client, headers, upload_id, status):
+    if upload_id is None:
+        upload_id = upload_client.post("/uploads", data={"size": 6}).json["id"]
+    response = upload_client.put(f"/uploads/{upload_id}", data=b"abc", headers=headers)
+    assert response.status_code == status
+
+
+def test_remove_upload(upload_client):
+    upload_id = upload_client.post("/uploads", data={"size": 6}).json["id"]
+    assert upload_client.delete(f"/uploads/{upload_id}").status_code == 204
+    assert upload_client.delete(f"/uploads/{upload_id}").status_code == 404
+    assert upload_client.get(f"/uploads/{upload_id}").status_code == 404
+
+
+def test_uploads_disabled(test_client):
+    assert test_client.post("/uploads", data={"size": 6}).status_code == 404
+
+
+def test_render_stats_disabled(test_client):
+    assert test_client.get("/stats/render").status_code == 404
+
+
 def test_bad_mode(content_key, test_client):
     response = test_client.post("/", data={content_key: "abc"})
     j = json.loads(response.data.decode("utf-8"))
@@ -360,6 +533,170 @@ def test_get_raw_content_length(content_key, test_client):
     assert "Content-Length" in response.headers
 
 
+@pytest.mark.parametrize("content", ["abcdefghij", "abcdefgh", "abc"])
+def test_get_raw_streamed(app, content_key, test_client, content, monkeypatch):
+    """Raw pastes larger than a chunk are streamed."""
+    app.config["STREAM_CHUNK_SIZE"] = 4
+    chunks = []
+    read = pbnh.db._Paster.read
+
+    def _read(self, **kwargs):
+        for chunk in read(self, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+
+    monkeypatch.setattr(pbnh.db._Paster, "read", _read)
+    response = test_client.post("/", data={content_key: content})
+    hashid = response.json["hashid"]
+    with test_client.get(f"/{hashid}.txt") as response:
+        assert response.headers["Content-Length"] == str(len(content))
+        assert response.data == content.encode()
+    assert len(chunks) == (len(content) + 3) // 4 if len(content) > 4 else not chunks
+    # (A single line's window is all of the data.)
+    response = test_client.get(f"/{hashid}.txt", query_string={"lines": "1"})
+    assert response.data == content.encode()
+
+
+@pytest.mark.parametrize("content", ["abcdefghij", "abc"])
+def test_get_raw_sendfile(app, content_key, test_client, content, tmp_path):
+    """Raw pastes are served by the proxy (if SENDFILE_DIR is set)."""
+    app.config["STREAM_CHUNK_SIZE"] = 4
+    app.extensions[sendfile.EXTENSION] = sendfile.Files(
+        str(tmp_path), prefix="/_pastes/"
+    )
+    hashid = test_client.post("/", data={content_key: content}).json["hashid"]
+    for _ in range(2):
+        response = test_client.get(f"/{hashid}.txt")
+        assert response.headers["X-Accel-Redirect"] == f"/_pastes/{hashid[:2]}/{hashid}"
+        assert response.content_type == "text/plain; charset=utf-8"
+        assert response.headers["ETag"]
+        assert not response.data
+    assert (tmp_path / hashid[:2] / hashid).read_bytes() == content.encode()
+    # Slices (and the about page) are still served by pbnh.
+    response = test_client.get(f"/{hashid}.txt", query_string={"lines": "1"})
+    assert response.data == content.encode()
+    assert "X-Accel-Redirect" not in test_client.get("/about.md").headers
+
+
+def test_get_packed(app, test_client, tmp_path):
+    """Pastes that were moved into packs are still served (and streamed)."""
+    app.config["STREAM_CHUNK_SIZE"] = 4
+    app.extensions[pack.EXTENSION] = pack.Packs(str(tmp_path / "packs"))
+    hashid = test_client.post("/", data={"content": "abcdefghij\nk"}).json["hashid"]
+    with app.app_context(), pbnh.db.paster_context() as paster:
+        paster.tier(before=datetime.now() + timedelta(days=1))
+        assert hashid in pack.packs()
+    assert test_client.get(f"/{hashid}.txt").data == b"abcdefghij\nk"
+    response = test_client.get(f"/{hashid}.txt", query_string={"lines": "2"})
+    assert response.data == b"k"
+
+
+def test_paste_filter(app, monkeypatch):
+    other_client = app.test_client()
+    assert other_client.get("/stats/filter").status_code == 404
+    app = pbnh.create_app(
+        {**app.config, "PASTE_FILTER_BYTES": 1024, "PASTE_FILTER_REFRESH": 3600}
+    )
+    with app.app_context():
+        paste_filter = bloom.paste_filter()
+    assert paste_filter.wait(10)
+    test_client = app.test_client()
+    # Pastes created by this worker are found right away.
+    hashid = test_client.post("/", data={"content": "abc"}).json["hashid"]
+    assert test_client.post("/", data={"content": "abc"}).status_code == 200
+    assert test_client.get(f"/{hashid}").status_code == 200
+    assert test_client.get("/about").status_code == 200
+    paste_filter.add("0" * 40)
+    assert test_client.get(f"/{'0' * 40}").status_code == 404
+    # Pastes created by other workers are found right away too.
+    other_hashid = other_client.post("/", data={"content": "def"}).json["hashid"]
+    assert test_client.get(f"/{other_hashid}").status_code == 200
+    # Definite misses don't fetch pastes.
+    monkeypatch.setattr(pbnh.db._Paster, "query", None)
+    monkeypatch.setattr(pbnh.db._Paster, "query_metadata", None)
+    for path in ["/wp-login.php", f"/{'1' * 40}", f"/{'1' * 40}.txt"]:
+        assert test_client.get(path).status_code == 404
+    stats = test_client.get("/stats/filter").json
+    assert (stats["negatives"], stats["false_positives"]) == (3, 1)
+    paste_filter.close()
+
+
+@pytest.fixture
+def archive_hashid(test_client):
+    data = BytesIO()
+    with zipfile.ZipFile(data, "w") as zip_file:
+        zip_file.writestr("a.txt", b"abc" * 100, compress_type=zipfile.ZIP_DEFLATED)
+        zip_file.writestr("dir/b.txt", b"abcdefgh")
+        zip_file.writestr("c.bin", b"abc", compress_type=zipfile.ZIP_BZIP2)
+    data.seek(0)
+    return test_client.post("/", data={"content": (data, "a.zip")}).json["hashid"]
+
+
+@pytest.mark.parametrize("stream_chunk_size", [4, None])
+def test_get_archive_member(app, test_client, archive_hashid, stream_chunk_size):
+    if stream_chunk_size:
+        app.config["STREAM_CHUNK_SIZE"] = stream_chunk_size
+    response = test_client.get(f"/{archive_hashid}.zip/members")
+    assert response.json == {
+        "format": "zip",
+        "members": [
+            {"name": "a.txt", "size": 300},
+            {"name": "dir/b.txt", "size": 8},
+            {"name": "c.bin", "size": 3},
+        ],
+    }
+    response = test_client.get(f"/{archive_hashid}.zip/a.txt")
+    assert response.data == b"abc" * 100
+    assert response.content_type == "text/plain; charset=utf-8"
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert "immutable" in response.headers["Cache-Control"]
+    etag = response.headers["ETag"]
+    response = test_client.get(
+        f"/{archive_hashid}.zip/a.txt", headers={"If-None-Match": etag}
+    )
+    assert response.status_code == 304
+    response = test_client.get(
+        f"/{archive_hashid}.zip/dir/b.txt", headers={"Range": "bytes=2-4"}
+    )
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == "bytes 2-4/8"
+    assert response.data == b"cde"
+    assert response.headers["ETag"] != etag
+    # A Range is ignored if the member changed (which it can't, but still).
+    response = test_client.get(
+        f"/{archive_hashid}.zip/dir/b.txt",
+        headers={"Range": "bytes=2-4", "If-Range": etag},
+    )
+    assert (response.status_code, response.data) == (200, b"abcdefgh")
+    response = test_client.get(
+        f"/{archive_hashid}.zip/dir/b.txt", headers={"Range": "bytes=10-"}
+    )
+    assert response.status_code == 416
+    assert response.headers["Content-Range"] == "bytes */8"
+    # Modes take precedence over members.
+    response = test_client.get(f"/{archive_hashid}.zip/raw")
+    assert response.data.startswith(b"PK")
+
+
+@pytest.mark.parametrize(
+    "path,status",
+    [
+        (".zip/missing.txt", 404),
+        (".zip/dir/missing.txt", 404),
+        (".zip/c.bin", 422),
+    ],
+)
+def test_get_archive_member_error(test_client, archive_hashid, path, status):
+    assert test_client.get(f"/{archive_hashid}{path}").status_code == status
+
+
+def test_get_archive_members_invalid(test_client):
+    hashid = test_client.post("/", data={"content": "abc"}).json["hashid"]
+    response = test_client.get(f"/{hashid}/members")
+    assert response.status_code == 422
+    assert test_client.get(f"/{hashid}.tar/a.txt").status_code == 422
+
+
 def test_get_extension_unknown(content_key, test_client):
     response = test_client.post("/", data={content_key: "abc"})
     hashid = response.json["hashid"]
@@ -388,3 +725,399 @@ def test_get_etag(content_key, test_client, extension, mode):
     assert response.status_code == 304
     response = test_client.get(path, headers={"If-None-Match": "invalid"})
     assert response.status_code == 200
+
+
+def test_get_cache_headers_raw(content_key, test_client):
+    """Raw pastes are cacheable forever."""
+    response = test_client.post("/", data={content_key: "abc"})
+    hashid = response.json["hashid"]
+    response = test_client.get(f"/{hashid}.txt")
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == 31536000
+    assert response.expires > datetime.now(timezone.utc) + timedelta(days=364)
+    assert response.last_modified
+    assert hashid in response.headers["Surrogate-Key"].split()
+    response = test_client.get(
+        f"/{hashid}.txt", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+    assert response.cache_control.immutable
+
+
+def test_get_cache_headers_sunset(content_key, test_client):
+    """Caching does not outlive a paste."""
+    response = test_client.post("/", data={content_key: "abc", "sunset": "60"})
+    hashid = response.json["hashid"]
+    response = test_client.get(f"/{hashid}.txt")
+    assert response.cache_control.max_age <= 60
+    assert response.expires <= datetime.now(timezone.utc) + timedelta(seconds=61)
+
+
+@pytest.mark.parametrize("mode", ["md", "text"])
+def test_get_cache_headers_rendered(app, content_key, test_client, mode):
+    """Rendered pastes are revalidated unless configured otherwise."""
+    response = test_client.post("/", data={content_key: "abc"})
+    hashid = response.json["hashid"]
+    response = test_client.get(f"/{hashid}/{mode}")
+    assert response.cache_control.no_cache
+    assert response.expires is None
+    app.config["CACHE_CONTROL"] = {mode: "public, max-age=60"}
+    response = test_client.get(f"/{hashid}/{mode}")
+    assert response.cache_control.max_age == 60
+    assert f"mode/{mode}" in response.headers["Surrogate-Key"].split()
+
+
+def test_get_cache_headers_about(test_client):
+    response = test_client.get("/about.md")
+    assert response.cache_control.no_cache
+    assert "Surrogate-Key" not in response.headers
+
+
+def test_batch(app, content_key, test_client):
+    hashids = [
+        test_client.post("/", data={content_key: text}).json["hashid"]
+        for text in ["abc", "def"]
+    ]
+    with app.app_context():
+        with pbnh.db.paster_context() as paster:
+            expired = paster.create(
+                b"expired", sunset=datetime.now(timezone.utc) - timedelta(seconds=1)
+            )
+    app.config["BATCH_CHUNK_SIZE"] = 2
+    requested = [hashids[1], "nonexistent", hashids[0], expired, hashids[1]]
+    response = test_client.post("/batch", json={"hashids": requested})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    items = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [item["hashid"] for item in items] == requested
+    assert [item["status"] for item in items] == [200, 404, 200, 404, 200]
+    assert base64.b64decode(items[2]["data"]) == b"abc"
+    assert items[2]["mime"] == "text/plain"
+    assert items[2]["sunset"] is None
+
+
+@pytest.mark.parametrize(
+    "body", [None, [], {"hashids": "abc"}, {"hashids": [1]}, {"hashids": ["a"] * 3}]
+)
+def test_batch_bad_request(app, test_client, body):
+    app.config["BATCH_MAX_HASHIDS"] = 2
+    response = test_client.post("/batch", json=body)
+    assert response.status_code == 400
+
+
+@pytest.fixture
+def asciicast_hashid(test_client):
+    events = [[time / 2, "o", f"event {time}"] for time in range(1, 11)]
+    cast = "\n".join(json.dumps(line) for line in [{"version": 2}, *events])
+    response = test_client.post(
+        "/", data={"content": cast, "mime": "application/x-asciicast"}
+    )
+    return response.json["hashid"]
+
+
+@pytest.mark.parametrize("suffix", [".cast", ".json"])
+def test_get_asciicast_time_range(test_client, asciicast_hashid, suffix):
+    for _ in range(2):  # The index is built and then reused.
+        response = test_client.get(
+            f"/{asciicast_hashid}{suffix}", query_string={"start": 1, "end": "2"}
+        )
+        assert response.status_code == 200
+        events = [json.loads(line) for line in response.data.splitlines()[1:]]
+        assert [event[0] for event in events] == [0.0, 0.5, 1.0]
+
+
+def test_get_asciicast_time_range_window(app, test_client, monkeypatch):
+    """Only the header and the events around the range are read."""
+    app.config["STREAM_CHUNK_SIZE"] = 4
+    monkeypatch.setattr(asciicast, "CHECKPOINT_BYTES", 1)
+    events = [[time / 2, "o", f"event {time}"] for time in range(1, 11)]
+    cast = "\n".join(json.dumps(line) for line in [{"version": 2}, *events])
+    response = test_client.post(
+        "/", data={"content": cast, "mime": "application/x-asciicast"}
+    )
+    hashid = response.json["hashid"]
+    test_client.get(f"/{hashid}.cast?start=0")
+    reads = []
+    read = pbnh.db._Paster.read
+
+    def _read(self, **kwargs):
+        reads.append((kwargs["start"], kwargs["stop"]))
+        return read(self, **kwargs)
+
+    monkeypatch.setattr(pbnh.db._Paster, "query", None)
+    monkeypatch.setattr(pbnh.db._Paster, "read", _read)
+    response = test_client.get(f"/{hashid}.cast", query_string={"start": 1, "end": "2"})
+    events = [json.loads(line) for line in response.data.splitlines()[1:]]
+    assert [event[2] for event in events] == ["event 2", "event 3", "event 4"]
+    # (The header is 15 bytes, and the events are 22 bytes each.)
+    assert reads == [(0, 15), (37, 103)]
+
+
+def test_get_asciicast_time_range_invalid(test_client, asciicast_hashid):
+    response = test_client.get(f"/{asciicast_hashid}.cast?start=soon")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf"])
+def test_get_asciicast_time_range_not_finite(test_client, asciicast_hashid, value):
+    for key in ["start", "end"]:
+        response = test_client.get(
+            f"/{asciicast_hashid}.cast", query_string={key: value}
+        )
+        assert response.status_code == 400
+
+
+def test_get_asciicast_time_range_guessed_mime(content_key, test_client):
+    """Asciicasts stored as text are trimmed if the extension is .cast."""
+    events = [[time, "o", f"event {time}"] for time in range(1, 4)]
+    cast = "\n".join(json.dumps(line) for line in [{"version": 2}, *events])
+    response = test_client.post("/", data={content_key: cast})
+    hashid = response.json["hashid"]
+    response = test_client.get(f"/{hashid}.cast", query_string={"start": 2})
+    assert len(response.data.splitlines()) == 3
+    assert response.mimetype == "application/x-asciicast"
+
+
+def test_get_asciicast_time_range_not_asciicast(test_client):
+    response = test_client.post(
+        "/", data={"content": "abc", "mime": "application/x-asciicast"}
+    )
+    response = test_client.get(f"/{response.json['hashid']}.cast?start=1")
+    assert response.status_code == 422
+
+
+def test_get_asciicast_time_range_ignored(content_key, test_client):
+    """Time ranges only apply to asciicasts."""
+    response = test_client.post("/", data={content_key: "abc"})
+    response = test_client.get(f"/{response.json['hashid']}.txt?start=1")
+    assert response.data == b"abc"
+
+
+def test_render_asciicast_time_range(test_client, asciicast_hashid):
+    response = test_client.get(f"/{asciicast_hashid}/cast?start=1&speed=2")
+    assert response.status_code == 200
+    assert f"/{asciicast_hashid}.cast?start=1".encode() in response.data
+
+
+@pytest.mark.parametrize(
+    "spec,data,line_range",
+    [
+        ("2-3", b"2\n3\n", "lines 2-3/5"),
+        ("-1", b"5\n", "lines 5-5/5"),
+        ("9", b"", "lines */5"),
+    ],
+)
+def test_get_lines(content_key, test_client, spec, data, line_range):
+    response = test_client.post("/", data={content_key: "1\n2\n3\n4\n5\n"})
+    hashid = response.json["hashid"]
+    for _ in range(2):  # The index is built and then reused.
+        response = test_client.get(f"/{hashid}.txt", query_string={"lines": spec})
+        assert response.status_code == 200
+        assert response.data == data
+        assert response.headers["X-Line-Range"] == line_range
+
+
+@pytest.mark.parametrize("path", ["/{hashid}.txt", "/{hashid}/raw"])
+def test_get_lines_window(app, test_client, monkeypatch, path):
+    """Only the window around the lines is read (once the index is built)."""
+    app.config["STREAM_CHUNK_SIZE"] = 4
+    monkeypatch.setattr(lines, "CHECKPOINT_LINES", 2)
+    content = "".join(f"{line}\n" for line in range(1, 10))
+    hashid = test_client.post("/", data={"content": content}).json["hashid"]
+    path = path.format(hashid=hashid)
+    test_client.get(path, query_string={"lines": "1"})
+    reads = []
+    read = pbnh.db._Paster.read
+
+    def _read(self, **kwargs):
+        reads.append((kwargs["start"], kwargs["stop"]))
+        return read(self, **kwargs)
+
+    monkeypatch.setattr(pbnh.db._Paster, "query", None)
+    monkeypatch.setattr(pbnh.db._Paster, "read", _read)
+    response = test_client.get(path, query_string={"lines": "5-6"})
+    assert response.data == b"5\n6\n"
+    assert response.headers["X-Line-Range"] == "lines 5-6/9"
+    response = test_client.get(path, query_string={"lines": "9-"})
+    assert response.data == b"9\n"
+    response = test_client.get(path, query_string={"lines": "10"})
+    assert response.data == b""
+    assert reads == [(8, 16), (16, None)]
+
+
+def test_get_lines_about(test_client):
+    response = test_client.get("/about.md?lines=1")
+    assert response.data.startswith(b"# About\n")
+
+
+def test_get_lines_invalid(content_key, test_client):
+    response = test_client.post("/", data={content_key: "abc"})
+    response = test_client.get(f"/{response.json['hashid']}.txt?lines=0")
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize(
+    "quota,statuses",
+    [
+        ({"IP_QUOTA_COUNT": 2}, [201, 201, 429]),
+        ({"IP_QUOTA_BYTES": 7}, [201, 201, 429]),
+        ({"IP_QUOTA_BYTES": 7, "IP_QUOTA_DAYS": 1}, [201, 201, 429]),
+        ({"IP_QUOTA_BYTES": 5}, [201, 429, 201]),
+    ],
+)
+def test_paste_quota(app, content_key, test_client, quota, statuses):
+    app.config.update(quota)
+    for status, content in zip(statuses, ["abc", "defg", "h"]):
+        response = test_client.post("/", data={content_key: content})
+        assert response.status_code == status
+    # Other IPs are unaffected.
+    response = test_client.post(
+        "/", data={content_key: "i"}, environ_base={"REMOTE_ADDR": "10.0.0.1"}
+    )
+    assert response.status_code == 201
+
+
+def test_paste_quota_date(app, content_key, test_client):
+    """Quotas can't be bypassed by sending a Date header."""
+    app.config.update({"IP_QUOTA_COUNT": 1, "IP_QUOTA_DAYS": 1})
+    for status, content in [(201, "abc"), (429, "defg")]:
+        response = test_client.post(
+            "/",
+            data={content_key: content},
+            headers={"Date": "Wed, 01 Jan 2031 00:00:00 GMT"},
+        )
+        assert response.status_code == status
+
+
+def test_paste_write_behind(app, content_key, tmp_path):
+    """Pastes that have not been written yet are served (by the same worker)."""
+    app = pbnh.create_app(
+        {
+            **app.config,
+            "WRITE_BEHIND": "journal",
+            "WRITE_BEHIND_JOURNAL": str(tmp_path),
+            "WRITE_BEHIND_BATCH_DELAY": 60,
+        }
+    )
+    test_client = app.test_client()
+    try:
+        response = test_client.post("/", data={content_key: "abc"})
+        assert response.status_code == 201
+        hashid = response.json["hashid"]
+        assert test_client.get(f"/{hashid}.txt").data == b"abc"
+        response = test_client.post("/batch", json={"hashids": [hashid]})
+        assert json.loads(response.data)["status"] == 200
+    finally:
+        with app.app_context():
+            ingest.writer().close()
+
+
+def test_paste_write_behind_cached(app, tmp_path):
+    """Pending pastes with a sunset are rendered (and cached until then)."""
+    app = pbnh.create_app(
+        {
+            **app.config,
+            "CACHE_URL": "memory://",
+            "WRITE_BEHIND": "journal",
+            "WRITE_BEHIND_JOURNAL": str(tmp_path),
+            "WRITE_BEHIND_BATCH_DELAY": 60,
+        }
+    )
+    test_client = app.test_client()
+    try:
+        response = test_client.post(
+            "/", data={"content": "# abc", "mime": "text/markdown", "sunset": "60"}
+        )
+        hashid = response.json["hashid"]
+        for _ in range(2):
+            response = test_client.get(f"/{hashid}")
+            assert response.status_code == 200
+            assert b"<h1" in response.data
+    finally:
+        with app.app_context():
+            ingest.writer().close()
+
+
+@pytest.mark.parametrize("limit", ["0", "-1"])
+def test_search_limit_invalid(app, test_client, limit):
+    app.config["SEARCH_INDEX"] = True
+    response = test_client.get("/search", query_string={"q": "x", "limit": limit})
+    assert response.status_code == 400
+
+
+def test_search(app, content_key, test_client):
+    app.config["SEARCH_INDEX"] = True
+    hashids = [
+        test_client.post("/", data={content_key: f"{i} found"}).json["hashid"]
+        for i in range(3)
+    ]
+    response = test_client.get("/search", query_string={"q": "found", "limit": 2})
+    assert [result["hashid"] for result in response.json["results"]] == [
+        hashids[2],
+        hashids[1],
+    ]
+    assert response.json["results"][0]["link"].endswith(f"/{hashids[2]}")
+    response = test_client.get(
+        "/search", query_string={"q": "found", "before": response.json["next"]}
+    )
+    assert [result["hashid"] for result in response.json["results"]] == [hashids[0]]
+    assert response.json["next"] is None
+
+
+@pytest.mark.parametrize("query_string", ["", "q=+", "q=a&limit=x", "q=a&before=x"])
+def test_search_invalid(app, test_client, query_string):
+    app.config["SEARCH_INDEX"] = True
+    assert test_client.get(f"/search?{query_string}").status_code == 400
+
+
+def test_search_disabled(test_client):
+    assert test_client.get("/search?q=a").status_code == 404
+
+
+ADMIN_HEADERS = {"Authorization": "Bearer secret"}
+
+
+def test_list_pastes(app, test_client):
+    app.config["ADMIN_TOKEN"] = "secret"
+    hashids = [
+        test_client.post("/", data={"content": "a" * (i + 1)}).json["hashid"]
+        for i in range(3)
+    ]
+    response = test_client.get(
+        "/admin/pastes", query_string={"limit": 2}, headers=ADMIN_HEADERS
+    )
+    assert [paste["hashid"] for paste in response.json["pastes"]] == [
+        hashids[2],
+        hashids[1],
+    ]
+    assert response.json["pastes"][0]["link"].endswith(f"/{hashids[2]}")
+    response = test_client.get(
+        "/admin/pastes",
+        query_string={"before": response.json["next"]},
+        headers=ADMIN_HEADERS,
+    )
+    assert [paste["hashid"] for paste in response.json["pastes"]] == [hashids[0]]
+    assert response.json["next"] is None
+    response = test_client.get(
+        "/admin/pastes",
+        query_string={"mime": "text/plain", "min_size": 2, "max_size": 2},
+        headers=ADMIN_HEADERS,
+    )
+    assert [paste["hashid"] for paste in response.json["pastes"]] == [hashids[1]]
+
+
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer wrong"}])
+def test_list_pastes_unauthorized(app, test_client, headers):
+    app.config["ADMIN_TOKEN"] = "secret"
+    assert test_client.get("/admin/pastes", headers=headers).status_code == 401
+
+
+@pytest.mark.parametrize("query_string", ["limit=x", "limit=0", "before=x"])
+def test_list_pastes_invalid(app, test_client, query_string):
+    app.config["ADMIN_TOKEN"] = "secret"
+    response = test_client.get(f"/admin/pastes?{query_string}", headers=ADMIN_HEADERS)
+    assert response.status_code == 400
+
+
+def test_list_pastes_disabled(test_client):
+    assert test_client.get("/admin/pastes", headers=ADMIN_HEADERS).status_code == 404